@@ -1,5 +1,32 @@
 from typing import List, Dict, Any
 
+# One canvas element as the planning prompts describe it; which fields apply depends on type
+CANVAS_ELEMENT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'type': {'type': 'string'},
+        'content': {'type': 'string'},
+        'style': {'type': 'string'},
+        'fontSize': {'type': 'number'},
+        'color': {'type': 'string'},
+        'stroke': {'type': 'string'},
+        'fill': {'type': 'string'},
+        'strokeWidth': {'type': 'number'},
+        'width': {'type': 'number'},
+        'height': {'type': 'number'},
+        'x': {'type': 'number'},
+        'y': {'type': 'number'},
+        'x1': {'type': 'number'},
+        'y1': {'type': 'number'},
+        'x2': {'type': 'number'},
+        'y2': {'type': 'number'},
+        'cx': {'type': 'number'},
+        'cy': {'type': 'number'},
+        'r': {'type': 'number'},
+    },
+    'required': ['type'],
+}
+
 class ClientSideCanvasGenerator:
     """Generate client-side canvas drawing instructions (FREE)."""
     
@@ -1,17 +1,73 @@
 ﻿# Create: agents/content_agent.py
 from services.gemini_service import FreeGeminiService
-import json
+from services.async_providers import AsyncGeminiService
+from services.structured_output import parse_response
 
 class ContentAnalysisAgent:
     """Agent that identifies key educational components from a topic."""
     
+    # Enforced through Gemini's JSON mode and checked again locally
+    RESPONSE_SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'main_concept': {'type': 'string'},
+            'visual_elements': {'type': 'array', 'items': {
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string'},
+                    'type': {'type': 'string'},
+                    'importance': {'type': 'string'},
+                    'description': {'type': 'string'},
+                },
+                'required': ['name'],
+            }},
+            'relationships': {'type': 'array', 'items': {
+                'type': 'object',
+                'properties': {
+                    'from': {'type': 'string'},
+                    'to': {'type': 'string'},
+                    'type': {'type': 'string'},
+                    'label': {'type': 'string'},
+                },
+                'required': ['from', 'to'],
+            }},
+            'educational_goal': {'type': 'string'},
+            'complexity_level': {'type': 'string'},
+            'diagram_type': {'type': 'string'},
+        },
+        # Only what downstream stages cannot default; the prompt still asks for every property
+        'required': ['main_concept', 'visual_elements', 'relationships'],
+    }
+    
     def __init__(self):
         self.gemini = FreeGeminiService()
+        self.async_gemini = AsyncGeminiService()
     
-    def analyze_topic(self, topic: str) -> dict:
-        """Extract educational elements and relationships."""
-        
-        system_prompt = """You are an educational content expert. Analyze topics and identify key components for visual learning.
+    def analyze_topic(self, topic: str, cancel_token=None, tier: str = None) -> dict:
+        """Extract educational elements and relationships (on the given model tier, if any)."""
+        try:
+            response = self.gemini.generate_response(topic, self._system_prompt(), label='content',
+                                                cancel_token=cancel_token,
+                                                response_schema=self.RESPONSE_SCHEMA, tier=tier)
+            return self._parse_analysis(response, topic)
+        except Exception as e:
+            print(f"Content analysis error: {e}")
+            return self._create_fallback_analysis(topic)
+    
+    async def analyze_topic_async(self, topic: str, cancel_token=None, tier: str = None) -> dict:
+        """analyze_topic() awaiting Gemini on the shared provider loop."""
+        try:
+            response = await self.async_gemini.generate_response(topic, self._system_prompt(), label='content',
+                                                                 cancel_token=cancel_token,
+                                                                 response_schema=self.RESPONSE_SCHEMA, tier=tier)
+            return self._parse_analysis(response, topic)
+        except Exception as e:
+            print(f"Content analysis error: {e}")
+            return self._create_fallback_analysis(topic)
+    
+    @staticmethod
+    def _system_prompt() -> str:
+        return """You are an educational content expert. Analyze topics and identify key components for visual learning.
 
 Your job: Break down the topic into visual elements that need to be shown in an educational diagram.
 
@@ -39,22 +95,10 @@ Now analyze {topic} step-by-step:
 
 Make sure there is only one connection between two distinct elements.
 Focus on elements that NEED to be visually represented. Don't include everything - only what helps learning."""
-
-        try:
-            response = self.gemini.generate_response(topic, system_prompt)
-            # Extract JSON from response
-            start = response.find('{')
-            end = response.rfind('}') + 1
-            if start != -1 and end > start:
-                json_str = response[start:end]
-                return json.loads(json_str)
-            else:
-                # Fallback
-                return self._create_fallback_analysis(topic)
-                
-        except Exception as e:
-            print(f"Content analysis error: {e}")
-            return self._create_fallback_analysis(topic)
+    
+    def _parse_analysis(self, response: str, topic: str) -> dict:
+        analysis = parse_response('content', response, self.RESPONSE_SCHEMA)
+        return analysis if analysis is not None else self._create_fallback_analysis(topic)
     
     def _create_fallback_analysis(self, topic: str) -> dict:
         """Simple fallback when JSON parsing fails."""
@@ -66,5 +110,6 @@ Focus on elements that NEED to be visually represented. Don't include everything
             "relationships": [],
             "educational_goal": f"Understand {topic}",
             "complexity_level": "elementary",
-            "diagram_type": "structure"
+            "diagram_type": "structure",
+            "fallback": True
         }
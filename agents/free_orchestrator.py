@@ -1,20 +1,58 @@
-﻿import json
-from typing import Dict, List, Any, Callable
+﻿import asyncio
+from typing import Dict, List, Any, Awaitable, Callable
 import time
-from concurrent.futures import ThreadPoolExecutor
-import traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 
 from services.gemini_service import FreeGeminiService
 from services.huggingface_service import FreeHuggingFaceService
-from agents.canvas_generator import ClientSideCanvasGenerator
+from agents.canvas_generator import CANVAS_ELEMENT_SCHEMA, ClientSideCanvasGenerator
 from services.perplexity_service import PerplexityService
+from services.cache_service import create_result_cache, normalize_question, stable_hash
+from services.similarity_index import MinHashLSHIndex
+from services.diagram_store import DiagramStore, svg_data_url
+from services.rate_limiter import get_rate_limiter
+from services.latency_tracker import LatencyTracker
+from services.cancellation import CancellationToken, record_calls_avoided
+from services.circuit_breaker import get_breaker
+from services.pipeline import DagExecutor, Stage
+from services.hub_monitor import offload
+from services.model_router import ComplexityRouter
+from services.structured_output import parse_response
+from services.async_providers import AsyncGeminiService, get_provider_loop, run_blocking
+from config import Config
 
 
 from agents.content_agent import ContentAnalysisAgent
 from agents.layout_agent import LayoutDesignAgent  
 from agents.visual_agent import VisualStyleAgent
+from agents.fused_agent import FusedLessonAgent
 from services.svg_renderer_service import SVGEducationalRenderer
 
+# Provider calls each pipeline stage makes when it is not served from cache, in order
+PIPELINE_STAGE_CALLS = (
+    ('plan', {'gemini': 1}),
+    ('content', {'gemini': 1}),
+    ('layout', {'gemini': 1}),
+    ('visual', {'gemini': 1}),
+)
+# The fused stage replaces plan, content, layout and visual with a single call
+FUSED_STAGE_CALLS = {'gemini': 1}
+STAGE_CALLS = dict(PIPELINE_STAGE_CALLS, fused=FUSED_STAGE_CALLS)
+
+# The planning call's answer, enforced through Gemini's JSON mode and checked again locally
+PLAN_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'explanation': {'type': 'string'},
+        'needs_image': {'type': 'boolean'},
+        'visual_type': {'type': 'string'},
+        'image_prompt': {'type': 'string'},
+        'canvas_elements': {'type': 'array', 'items': CANVAS_ELEMENT_SCHEMA},
+    },
+    'required': ['explanation', 'needs_image'],
+}
+
+
 class FreeVisualOrchestrator:
     """Orchestrator using only FREE APIs and client-side rendering."""
     
@@ -24,43 +62,569 @@ class FreeVisualOrchestrator:
         self.perplexity = PerplexityService()  # Add this line
         self.canvas_gen = ClientSideCanvasGenerator()
     
-        # Rate limiting for FREE tiers
-        self.last_gemini_call = 0
-        self.last_hf_call = 0
-        self.last_perplexity_call = 0  # Add this line
-    
-        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.executor = ThreadPoolExecutor(max_workers=Config.PIPELINE_STAGE_THREADS)
+        # Async stages await their provider calls on this shared loop instead of holding a thread
+        self.provider_loop = get_provider_loop() if Config.ASYNC_PROVIDERS else None
+        self.async_gemini = AsyncGeminiService()
+        # Stages of one generation run in parallel wherever their inputs allow
+        self.pipeline = DagExecutor(self.executor, self.provider_loop)
+        # Budgeted provider calls run here, separate from the stage threads that wait on them
+        self.call_executor = ThreadPoolExecutor(max_workers=Config.PIPELINE_STAGE_THREADS)
         self.content_agent = ContentAnalysisAgent()
         self.layout_agent = LayoutDesignAgent()
         self.visual_agent = VisualStyleAgent()
+        self.fused_agent = FusedLessonAgent()
         self.svg_renderer = SVGEducationalRenderer()
+        self.diagram_store = DiagramStore(Config.DIAGRAM_STORE_DIR)
+
+        # Whole-result caches keyed by normalized question
+        self.plan_cache = create_result_cache('plan')
+        self.diagram_cache = create_result_cache('diagram')
+        # Maps differently worded questions onto already cached ones
+        self.question_index = MinHashLSHIndex(
+            threshold=Config.SIMILARITY_THRESHOLD,
+            persist_path=Config.SIMILARITY_INDEX_PATH,
+            max_candidates=Config.SIMILARITY_MAX_CANDIDATES
+        )
+        self.plan_cache.add_eviction_listener(lambda key: self._prune_question_index([key]))
+        self.diagram_cache.add_eviction_listener(lambda key: self._prune_question_index([key]))
+        # Observed latency of real (uncached) work per stage, used for queue ETAs
+        self.stage_latency = LatencyTracker()
+        # Called with (topic, content_analysis) after each fresh analysis, e.g. by the prefetcher
+        self.analysis_listeners: List[Callable[[str, dict], None]] = []
+        # Stages answered locally because their provider's circuit breaker was open
+        self.breaker_fallbacks: Dict[str, int] = {}
+        # Critical path ("plan > layout > visual > render") -> number of runs, and their durations
+        self.critical_paths: Dict[str, int] = {}
+        self.path_latency = LatencyTracker()
+        # Runs and durations per pipeline mode ('staged' / 'fused'), for A/B comparison
+        self.mode_runs: Dict[str, int] = {}
+        self.mode_latency = LatencyTracker()
+        # Per-stage caches so partial hits skip the downstream LLM calls
+        self.stage_caches = {
+            stage: create_result_cache(f'stage_{stage}')
+            for stage in ('content', 'layout', 'visual')
+        }
+        # Picks the light or heavy Gemini tier for plan and content calls
+        self.router = ComplexityRouter(self.stage_caches['content'], self.question_index)
 
-    def generate_educational_diagram(self, topic: str) -> dict:
-        """Generate educational diagram using multi-agent system."""
+    def generate_educational_diagram(self, topic: str, use_cache: bool = True, cancel_token=None,
+                                     deadline=None) -> dict:
+        """Generate educational diagram using multi-agent system.
+
+        With use_cache=False cached results are ignored (but still refreshed).
+        cancel_token is checked before every stage; once it fires, Cancelled is raised
+        and the remaining stages' calls are never made. With a deadline, a stage that
+        overruns its share of the budget is replaced by the agent's fallback output.
+        """
+        
+        cache_key, cached = offload(self._lookup_cached_result, self.diagram_cache, topic, use_cache)
+        if cached:
+            print(f"⚡ Diagram cache hit for: {topic}")
+            return self._publish_diagram(cached)
         
         print(f"🎯 Starting multi-agent diagram generation for: {topic}")
+        result = self.pipeline.run(self._diagram_stages(topic, cache_key, use_cache, cancel_token, deadline))
+        self._record_pipeline(result, 'staged')
+        for stage in ('content', 'layout', 'visual', 'render'):
+            if stage in result.errors:
+                raise result.errors[stage]
+        return result.outputs.get('render')
+
+    def run_lesson_pipeline(self, question: str, cancel_token=None, deadline=None,
+                            on_stage_done: Callable[[str, Any], None] = None, mode: str = 'staged'):
+        """Plan and diagram for a question as one DAG run; returns the PipelineResult.
+
+        Content analysis only needs the question, so it starts alongside the plan.
+        Layout waits for the plan too and is skipped (with everything after it) when
+        the plan needs no image. on_stage_done(stage, output) runs as each stage
+        finishes, so the explanation can be sent while the diagram is still in progress.
+        mode='fused' makes one combined Gemini call instead of four (see _fused_stages);
+        the result has the same stage outputs either way. If any part of the fused answer
+        is unusable, the whole answer is discarded and the staged pipeline runs instead
+        (counted as a 'fused_rejected' run followed by a 'staged' one).
+        """
+        diagram_key, cached_diagram = offload(self._lookup_cached_result, self.diagram_cache, question)
+        needs_image = lambda outputs: bool(outputs['plan'].get('needs_image'))
+        
+        if mode == 'fused' and not cached_diagram:
+            result = self.pipeline.run(self._fused_stages(question, diagram_key, cancel_token, deadline, needs_image),
+                                       on_stage_done)
+            if result.outputs.get('fused') is not None or 'fused' in result.errors:
+                self._record_pipeline(result, mode)
+                return result
+            print("🧩 Fused answer incomplete, running the staged pipeline")
+            self._record_pipeline(result, 'fused_rejected')
+        
+        if self.provider_loop is not None:
+            async def plan():
+                return await self.create_visual_plan_async(question, cancel_token=cancel_token, deadline=deadline)
+        else:
+            def plan():
+                return self.create_visual_plan_free(question, cancel_token=cancel_token, deadline=deadline)
         
-        # Step 1: Content Analysis
-        print("📋 Content Agent analyzing topic...")
-        content_analysis = self.content_agent.analyze_topic(topic)
+        stages = [Stage('plan', plan, calls=dict(PIPELINE_STAGE_CALLS)['plan'])]
+        if cached_diagram:
+            print(f"⚡ Diagram cache hit for: {question}")
+            stages.append(Stage('render', lambda: self._publish_diagram(cached_diagram),
+                                after=('plan',), when=needs_image))
+        else:
+            stages += self._diagram_stages(question, diagram_key, True, cancel_token, deadline,
+                                           gate=('plan', needs_image))
         
-        # Step 2: Layout Design  
-        print("📐 Layout Agent designing spatial arrangement...")
-        layout_plan = self.layout_agent.design_layout(content_analysis)
+        result = self.pipeline.run(stages, on_stage_done)
+        self._record_pipeline(result, 'staged')
+        return result
+
+    def _fused_stages(self, question: str, cache_key: str, cancel_token, deadline,
+                      needs_image: Callable[[Dict[str, Any]], bool]) -> List[Stage]:
+        """One fused call, split into the plan, content, layout and visual outputs, then render.
+
+        Every part the lesson needs is checked like the staged agents' answers. If any
+        fails, the fused stage outputs None and the other stages are skipped, so the
+        caller can rerun the question staged; nothing of a partly bad answer is mixed
+        with fallbacks. Only when the call itself was abandoned (out of budget, or its
+        provider's breaker open) is the lesson built from local fallbacks, since staged
+        calls would not fare better. Accepted parts are written to the same caches the
+        staged pipeline reads, so either mode benefits from the other's work.
+        """
+        fallback = lambda: dict(FusedLessonAgent._split(None), abandoned=True)
         
-        # Step 3: Visual Design
-        print("🎨 Visual Agent choosing colors and shapes...")
-        visual_design = self.visual_agent.design_visuals(content_analysis, layout_plan)
+        def timed(started, parts):
+            self.stage_latency.record('fused', time.time() - started)
+            if parts.get('abandoned') or self._fused_parts_usable(parts):
+                return parts
+            return None
         
-        # Step 4: SVG Rendering
-        print("🖼️ SVG Renderer assembling final diagram...")
-        final_diagram = self.svg_renderer.render_educational_diagram(
-            content_analysis, layout_plan, visual_design
-        )
+        if self.provider_loop is not None:
+            async def fused():
+                print("🧩 Fused agent generating the whole lesson...")
+                started = time.time()
+                return timed(started, await self._arun_cancellable(
+                    'fused', lambda token: self.fused_agent.generate_lesson_async(question, cancel_token=token),
+                    cancel_token, deadline, fallback))
+        else:
+            def fused():
+                print("🧩 Fused agent generating the whole lesson...")
+                started = time.time()
+                return timed(started, self._run_cancellable(
+                    'fused', lambda token: self.fused_agent.generate_lesson(question, cancel_token=token),
+                    cancel_token, deadline, fallback))
+        
+        def plan(fused):
+            if fused['plan'] is None:
+                return self._create_fallback_plan(question)
+            self.plan_cache.set(cache_key, fused['plan'])
+            self.question_index.add(cache_key)
+            return fused['plan']
+        
+        def content(fused):
+            content = fused['content']
+            if not content or not isinstance(content.get('visual_elements'), list):
+                return self.content_agent._create_fallback_analysis(question)
+            self.stage_caches['content'].set(cache_key, content)
+            return content
+        
+        def layout(fused, content):
+            layout = fused['layout']
+            if not self.layout_agent._validate_layout_structure(layout):
+                return self.layout_agent._create_fallback_layout(content)
+            self.stage_caches['layout'].set(stable_hash(content), layout)
+            return layout
+        
+        def visual(fused, content, layout):
+            visual = fused['visual']
+            if not visual or not isinstance(visual.get('visual_elements'), list):
+                return self.visual_agent._create_fallback_visuals(layout)
+            self.stage_caches['visual'].set(stable_hash([content, layout]), visual)
+            return visual
+        
+        return [
+            Stage('fused', fused, calls=FUSED_STAGE_CALLS),
+            Stage('plan', plan, inputs=('fused',), when=lambda outputs: outputs['fused'] is not None),
+            Stage('content', content, inputs=('fused',), after=('plan',), when=needs_image),
+            Stage('layout', layout, inputs=('fused', 'content')),
+            Stage('visual', visual, inputs=('fused', 'content', 'layout')),
+            Stage('render', self._render_stage(cache_key, cancel_token), inputs=('content', 'layout', 'visual')),
+        ]
+
+    def _fused_parts_usable(self, parts: Dict[str, Any]) -> bool:
+        """Whether the plan, and the diagram parts if it needs an image, passed the staged agents' checks."""
+        plan = parts['plan']
+        if plan is None:
+            return False
+        if not plan.get('needs_image'):
+            return True
+        content, layout, visual = parts['content'], parts['layout'], parts['visual']
+        return (bool(content) and isinstance(content.get('visual_elements'), list)
+                and self.layout_agent._validate_layout_structure(layout)
+                and bool(visual) and isinstance(visual.get('visual_elements'), list))
+
+    def _diagram_stages(self, topic: str, cache_key: str, use_cache: bool, cancel_token, deadline,
+                        gate: tuple = None) -> List[Stage]:
+        """Content → layout → visual → render as DAG stages.
+
+        gate is an optional (stage, predicate) that layout must wait for and pass.
+        With async providers, content, layout (including its hedged Gemini/Perplexity
+        race) and visual are coroutines awaited on the provider loop.
+        """
+        calls = dict(PIPELINE_STAGE_CALLS)
+        
+        def notify(content_analysis):
+            if not content_analysis.get('fallback'):
+                for listener in self.analysis_listeners:
+                    try:
+                        listener(topic, content_analysis)
+                    except Exception as e:
+                        print(f"⚠️ Analysis listener failed: {e}")
+            return content_analysis
+        
+        if self.provider_loop is not None:
+            async def content():
+                print("📋 Content Agent analyzing topic...")
+                content_analysis = await self._arun_cached_stage(
+                    'content', cache_key,
+                    lambda token: self._arouted_call(
+                        'content', topic,
+                        lambda tier: self.content_agent.analyze_topic_async(topic, cancel_token=token, tier=tier)),
+                    use_cache, cancel_token, deadline,
+                    fallback=lambda: self.content_agent._create_fallback_analysis(topic)
+                )
+                return await run_blocking(notify, content_analysis)
+            
+            async def layout(content):
+                print("📐 Layout Agent designing spatial arrangement...")
+                return await self._arun_cached_stage(
+                    'layout', stable_hash(content),
+                    lambda token: self.layout_agent.design_layout_async(content, cancel_token=token),
+                    use_cache, cancel_token, deadline,
+                    fallback=lambda: self.layout_agent._create_fallback_layout(content)
+                )
+            
+            async def visual(content, layout):
+                print("🎨 Visual Agent choosing colors and shapes...")
+                return await self._arun_cached_stage(
+                    'visual', stable_hash([content, layout]),
+                    lambda token: self.visual_agent.design_visuals_async(content, layout, cancel_token=token),
+                    use_cache, cancel_token, deadline,
+                    fallback=lambda: self.visual_agent._create_fallback_visuals(layout)
+                )
+        else:
+            def content():
+                print("📋 Content Agent analyzing topic...")
+                return notify(self._run_cached_stage(
+                    'content', cache_key,
+                    lambda token: self._routed_call(
+                        'content', topic,
+                        lambda tier: self.content_agent.analyze_topic(topic, cancel_token=token, tier=tier)),
+                    use_cache, cancel_token, deadline,
+                    fallback=lambda: self.content_agent._create_fallback_analysis(topic)
+                ))
+            
+            def visual(content, layout):
+                print("🎨 Visual Agent choosing colors and shapes...")
+                return self._run_cached_stage(
+                    'visual', stable_hash([content, layout]),
+                    lambda token: self.visual_agent.design_visuals(content, layout, cancel_token=token),
+                    use_cache, cancel_token, deadline,
+                    fallback=lambda: self.visual_agent._create_fallback_visuals(layout)
+                )
+            
+            def layout(content):
+                print("📐 Layout Agent designing spatial arrangement...")
+                return self._run_cached_stage(
+                    'layout', stable_hash(content),
+                    lambda token: self.layout_agent.design_layout(content, cancel_token=token),
+                    use_cache, cancel_token, deadline,
+                    fallback=lambda: self.layout_agent._create_fallback_layout(content)
+                )
+        
+        gate_stage, gate_check = gate if gate else (None, None)
+        return [
+            Stage('content', content, calls=calls['content']),
+            Stage('layout', layout, inputs=('content',), after=(gate_stage,) if gate_stage else (),
+                  when=gate_check, calls=calls['layout']),
+            Stage('visual', visual, inputs=('content', 'layout'), calls=calls['visual']),
+            Stage('render', self._render_stage(cache_key, cancel_token), inputs=('content', 'layout', 'visual')),
+        ]
+
+    def _render_stage(self, cache_key: str, cancel_token) -> Callable[[dict, dict, dict], dict]:
+        """The SVG render stage: publishes the diagram and caches it unless built from fallbacks."""
+        def render(content, layout, visual):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            print("🖼️ SVG Renderer assembling final diagram...")
+            render_started = time.time()
+            final_diagram = self.svg_renderer.render_educational_diagram(content, layout, visual)
+            self.stage_latency.record('render', time.time() - render_started)
+            
+            print("✅ Multi-agent diagram generation complete!")
+            
+            if final_diagram and final_diagram.get('svg_content'):
+                final_diagram = self._publish_diagram(final_diagram)
+                # Diagrams built from fallback stages are served but not cached
+                if not any(stage.get('fallback') for stage in (content, layout, visual)):
+                    self.diagram_cache.set(cache_key, final_diagram)
+                    self.question_index.add(cache_key)
+            return final_diagram
+        return render
+
+    def _record_pipeline(self, result, mode: str):
+        """Log and count the run's critical path: the chain of stages that set its duration."""
+        self.mode_runs[mode] = self.mode_runs.get(mode, 0) + 1
+        self.mode_latency.record(mode, result.duration)
+        path = ' > '.join(result.critical_path())
+        if not path:
+            return
+        print(f"🧭 Critical path: {path} ({result.duration:.1f}s)")
+        self.critical_paths[path] = self.critical_paths.get(path, 0) + 1
+        self.path_latency.record(path, result.duration)
+
+    def pipeline_stats(self) -> Dict[str, Any]:
+        """How often each critical path occurred and how long those runs took."""
+        latency = self.path_latency.stats()
+        return {
+            path: dict(latency.get(path, {}), runs=count)
+            for path, count in self.critical_paths.items()
+        }
+
+    def pipeline_mode_stats(self) -> Dict[str, Any]:
+        """Runs and durations of staged vs fused pipeline runs."""
+        latency = self.mode_latency.stats()
+        return {mode: dict(latency.get(mode, {}), runs=count) for mode, count in self.mode_runs.items()}
+
+    @staticmethod
+    def pick_pipeline_mode(session_id: str, requested: str = None) -> str:
+        """The request's explicit mode, else a stable per-session A/B assignment."""
+        if requested in ('staged', 'fused'):
+            return requested
+        bucket = int(stable_hash(session_id)[:8], 16) / 0xFFFFFFFF
+        return 'fused' if bucket < Config.FUSED_PIPELINE_SHARE else 'staged'
+
+    def _publish_diagram(self, diagram: dict) -> dict:
+        """Make sure the SVG is in the diagram store and attach its URL.
+
+        The SVG stays in the cached result so another worker (sharing the cache but
+        not the store) can republish it. If the store is unwritable, fall back to
+        an inline data URL.
+        """
+        try:
+            digest = self.diagram_store.put(diagram['svg_content'], diagram.get('metadata'))
+            diagram['digest'] = digest
+            diagram['url'] = f"/diagrams/{digest}.svg"
+            diagram.pop('data', None)
+        except OSError as e:
+            print(f"⚠️ Diagram store write failed, sending inline SVG: {e}")
+            diagram['data'] = svg_data_url(diagram['svg_content'])
+        return diagram
+
+    def _lookup_cached_result(self, cache, question: str, use_cache: bool = True) -> tuple:
+        """Look up a question exactly, then via the near-duplicate index.
+
+        Returns the key to store a fresh result under and the cached value, if any.
+        """
+        cache_key = normalize_question(question)
+        if not use_cache:
+            return cache_key, None
+        matches = [(key, similarity) for key, similarity in self.question_index.query(question)
+                   if key != cache_key]
+
+        # Exact and near-duplicate keys are read together in one round trip
+        found = cache.get_many([cache_key] + [key for key, _ in matches])
+        if cache_key in found:
+            return cache_key, found[cache_key]
+        # Candidates whose entries expired (Redis drops keys silently) stop being offered
+        self._prune_question_index([key for key, _ in matches if key not in found])
+        for similar_key, similarity in matches:
+            if similar_key in found:
+                print(f"🔁 Near-duplicate of '{similar_key}' (similarity {similarity:.2f})")
+                return cache_key, found[similar_key]
+        return cache_key, None
+
+    def _prune_question_index(self, keys: List[str]):
+        """Remove keys from the near-duplicate index once neither result cache holds them."""
+        if not keys:
+            return
+        try:
+            present = self.plan_cache.contains_many(keys) | self.diagram_cache.contains_many(keys)
+        except Exception as e:
+            print(f"⚠️ Similarity index pruning failed: {e}")
+            return
+        for key in keys:
+            if key not in present:
+                self.question_index.remove(key)
+
+    def _run_cached_stage(self, stage: str, key: str, compute: Callable[[Any], dict],
+                          use_cache: bool = True, cancel_token=None, deadline=None,
+                          fallback: Callable[[], dict] = None) -> dict:
+        """Return a memoized stage output, computing and storing it on a miss."""
+        cache = self.stage_caches[stage]
+        cached = cache.get(key) if use_cache else None
+        if cached is not None:
+            print(f"⚡ {stage} stage cache hit")
+            return cached
         
-        print("✅ Multi-agent diagram generation complete!")
+        started = time.time()
+        result = self._run_cancellable(stage, compute, cancel_token, deadline, fallback)
+        self.stage_latency.record(stage, time.time() - started)
+        # Fallback outputs are cheap to rebuild and should not mask a later good answer
+        if isinstance(result, dict) and not result.get('fallback'):
+            cache.set(key, result)
+        return result
+
+    def _run_cancellable(self, stage: str, compute: Callable[[Any], Any], cancel_token=None,
+                         deadline=None, fallback: Callable[[], Any] = None):
+        """Run a stage unless cancelled (the pipeline executor counts the calls avoided).
+
+        compute receives the cancellation token to pass on to its provider calls.
+        """
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        if fallback is not None and self._stage_unavailable(stage):
+            return self._breaker_fallback(stage, deadline, fallback)
+        if deadline is None or fallback is None:
+            return compute(cancel_token)
+        return self._run_within_budget(stage, compute, cancel_token, deadline, fallback)
+
+    async def _arun_cached_stage(self, stage: str, key: str, compute: Callable[[Any], Awaitable[dict]],
+                                 use_cache: bool = True, cancel_token=None, deadline=None,
+                                 fallback: Callable[[], dict] = None) -> dict:
+        """_run_cached_stage() for async stages; cache reads and writes run off the loop."""
+        cache = self.stage_caches[stage]
+        cached = await run_blocking(cache.get, key) if use_cache else None
+        if cached is not None:
+            print(f"⚡ {stage} stage cache hit")
+            return cached
         
-        return final_diagram
+        started = time.time()
+        result = await self._arun_cancellable(stage, compute, cancel_token, deadline, fallback)
+        self.stage_latency.record(stage, time.time() - started)
+        if isinstance(result, dict) and not result.get('fallback'):
+            await run_blocking(cache.set, key, result)
+        return result
+
+    async def _arun_cancellable(self, stage: str, compute: Callable[[Any], Awaitable[Any]], cancel_token=None,
+                                deadline=None, fallback: Callable[[], Any] = None):
+        """_run_cancellable() for async stages.
+
+        An overrunning call is cancelled outright rather than left to finish in the
+        background: its request is aborted and any reservation it still holds is released.
+        """
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        if fallback is not None and self._stage_unavailable(stage):
+            return self._breaker_fallback(stage, deadline, fallback)
+        if deadline is None or fallback is None:
+            return await compute(cancel_token)
+        budget = deadline.stage_budget(stage)
+        if budget > 0:
+            try:
+                return await asyncio.wait_for(compute(cancel_token), budget)
+            except asyncio.TimeoutError:
+                pass
+        return self._budget_fallback(stage, deadline, fallback)
+
+    def _breaker_fallback(self, stage: str, deadline, fallback: Callable[[], Any]):
+        # Provider is known to be failing: answer locally instead of waiting on it
+        print(f"🔌 {stage} stage provider unavailable, using fallback")
+        self.breaker_fallbacks[stage] = self.breaker_fallbacks.get(stage, 0) + 1
+        if deadline is not None:
+            deadline.mark_degraded(stage)
+        return fallback()
+
+    @staticmethod
+    def _budget_fallback(stage: str, deadline, fallback: Callable[[], Any]):
+        print(f"⏱️ {stage} stage out of time budget, using fallback")
+        deadline.mark_degraded(stage)
+        return fallback()
+
+    @staticmethod
+    def _stage_unavailable(stage: str) -> bool:
+        """Whether every provider the stage calls has an open circuit breaker."""
+        calls = STAGE_CALLS[stage]
+        return all(get_breaker(provider).is_open() for provider in calls)
+
+    def _run_within_budget(self, stage: str, compute: Callable[[Any], Any], cancel_token,
+                           deadline, fallback: Callable[[], Any]):
+        """Run compute on the executor, degrading to fallback() if it overruns the stage budget.
+
+        The overrunning call gets its own child token, which is cancelled so it stops
+        waiting for (and hands back) rate-limit capacity. The token expires with the
+        budget, so requests already sent to a provider carry a matching SDK timeout and
+        release their executor thread soon after the stage gives up on them.
+        """
+        budget = deadline.stage_budget(stage)
+        if budget > 0:
+            stage_token = CancellationToken(parent=cancel_token, expires_at=time.time() + budget)
+            future = self.call_executor.submit(compute, stage_token)
+            try:
+                return future.result(timeout=budget)
+            except FutureTimeout:
+                stage_token.cancel(f"{stage} stage exceeded its {budget:.1f}s budget")
+        return self._budget_fallback(stage, deadline, fallback)
+
+    def record_cancelled_from(self, stage: str):
+        """Count the provider calls of stage and all later pipeline stages as avoided.
+
+        'fused' counts just the fused call, which replaces all of them.
+        """
+        names = [name for name, _ in PIPELINE_STAGE_CALLS]
+        remaining = PIPELINE_STAGE_CALLS[names.index(stage):] if stage in names else ((stage, STAGE_CALLS[stage]),)
+        avoided = {}
+        for _, calls in remaining:
+            for provider, count in calls.items():
+                avoided[provider] = avoided.get(provider, 0) + count
+        record_calls_avoided(avoided)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for the result and stage caches."""
+        return {
+            'plan': self.plan_cache.stats(),
+            'diagram': self.diagram_cache.stats(),
+            'stages': {stage: cache.stats() for stage, cache in self.stage_caches.items()},
+            'similarity_index': self.question_index.stats(),
+            'positioning': FreeGeminiService.positioning_cache_stats(),
+            'stage_latency': self.stage_latency.stats()
+        }
+
+    def estimated_generation_seconds(self) -> float:
+        """Expected duration of an uncached question, from observed per-stage latency.
+
+        Plan and content analysis run side by side, so only the slower of them counts.
+        """
+        default = Config.SCHEDULER_DEFAULT_STAGE_SECONDS
+        mean = lambda stage: self.stage_latency.mean(stage, default)
+        return max(mean('plan'), mean('content')) + mean('layout') + mean('visual') + mean('render')
+
+    def seed_cache(self, question: str, plan: dict = None, diagram: dict = None):
+        """Store a precomputed plan and/or diagram as if it had just been generated."""
+        cache_key = normalize_question(question)
+        if plan:
+            self.plan_cache.set(cache_key, plan)
+        if diagram and diagram.get('svg_content'):
+            self.diagram_cache.set(cache_key, self._publish_diagram(diagram))
+        if plan or diagram:
+            self.question_index.add(cache_key)
+
+    def get_cached(self, question: str) -> tuple:
+        """Return the (plan, diagram) currently cached for an exact question, if any."""
+        cache_key = normalize_question(question)
+        return self.plan_cache.get(cache_key), self.diagram_cache.get(cache_key)
+
+    def has_spare_capacity(self, calls_needed: int = 1, headroom: int = 0, provider: str = None) -> bool:
+        """Whether calls_needed provider calls can start now and still leave headroom requests on hand.
+
+        Only tokens already in the bucket count, never its future refill. When the
+        bucket cannot hold calls_needed + headroom, it has to be full. Without a
+        provider, every Gemini model tier's quota must have the room.
+        """
+        limiter = get_rate_limiter()
+        for quota in [provider] if provider else FreeGeminiService.quotas():
+            if get_breaker(quota).is_open():
+                return False
+            if limiter.available(quota) < min(calls_needed + headroom, limiter.capacity(quota)):
+                return False
+        return True
 
     def _extract_explanation_from_raw_response(self, raw_response: str) -> str:
         """Extract clean explanation from raw JSON response."""
@@ -83,13 +647,75 @@ class FreeVisualOrchestrator:
     
         return "I can help explain this concept. Please try asking again."
     
-    def create_visual_plan_free(self, question: str) -> Dict[str, Any]:
+    def create_visual_plan_free(self, question: str, use_cache: bool = True, cancel_token=None,
+                                deadline=None) -> Dict[str, Any]:
         """Create visual plan using FREE Google Gemini."""
         
-        # Respect rate limits
-        self._wait_for_rate_limit('gemini')
+        cache_key, cached = self._lookup_cached_result(self.plan_cache, question, use_cache)
+        if cached:
+            print(f"⚡ Plan cache hit for: {question}")
+            return cached
         
-        system_prompt = """## ROLE & PERSONA
+        started = time.time()
+        plan = self._run_cancellable(
+            'plan', lambda token: self._routed_call(
+                'plan', question, lambda tier: self._generate_visual_plan(question, cache_key, token, tier)),
+            cancel_token, deadline, fallback=lambda: self._create_fallback_plan(question)
+        )
+        self.stage_latency.record('plan', time.time() - started)
+        return plan
+
+    async def create_visual_plan_async(self, question: str, use_cache: bool = True, cancel_token=None,
+                                       deadline=None) -> Dict[str, Any]:
+        """create_visual_plan_free() awaiting Gemini on the shared provider loop."""
+        
+        cache_key, cached = await run_blocking(self._lookup_cached_result, self.plan_cache, question, use_cache)
+        if cached:
+            print(f"⚡ Plan cache hit for: {question}")
+            return cached
+        
+        started = time.time()
+        plan = await self._arun_cancellable(
+            'plan', lambda token: self._arouted_call(
+                'plan', question, lambda tier: self._generate_visual_plan_async(question, cache_key, token, tier)),
+            cancel_token, deadline, fallback=lambda: self._create_fallback_plan(question)
+        )
+        self.stage_latency.record('plan', time.time() - started)
+        return plan
+
+    def _generate_visual_plan(self, question: str, cache_key: str, cancel_token=None,
+                              tier: str = None) -> Dict[str, Any]:
+        """Ask Gemini for the explanation and canvas plan, caching only parsed plans."""
+        # Rate limiting happens inside FreeGeminiService.generate_response
+        response = self.gemini.generate_response(question, self._plan_system_prompt(), label='plan',
+                                                 cancel_token=cancel_token, response_schema=PLAN_SCHEMA, tier=tier)
+        return self._parse_visual_plan(response, question, cache_key)
+
+    async def _generate_visual_plan_async(self, question: str, cache_key: str, cancel_token=None,
+                                          tier: str = None) -> Dict[str, Any]:
+        response = await self.async_gemini.generate_response(
+            question, self._plan_system_prompt(), label='plan', cancel_token=cancel_token,
+            response_schema=PLAN_SCHEMA, tier=tier)
+        return await run_blocking(self._parse_visual_plan, response, question, cache_key)
+
+    def _routed_call(self, stage: str, question: str, call: Callable[[str], Any]) -> Any:
+        """call(tier) on the model tier the router picks for question, counted in its per-tier figures."""
+        tier = offload(self.router.route, question)
+        started = time.time()
+        output = call(tier)
+        self.router.record(stage, tier, time.time() - started, output)
+        return output
+
+    async def _arouted_call(self, stage: str, question: str, call: Callable[[str], Awaitable[Any]]) -> Any:
+        tier = await run_blocking(self.router.route, question)
+        started = time.time()
+        output = await call(tier)
+        self.router.record(stage, tier, time.time() - started, output)
+        return output
+
+    @staticmethod
+    def _plan_system_prompt() -> str:
+        return """## ROLE & PERSONA
 You are Buddy, a smart AI tutor who creates perfect visual lessons using interactive canvas diagrams. You're enthusiastic and speak like you're talking to a curious 8-12 year old.
 
 ## CORE PRINCIPLE: CANVAS-ONLY VISUAL EDUCATION
@@ -200,25 +826,17 @@ Everything is created using canvas drawings - no background images! You create e
 
 Remember: You're creating interactive learning experiences that make complex topics fun and understandable through beautiful, clear canvas diagrams!"""
 
-
-
-
-        try:
-            response = self.gemini.generate_response(question, system_prompt)
+    def _parse_visual_plan(self, response: str, question: str, cache_key: str) -> Dict[str, Any]:
+        plan = parse_response('plan', response, PLAN_SCHEMA)
+        if plan is not None:
         
-            # Try to extract JSON from response
-            json_str = self._extract_json_from_response(response)
-            plan = json.loads(json_str)
-        
-            print(f"✅ Successfully parsed JSON: needs_image={plan.get('needs_image')}")  # DEBUG
-        
-            self.last_gemini_call = time.time()
+            # Only successfully parsed plans are cached; fallbacks below are not
+            self.plan_cache.set(cache_key, plan)
+            self.question_index.add(cache_key)
             return plan
         
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON parsing failed: {e}")
+        else:
             print(f"❌ Raw response that failed: {response}")
-            traceback.print_exc()
             # Try to extract at least the explanation 
             try:
                 # Look for explanation in the response
@@ -242,19 +860,25 @@ Remember: You're creating interactive learning experiences that make complex top
                     "image_prompt": f"Educational illustration about {question}, simple colorful diagram",
                     "canvas_elements": [
                         {"type": "text", "content": "Educational Concept", "x": 512, "y": 300, "style": "title"}
-                    ]
+                    ],
+                    "fallback": True
                 }
             except:
                 print(f"🆘 Complete fallback")
-                return {
-                    "explanation": "Let me help you learn about this topic!",
-                    "visual_type": "image_with_overlays",
-                    "needs_image": True,
-                    "image_prompt": f"Simple educational diagram about {question}",
-                    "canvas_elements": [
-                        {"type": "text", "content": "Learning Topic", "x": 512, "y": 300, "style": "title"}
-                    ]
-                }
+                return self._create_fallback_plan(question)
+
+    def _create_fallback_plan(self, question: str) -> Dict[str, Any]:
+        """Generic plan used when Gemini's answer is unusable or too slow."""
+        return {
+            "explanation": "Let me help you learn about this topic!",
+            "visual_type": "image_with_overlays",
+            "needs_image": True,
+            "image_prompt": f"Simple educational diagram about {question}",
+            "canvas_elements": [
+                {"type": "text", "content": "Learning Topic", "x": 512, "y": 300, "style": "title"}
+            ],
+            "fallback": True
+        }
 
     def _extract_json_from_response(self, response: str) -> str:
         """Extract JSON from Gemini response that might have extra text."""
@@ -269,15 +893,11 @@ Remember: You're creating interactive learning experiences that make complex top
             # If no JSON found, assume entire response is JSON
             return response
     
-    def generate_image_free(self, image_prompt: str) -> Dict[str, Any]:
-        """Generate image using FREE HuggingFace API."""
-        
-        # Respect rate limits
-        self._wait_for_rate_limit('huggingface')
+    def generate_image_free(self, image_prompt: str, cancel_token=None) -> Dict[str, Any]:
+        """Generate image using FREE HuggingFace API (rate limited per attempt by the service)."""
         
         try:
-            result = self.huggingface.generate_image(image_prompt)
-            self.last_hf_call = time.time()
+            result = self.huggingface.generate_image(image_prompt, cancel_token=cancel_token)
             return result
         except Exception as e:
             print(f"FREE image generation failed: {e}")
@@ -287,22 +907,6 @@ Remember: You're creating interactive learning experiences that make complex top
         """Create client-side canvas instructions (always FREE)."""
         return self.canvas_gen.generate_instructions(visual_plan.get('canvas_elements', []))
     
-    def _wait_for_rate_limit(self, service: str):
-        """Respect FREE tier rate limits."""
-        current_time = time.time()
-        
-        if service == 'gemini':
-            # Gemini: 15 requests per minute = 4 seconds between calls
-            time_since_last = current_time - self.last_gemini_call
-            if time_since_last < 4:
-                time.sleep(4 - time_since_last)
-        
-        elif service == 'huggingface':
-            # HuggingFace: 300 requests per hour = 12 seconds between calls
-            time_since_last = current_time - self.last_hf_call
-            if time_since_last < 12:
-                time.sleep(12 - time_since_last)
-
     def execute_parallel_generation(self, instructions: Dict[str, Any], 
                                   progress_callback: Callable = None) -> Dict[str, Any]:
         """Execute all visual generation tasks with image feedback loop."""
@@ -414,5 +1018,5 @@ Remember: You're creating interactive learning experiences that make complex top
         return None
     
     # ✅ ADD missing method  
-    def analyze_image_positioning(self, image_data: str, concept: str):
-        return self.gemini.analyze_image_for_positioning(image_data, concept)
\ No newline at end of file
+    def analyze_image_positioning(self, image_data: str, concept: str, cancel_token=None):
+        return self.gemini.analyze_image_for_positioning(image_data, concept, cancel_token=cancel_token)
\ No newline at end of file
@@ -0,0 +1,164 @@
+# Create: agents/fused_agent.py
+import textwrap
+
+from services.gemini_service import FreeGeminiService
+from services.async_providers import AsyncGeminiService
+from services.structured_output import parse_response
+from services.wire_format import (COMPACT_LAYOUT_EXAMPLE, COMPACT_LAYOUT_KEYS, COMPACT_LAYOUT_SCHEMA,
+                                  COMPACT_VISUAL_EXAMPLE, COMPACT_VISUAL_KEYS, COMPACT_VISUAL_SCHEMA,
+                                  compact_enabled, expand_layout, expand_visuals, usage_label)
+from agents.canvas_generator import CANVAS_ELEMENT_SCHEMA
+from agents.content_agent import ContentAnalysisAgent
+from agents.layout_agent import LayoutDesignAgent
+from agents.visual_agent import VisualStyleAgent
+
+class FusedLessonAgent:
+    """Agent that produces the explanation, content analysis, layout and visual styles in one call.
+
+    Stands in for the plan, content, layout and visual agents when a request runs in
+    fused mode; the orchestrator splits the answer back into their usual dicts.
+    """
+
+    # The planning fields plus each stage agent's own schema
+    RESPONSE_SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'explanation': {'type': 'string'},
+            'needs_image': {'type': 'boolean'},
+            'visual_type': {'type': 'string'},
+            'canvas_elements': {'type': 'array', 'items': CANVAS_ELEMENT_SCHEMA},
+            'content': ContentAnalysisAgent.RESPONSE_SCHEMA,
+            'layout': LayoutDesignAgent.RESPONSE_SCHEMA,
+            'visual': VisualStyleAgent.RESPONSE_SCHEMA,
+        },
+        'required': ['explanation', 'needs_image'],
+    }
+    # Layout and visual in the short-key dialect of services/wire_format.py
+    COMPACT_RESPONSE_SCHEMA = dict(RESPONSE_SCHEMA, properties=dict(
+        RESPONSE_SCHEMA['properties'], layout=COMPACT_LAYOUT_SCHEMA, visual=COMPACT_VISUAL_SCHEMA))
+
+    VERBOSE_LAYOUT_EXAMPLE = """{
+    "layout_strategy": "center_focus|left_to_right|top_to_bottom|circular|radial",
+    "element_positions": [
+      {"name": "element1", "x": 100, "y": 150, "width": 120, "height": 80, "priority": "primary|secondary|tertiary"}
+    ],
+    "connection_paths": [
+      {"from": "element1", "to": "element2", "path_type": "straight|curved|stepped", "control_points": []}
+    ],
+    "text_zones": [
+      {"type": "title", "x": 400, "y": 50, "max_width": 300}
+    ],
+    "visual_hierarchy": ["most_important_element", "supporting_elements"]
+  }"""
+
+    VERBOSE_VISUAL_EXAMPLE = """{
+    "visual_elements": [
+      {"name": "element1", "shape": "circle|rectangle|ellipse|triangle", "fill_color": "#color_hex",
+       "stroke_color": "#color_hex", "stroke_width": 2, "pattern": "solid|gradient|dashed",
+       "visual_metaphor": "what this shape represents", "educational_purpose": "why this helps learning"}
+    ],
+    "connection_styles": [
+      {"from": "element1", "to": "element2", "arrow_style": "simple|curved|double|dashed",
+       "color": "#color_hex", "thickness": 2, "animation_hint": "none|flow|pulse|grow"}
+    ],
+    "text_styles": [
+      {"type": "title|label|annotation", "font_size": 16, "color": "#color_hex", "weight": "normal|bold"}
+    ],
+    "overall_theme": "modern|friendly|scientific|playful"
+  }"""
+
+    def __init__(self):
+        self.gemini = FreeGeminiService()
+        self.async_gemini = AsyncGeminiService()
+
+    def generate_lesson(self, question: str, cancel_token=None) -> dict:
+        """Return {"plan", "content", "layout", "visual"}; a part that is missing or unusable is None."""
+        try:
+            response = self.gemini.generate_response(question, self._system_prompt(), label=usage_label('fused'),
+                                                     cancel_token=cancel_token,
+                                                     response_schema=self._response_schema())
+            return self._split(response)
+        except Exception as e:
+            print(f"Fused lesson error: {e}")
+            return self._split(None)
+
+    async def generate_lesson_async(self, question: str, cancel_token=None) -> dict:
+        """generate_lesson() awaiting Gemini on the shared provider loop."""
+        try:
+            response = await self.async_gemini.generate_response(question, self._system_prompt(), label=usage_label('fused'),
+                                                                 cancel_token=cancel_token,
+                                                                 response_schema=self._response_schema())
+            return self._split(response)
+        except Exception as e:
+            print(f"Fused lesson error: {e}")
+            return self._split(None)
+
+    @classmethod
+    def _response_schema(cls) -> dict:
+        return cls.COMPACT_RESPONSE_SCHEMA if compact_enabled() else cls.RESPONSE_SCHEMA
+
+    @classmethod
+    def _system_prompt(cls) -> str:
+        if compact_enabled():
+            layout = textwrap.indent(COMPACT_LAYOUT_EXAMPLE, '  ').lstrip()
+            visual = textwrap.indent(COMPACT_VISUAL_EXAMPLE, '  ').lstrip()
+            key_notes = ("\n\nlayout and visual use short keys; leave out any field equal to its default.\n"
+                         "layout: " + COMPACT_LAYOUT_KEYS + "\nvisual: " + COMPACT_VISUAL_KEYS)
+        else:
+            layout, visual, key_notes = cls.VERBOSE_LAYOUT_EXAMPLE, cls.VERBOSE_VISUAL_EXAMPLE, ""
+        return """You are Buddy, a smart AI tutor for curious 8-12 year olds, and an educational diagram designer.
+
+For the question in the user message, produce the explanation AND the full diagram design in ONE JSON object.
+
+1. explanation: enthusiastic, kid-friendly, 2-3 simple sentences ("Hey! Great question! ...").
+2. content: the key components that NEED to be shown visually and how they relate.
+   Only one connection between two distinct elements.
+3. layout: positions on a 1024x768 canvas. Most important elements prominent, processes read
+   left-to-right / top-to-bottom, no overlapping elements, spread out over the canvas.
+4. visual: a shape and colors for each element. Shapes are always light colors; arrows, lines
+   and text are always black or a dark color.
+
+Every element name must be identical in content, layout and visual.
+If the question needs no diagram, set needs_image to false, fill canvas_elements
+(types: text, arrow, line, circle, rectangle; text is #000000) and omit content, layout and visual.
+
+Respond with JSON only:
+{
+  "explanation": "Hey there! ...",
+  "needs_image": true,
+  "visual_type": "canvas_drawing",
+  "canvas_elements": [],
+  "content": {
+    "main_concept": "Primary concept being taught",
+    "visual_elements": [
+      {"name": "element1", "type": "object|process|connection", "importance": "high|medium|low", "description": "what it represents"}
+    ],
+    "relationships": [
+      {"from": "element1", "to": "element2", "type": "flow|cause|part_of|transforms", "label": "relationship description"}
+    ],
+    "educational_goal": "What should students understand after seeing this?",
+    "complexity_level": "elementary|middle|high",
+    "diagram_type": "flow|cycle|structure|comparison|timeline"
+  },
+  "layout": """ + layout + """,
+  "visual": """ + visual + """
+}""" + key_notes
+
+    @classmethod
+    def _split(cls, response) -> dict:
+        """Split the combined answer into the plan and the three diagram stage outputs."""
+        parts = {'plan': None, 'content': None, 'layout': None, 'visual': None}
+        lesson = parse_response('fused', response, cls._response_schema()) if response else None
+        if lesson is None:
+            return parts
+        if compact_enabled():
+            for stage, expand in (('layout', expand_layout), ('visual', expand_visuals)):
+                if isinstance(lesson.get(stage), dict):
+                    lesson[stage] = expand(lesson[stage])
+
+        parts['plan'] = {key: lesson[key] for key in ('explanation', 'needs_image', 'visual_type', 'canvas_elements')
+                         if key in lesson}
+        for stage in ('content', 'layout', 'visual'):
+            if isinstance(lesson.get(stage), dict):
+                parts[stage] = lesson[stage]
+        return parts
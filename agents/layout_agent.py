@@ -1,6 +1,11 @@
 ﻿# Create: agents/layout_agent.py
 from services.gemini_service import FreeGeminiService
 from services.perplexity_service import PerplexityService
+from services.async_providers import AsyncGeminiService, AsyncPerplexityService
+from services.hedging import Hedger
+from services.prompt_builder import build_prompt
+from services.structured_output import parse_response
+from services.wire_format import COMPACT_LAYOUT_PROMPT, COMPACT_LAYOUT_SCHEMA, compact_enabled, expand_layout, usage_label
 import json
 from config import Config
 import re
@@ -8,20 +13,138 @@ import re
 class LayoutDesignAgent:
     """Agent that determines optimal spatial arrangement for educational clarity."""
     
+    # Enforced through Gemini's JSON mode / Perplexity's json_schema format and checked again locally
+    RESPONSE_SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'layout_strategy': {'type': 'string'},
+            'element_positions': {'type': 'array', 'items': {
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string'},
+                    'x': {'type': 'number'},
+                    'y': {'type': 'number'},
+                    'width': {'type': 'number'},
+                    'height': {'type': 'number'},
+                    'priority': {'type': 'string'},
+                },
+                'required': ['name', 'x', 'y', 'width', 'height'],
+            }},
+            'connection_paths': {'type': 'array', 'items': {
+                'type': 'object',
+                'properties': {
+                    'from': {'type': 'string'},
+                    'to': {'type': 'string'},
+                    'path_type': {'type': 'string'},
+                    'control_points': {'type': 'array', 'items': {'type': 'array', 'items': {'type': 'number'}}},
+                },
+                'required': ['from', 'to'],
+            }},
+            'text_zones': {'type': 'array', 'items': {
+                'type': 'object',
+                'properties': {
+                    'type': {'type': 'string'},
+                    'element': {'type': 'string'},
+                    'x': {'type': 'number'},
+                    'y': {'type': 'number'},
+                    'max_width': {'type': 'number'},
+                    'position': {'type': 'string'},
+                    'offset': {'type': 'number'},
+                },
+                'required': ['type'],
+            }},
+            'visual_hierarchy': {'type': 'array', 'items': {'type': 'string'}},
+        },
+        'required': ['layout_strategy', 'element_positions'],
+    }
+    
+    # What layout reads from the content analysis; descriptions and labels do not move elements
+    PROMPT_FIELDS = {
+        'main_concept': None,
+        'diagram_type': None,
+        'visual_elements': ('name', 'type', 'importance'),
+        'relationships': ('from', 'to', 'type'),
+    }
+    
+    # Answer format used when the compact wire format is off
+    VERBOSE_FORMAT_PROMPT = """Respond with JSON:
+{
+  "layout_strategy": "center_focus|left_to_right|top_to_bottom|circular|radial",
+  "element_positions": [
+    {"name": "element_name", "x": 100, "y": 150, "width": 120, "height": 80, "priority": "primary|secondary|tertiary"},
+    {"name": "element2", "x": 300, "y": 200, "width": 100, "height": 60, "priority": "primary|secondary|tertiary"}
+  ],
+  "connection_paths": [
+    {"from": "element1", "to": "element2", "path_type": "straight|curved|stepped", "control_points": [[x1,y1], [x2,y2]]},
+  ],
+  "text_zones": [
+    {"type": "title", "x": 400, "y": 50, "max_width": 300},
+    {"type": "label", "element": "element1", "position": "above|below|left|right", "offset": 20}
+  ],
+  "visual_hierarchy": ["most_important_element", "second_important", "supporting_elements"]
+}"""
+    
     def __init__(self):
         self.gemini = FreeGeminiService()
         self.perplexity = PerplexityService()
+        self.async_gemini = AsyncGeminiService()
+        self.async_perplexity = AsyncPerplexityService()
         self.use_perplexity = getattr(Config, 'USE_PERPLEXITY_FOR_LAYOUT', True)
+        settings = Config.AGENT_HEDGING.get('layout', {})
+        self.hedger = Hedger('layout', settings.get('primary', 'gemini'), settings.get('backup', 'perplexity'), settings)
     
-    def design_layout(self, content_analysis: dict) -> dict:
+    def design_layout(self, content_analysis: dict, cancel_token=None) -> dict:
         """Create spatial layout plan for maximum educational impact."""
         
-        system_prompt = f"""You are a visual design expert specializing in educational diagrams.
+        system_prompt = self._system_prompt()
+
+        user_prompt = build_prompt('layout', [('CONTENT ANALYSIS', content_analysis, self.PROMPT_FIELDS)])
 
-Given this content analysis, design the optimal spatial layout:
+        if self.hedger.enabled and self.use_perplexity and self.perplexity.api_key:
+            try:
+                layout = self.hedger.run(
+                    primary=lambda token: self._layout_from(self.hedger.primary, user_prompt, system_prompt, token),
+                    backup=lambda token: self._layout_from(self.hedger.backup, user_prompt, system_prompt, token),
+                    is_valid=self._validate_layout_structure,
+                    cancel_token=cancel_token
+                )
+                return layout or self._create_fallback_layout(content_analysis)
+            except Exception as e:
+                print(f"❌ Layout generation error: {e}")
+                return self._create_fallback_layout(content_analysis)
+
+        try:
+            layout = self._layout_from('gemini', user_prompt, system_prompt, cancel_token)
+            return layout or self._create_fallback_layout(content_analysis)
+        except Exception as e:
+            print(f"❌ Layout generation error: {e}")
+            return self._create_fallback_layout(content_analysis)
+    
+    async def design_layout_async(self, content_analysis: dict, cancel_token=None) -> dict:
+        """design_layout() awaiting Gemini (and the hedged Perplexity backup) on the shared provider loop."""
+        system_prompt = self._system_prompt()
+        user_prompt = build_prompt('layout', [('CONTENT ANALYSIS', content_analysis, self.PROMPT_FIELDS)])
+
+        try:
+            if self.hedger.enabled and self.use_perplexity and self.async_perplexity.api_key:
+                layout = await self.hedger.run_async(
+                    primary=lambda token: self._layout_from_async(self.hedger.primary, user_prompt, system_prompt, token),
+                    backup=lambda token: self._layout_from_async(self.hedger.backup, user_prompt, system_prompt, token),
+                    is_valid=self._validate_layout_structure,
+                    cancel_token=cancel_token
+                )
+            else:
+                layout = await self._layout_from_async('gemini', user_prompt, system_prompt, cancel_token)
+            return layout or self._create_fallback_layout(content_analysis)
+        except Exception as e:
+            print(f"❌ Layout generation error: {e}")
+            return self._create_fallback_layout(content_analysis)
+    
+    def _system_prompt(self) -> str:
+        # Static instructions are registered once; only the analysis varies per call
+        return """You are a visual design expert specializing in educational diagrams.
 
-CONTENT ANALYSIS:
-{json.dumps(content_analysis, indent=2)}
+Given the content analysis in the user message, design the optimal spatial layout.
 
 Design a layout that maximizes learning. Consider:
 - Information hierarchy (most important elements prominent)
@@ -34,69 +157,52 @@ Design a layout that maximizes learning. Consider:
 
 Canvas size: 1024x768 pixels
 
-Respond with JSON:
-{{
-  "layout_strategy": "center_focus|left_to_right|top_to_bottom|circular|radial",
-  "element_positions": [
-    {{"name": "element_name", "x": 100, "y": 150, "width": 120, "height": 80, "priority": "primary|secondary|tertiary"}},
-    {{"name": "element2", "x": 300, "y": 200, "width": 100, "height": 60, "priority": "primary|secondary|tertiary"}}
-  ],
-  "connection_paths": [
-    {{"from": "element1", "to": "element2", "path_type": "straight|curved|stepped", "control_points": [[x1,y1], [x2,y2]]}},
-  ],
-  "text_zones": [
-    {{"type": "title", "x": 400, "y": 50, "max_width": 300}},
-    {{"type": "label", "element": "element1", "position": "above|below|left|right", "offset": 20}}
-  ],
-  "visual_hierarchy": ["most_important_element", "second_important", "supporting_elements"]
-}}
+""" + (COMPACT_LAYOUT_PROMPT if compact_enabled() else self.VERBOSE_FORMAT_PROMPT) + """
 
 Ensure no overlapping elements and clear visual flow."""
-
-        try:
-            # First get initial layout from Gemini
-            initial_response = self.gemini.generate_response("", system_prompt)
-            
-            # Use Perplexity for spatial optimization review
-            if self.use_perplexity and self.perplexity.api_key:
-                print("🧠 Using Perplexity for layout optimization...")
-                
-                reflection_prompt = f"""
-                Review and improve this spatial layout analysis:
-                
-                Initial Layout:
-                {json.dumps(initial_response, indent=2)}
-                
-                As a spatial design expert with access to current educational research:
-                1. Is this layout non-overlapping with clear element separation?
-                2. Are the shapes optimally placed for educational clarity?
-                3. Does it use the full 1200x800 canvas effectively?
-                4. Is the reading flow intuitive (left-to-right for processes)?
-                
-                If improvements are needed, provide an enhanced layout.
-                If the original is optimal, return it unchanged.
-                
-                CRITICAL: Return ONLY the JSON layout object, no other text or analysis.
-                """
-                
-                #optimized_response = self.perplexity.generate_content(reflection_prompt, system_prompt)
-                
-                # Extract JSON from Perplexity response
-                layout_json = self._extract_json_from_response(initial_response)
-                
-                if layout_json:
-                    print("✅ Perplexity layout optimization successful")
-                    return layout_json
-                else:
-                    print("⚠️ Failed to parse Perplexity response, using Gemini fallback")
-                    return initial_response
-            else:
-                return initial_response
-                
-        except Exception as e:
-            print(f"❌ Layout generation error: {e}")
-            return self._create_fallback_layout(content_analysis)
     
+    @classmethod
+    def _response_schema(cls) -> dict:
+        return COMPACT_LAYOUT_SCHEMA if compact_enabled() else cls.RESPONSE_SCHEMA
+    
+    def _layout_from(self, provider: str, user_prompt: str, system_prompt: str, cancel_token=None) -> dict:
+        """Ask one provider for the layout and parse it (None if unparseable)."""
+        if provider == 'perplexity':
+            response = self.perplexity.generate_content(user_prompt, system_prompt, cancel_token=cancel_token,
+                                                        response_schema=self._response_schema())
+        else:
+            response = self.gemini.generate_response(user_prompt, system_prompt, label=usage_label('layout'),
+                                                     cancel_token=cancel_token,
+                                                     response_schema=self._response_schema())
+        return self._parse_layout(provider, response)
+    
+    async def _layout_from_async(self, provider: str, user_prompt: str, system_prompt: str,
+                                 cancel_token=None) -> dict:
+        """_layout_from() on the provider loop."""
+        if provider == 'perplexity':
+            response = await self.async_perplexity.generate_content(user_prompt, system_prompt,
+                                                                    cancel_token=cancel_token,
+                                                                    response_schema=self._response_schema())
+        else:
+            response = await self.async_gemini.generate_response(user_prompt, system_prompt,
+                                                                 label=usage_label('layout'),
+                                                                 cancel_token=cancel_token,
+                                                                 response_schema=self._response_schema())
+        return self._parse_layout(provider, response)
+    
+    def _parse_layout(self, provider: str, response) -> dict:
+        if provider == 'perplexity':
+            if response.get('fallback'):
+                # The call itself failed; there is nothing to parse
+                return None
+            if response.get('raw_response'):
+                response = response.get('content', '')
+        if compact_enabled():
+            layout = parse_response('layout', response, COMPACT_LAYOUT_SCHEMA)
+            return expand_layout(layout) if layout is not None else None
+        # The old text heuristics only run if the answer is not schema-conforming JSON
+        return parse_response('layout', response, self.RESPONSE_SCHEMA, repair=self._extract_json_from_response)
+
     def _extract_json_from_response(self, response) -> dict:
         """Extract JSON from various response formats."""
         
@@ -239,5 +345,6 @@ Ensure no overlapping elements and clear visual flow."""
             "text_zones": [
                 {"type": "title", "x": 600, "y": 50, "max_width": 400}  # Centered for wider canvas
             ],
-            "visual_hierarchy": [el['name'] for el in elements]
+            "visual_hierarchy": [el['name'] for el in elements],
+            "fallback": True
         }
@@ -1,40 +1,77 @@
 # Create: agents/visual_agent.py
 from services.gemini_service import FreeGeminiService
+from services.async_providers import AsyncGeminiService
+from services.prompt_builder import build_prompt
+from services.structured_output import parse_response
+from services.wire_format import COMPACT_VISUAL_PROMPT, COMPACT_VISUAL_SCHEMA, compact_enabled, expand_visuals, usage_label
 import json
 
 class VisualStyleAgent:
     """Agent that determines colors, shapes, and visual metaphors for educational impact."""
     
-    def __init__(self):
-        self.gemini = FreeGeminiService()
-        self.educational_colors = {
-            'primary': '#4A90E2',      # Professional blue
-            'secondary': '#50C878',    # Educational green  
-            'accent': '#FF6B6B',       # Attention red
-            'process': '#FFD700',      # Process yellow
-            'neutral': '#8E8E93',      # Supporting gray
-            'background': '#F8F9FA'    # Clean background
-        }
+    # Enforced through Gemini's JSON mode and checked again locally
+    RESPONSE_SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'visual_elements': {'type': 'array', 'items': {
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string'},
+                    'shape': {'type': 'string'},
+                    'fill_color': {'type': 'string'},
+                    'stroke_color': {'type': 'string'},
+                    'stroke_width': {'type': 'number'},
+                    'pattern': {'type': 'string'},
+                    'visual_metaphor': {'type': 'string'},
+                    'educational_purpose': {'type': 'string'},
+                },
+                'required': ['name'],
+            }},
+            'connection_styles': {'type': 'array', 'items': {
+                'type': 'object',
+                'properties': {
+                    'from': {'type': 'string'},
+                    'to': {'type': 'string'},
+                    'arrow_style': {'type': 'string'},
+                    'color': {'type': 'string'},
+                    'thickness': {'type': 'number'},
+                    'animation_hint': {'type': 'string'},
+                },
+                'required': ['from', 'to'],
+            }},
+            'text_styles': {'type': 'array', 'items': {
+                'type': 'object',
+                'properties': {
+                    'type': {'type': 'string'},
+                    'font_size': {'type': 'number'},
+                    'color': {'type': 'string'},
+                    'weight': {'type': 'string'},
+                    'emphasis': {'type': 'string'},
+                },
+                'required': ['type'],
+            }},
+            'overall_theme': {'type': 'string'},
+            'accessibility_notes': {'type': 'string'},
+        },
+        'required': ['visual_elements'],
+    }
     
-    def design_visuals(self, content_analysis: dict, layout_plan: dict) -> dict:
-        """Choose optimal visual elements for educational clarity."""
-        
-        system_prompt = f"""You are a visual design expert for educational content.
-
-CONTENT: {json.dumps(content_analysis, indent=2)}
-LAYOUT: {json.dumps(layout_plan, indent=2)}
-
-Choose the best visual representation for each element to maximize learning.
-
-Available shapes: circle, rectangle, ellipse, triangle, polygon, path
-Available patterns: solid, gradient, dashed, dotted
-Educational color palette: {json.dumps(self.educational_colors)}
-Make sure that the shape elements are always light color, and arrows, lines and text are always black or dark color.
-
-Respond with JSON:
-{{
+    # What styling reads from upstream: what each element is and how big it is drawn, not where
+    CONTENT_PROMPT_FIELDS = {
+        'main_concept': None,
+        'visual_elements': ('name', 'type', 'importance', 'description'),
+        'relationships': ('from', 'to', 'type'),
+    }
+    LAYOUT_PROMPT_FIELDS = {
+        'layout_strategy': None,
+        'element_positions': ('name', 'width', 'height', 'priority'),
+    }
+    
+    # Answer format used when the compact wire format is off
+    VERBOSE_FORMAT_PROMPT = """Respond with JSON:
+{
   "visual_elements": [
-    {{
+    {
       "name": "element_name",
       "shape": "circle|rectangle|ellipse|triangle|custom_path",
       "fill_color": "#color_hex",
@@ -43,47 +80,99 @@ Respond with JSON:
       "pattern": "solid|gradient|dashed",
       "visual_metaphor": "what this shape represents",
       "educational_purpose": "why this visual choice helps learning"
-    }}
+    }
   ],
   "connection_styles": [
-    {{
+    {
       "from": "element1", 
       "to": "element2",
       "arrow_style": "simple|curved|double|dashed",
       "color": "#color_hex",
       "thickness": 2,
       "animation_hint": "none|flow|pulse|grow"
-    }}
+    }
   ],
   "text_styles": [
-    {{
+    {
       "type": "title|label|annotation",
       "font_size": 16,
       "color": "#color_hex",
       "weight": "normal|bold",
       "emphasis": "none|highlight|callout"
-    }}
+    }
   ],
   "overall_theme": "modern|friendly|scientific|playful",
   "accessibility_notes": "Color blind considerations, contrast ratios"
-}}
-
-Prioritize educational clarity over visual complexity."""
-
+}"""
+    
+    def __init__(self):
+        self.gemini = FreeGeminiService()
+        self.async_gemini = AsyncGeminiService()
+        self.educational_colors = {
+            'primary': '#4A90E2',      # Professional blue
+            'secondary': '#50C878',    # Educational green  
+            'accent': '#FF6B6B',       # Attention red
+            'process': '#FFD700',      # Process yellow
+            'neutral': '#8E8E93',      # Supporting gray
+            'background': '#F8F9FA'    # Clean background
+        }
+    
+    def design_visuals(self, content_analysis: dict, layout_plan: dict, cancel_token=None) -> dict:
+        """Choose optimal visual elements for educational clarity."""
+        try:
+            response = self.gemini.generate_response(self._user_prompt(content_analysis, layout_plan),
+                                                     self._system_prompt(), label=usage_label('visual'),
+                                                     cancel_token=cancel_token,
+                                                     response_schema=self._response_schema())
+            return self._parse_visuals(response, layout_plan)
+        except Exception as e:
+            print(f"Visual design error: {e}")
+            return self._create_fallback_visuals(layout_plan)
+    
+    async def design_visuals_async(self, content_analysis: dict, layout_plan: dict, cancel_token=None) -> dict:
+        """design_visuals() awaiting Gemini on the shared provider loop."""
         try:
-            response = self.gemini.generate_response("", system_prompt)
-            start = response.find('{')
-            end = response.rfind('}') + 1
-            if start != -1 and end > start:
-                json_str = response[start:end]
-                return json.loads(json_str)
-            else:
-                return self._create_fallback_visuals(layout_plan)
-                
+            response = await self.async_gemini.generate_response(self._user_prompt(content_analysis, layout_plan),
+                                                                 self._system_prompt(), label=usage_label('visual'),
+                                                                 cancel_token=cancel_token,
+                                                                 response_schema=self._response_schema())
+            return self._parse_visuals(response, layout_plan)
         except Exception as e:
             print(f"Visual design error: {e}")
             return self._create_fallback_visuals(layout_plan)
     
+    def _system_prompt(self) -> str:
+        # Static instructions are registered once; only content and layout vary per call
+        return """You are a visual design expert for educational content.
+
+Using the CONTENT and LAYOUT in the user message, choose the best visual representation for each element to maximize learning.
+
+Available shapes: circle, rectangle, ellipse, triangle, polygon, path
+Available patterns: solid, gradient, dashed, dotted
+Educational color palette: """ + json.dumps(self.educational_colors) + """
+Make sure that the shape elements are always light color, and arrows, lines and text are always black or dark color.
+
+""" + (COMPACT_VISUAL_PROMPT if compact_enabled() else self.VERBOSE_FORMAT_PROMPT) + """
+
+Prioritize educational clarity over visual complexity."""
+    
+    @classmethod
+    def _response_schema(cls) -> dict:
+        return COMPACT_VISUAL_SCHEMA if compact_enabled() else cls.RESPONSE_SCHEMA
+    
+    @classmethod
+    def _user_prompt(cls, content_analysis: dict, layout_plan: dict) -> str:
+        return build_prompt('visual', [('CONTENT', content_analysis, cls.CONTENT_PROMPT_FIELDS),
+                                       ('LAYOUT', layout_plan, cls.LAYOUT_PROMPT_FIELDS)])
+    
+    def _parse_visuals(self, response: str, layout_plan: dict) -> dict:
+        if compact_enabled():
+            visuals = parse_response('visual', response, COMPACT_VISUAL_SCHEMA)
+            visuals = expand_visuals(visuals) if visuals is not None else None
+        else:
+            visuals = parse_response('visual', response, self.RESPONSE_SCHEMA)
+        return visuals if visuals is not None else self._create_fallback_visuals(layout_plan)
+    
     def _create_fallback_visuals(self, layout_plan: dict) -> dict:
         """Clean, simple visual defaults."""
         elements = layout_plan.get('element_positions', [])
@@ -111,5 +200,6 @@ Prioritize educational clarity over visual complexity."""
                 {"type": "label", "font_size": 14, "color": "#34495E", "weight": "normal"}
             ],
             "overall_theme": "clean",
-            "accessibility_notes": "High contrast, colorblind safe"
+            "accessibility_notes": "High contrast, colorblind safe",
+            "fallback": True
         }
@@ -1,12 +1,29 @@
-﻿from flask import Flask, render_template, request
+﻿from flask import Flask, render_template, request, Response
 from flask_socketio import SocketIO, emit
 import logging
 import traceback
 import sys
 import os
 from concurrent.futures import ThreadPoolExecutor
+from eventlet import tpool
 from config import Config
 from agents.free_orchestrator import FreeVisualOrchestrator
+from services.diagram_store import DiagramStore
+from services.cache_service import normalize_question
+from services.single_flight import SingleFlight
+from services.warmup_service import WarmupService
+from services.prefetch_service import PrefetchService
+from services.gemini_service import FreeGeminiService
+from services.rate_limiter import get_rate_limiter, set_sleep_function
+from services.scheduler import FairScheduler, AdmissionRejected
+from services.cancellation import Cancelled, cancellation_stats, record_cancelled
+from services.deadline import Deadline, deadline_stats
+from services.hedging import hedging_stats
+from services.circuit_breaker import breaker_stats
+from services.async_providers import async_provider_stats
+from services.hub_monitor import HubStallMonitor, set_offload_function
+from services.structured_output import structured_output_stats
+from services.prompt_builder import prompt_token_stats
 
 # Setup logging
 logging.basicConfig(
@@ -33,6 +50,28 @@ socketio = SocketIO(
     ping_timeout=60,
     ping_interval=25
 )
+# Rate-limit waits yield to other greenlets instead of blocking the hub
+set_sleep_function(socketio.sleep)
+# Blocking SDK calls, waits and image work started from green threads run on real OS threads
+tpool.set_num_threads(Config.HUB_OFFLOAD_THREADS)
+set_offload_function(tpool.execute)
+# Measures hub scheduling lag and logs whatever is blocking it
+hub_monitor = HubStallMonitor()
+if Config.HUB_WATCHDOG_ENABLED:
+    hub_monitor.start(socketio.start_background_task, socketio.sleep)
+diagram_store = DiagramStore(Config.DIAGRAM_STORE_DIR)
+
+# Identical questions asked while one is still generating share a single pipeline run
+generation_flights = SingleFlight(
+    emit=lambda event, data, session_id: socketio.emit(event, data, room=session_id)
+)
+
+# Everything built on the orchestrator stays None if it fails to start; questions are
+# then refused instead of failing with NameError
+orchestrator = None
+warmup = None
+prefetcher = None
+
 # Initialize FREE orchestrator
 try:
     orchestrator = FreeVisualOrchestrator()
@@ -41,6 +80,41 @@ except Exception as e:
     logger.error(f"❌ Failed to initialize orchestrator: {e}")
     traceback.print_exc()
 
+# Background services are optional: the app serves live requests without them
+if orchestrator is not None:
+    try:
+        # Suggested topics are answered from cache right after a restart
+        warmup = WarmupService(orchestrator)
+        warmup.load()
+        if Config.WARMUP_REFRESH_ENABLED:
+            socketio.start_background_task(warmup.run_forever, socketio.sleep)
+    except Exception as e:
+        warmup = None
+        logger.error(f"❌ Failed to start topic warm-up: {e}")
+        traceback.print_exc()
+
+    try:
+        # Follow-up diagrams are generated only while no live request is running
+        prefetcher = PrefetchService(orchestrator, is_idle=lambda: generation_flights.in_flight() == 0)
+        orchestrator.analysis_listeners.append(prefetcher.on_content_analysis)
+        if Config.PREFETCH_ENABLED:
+            socketio.start_background_task(prefetcher.run_forever, socketio.sleep)
+    except Exception as e:
+        prefetcher = None
+        logger.error(f"❌ Failed to start follow-up prefetch: {e}")
+        traceback.print_exc()
+
+# Bounded queue and fixed worker pool; sessions share the workers fairly and queued
+# ones get position/ETA updates
+scheduler = FairScheduler(
+    spawn=socketio.start_background_task,
+    estimate_job_seconds=(orchestrator.estimated_generation_seconds if orchestrator is not None
+                          else lambda: Config.GENERATION_DEADLINE_SECONDS),
+    make_queue=socketio.server.eio.create_queue
+)
+scheduler.start()
+socketio.start_background_task(scheduler.run_status_loop, socketio.sleep)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -50,6 +124,66 @@ def health_check():
     """Health check endpoint for Docker"""
 
     return {'status': 'healthy', 'service': 'AI Tutor'}, 200
+
+@app.route('/diagrams/<digest>.svg')
+def serve_diagram(digest):
+    """Serve a stored diagram with a strong ETag and negotiated compression."""
+    if not diagram_store.contains(digest):
+        return {'error': 'Diagram not found'}, 404
+
+    headers = {
+        'ETag': f'"{digest}"',
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'Vary': 'Accept-Encoding'
+    }
+    # Content never changes for a digest, so any matching validator means unchanged
+    if digest in request.if_none_match or request.if_none_match.star_tag:
+        return Response(status=304, headers=headers)
+
+    for encoding in diagram_store.available_encodings():
+        if request.accept_encodings.quality(encoding) > 0:
+            body = diagram_store.read(digest, encoding)
+            if body is not None:
+                headers['Content-Encoding'] = encoding
+                break
+    else:
+        body = diagram_store.read(digest)
+
+    return Response(body, mimetype='image/svg+xml', headers=headers)
+
+@app.route('/metrics')
+def metrics():
+    """Cache and pipeline counters as JSON."""
+    report = {
+        'orchestrator_ready': orchestrator is not None,
+        'single_flight': generation_flights.stats(),
+        'scheduler': scheduler.stats(),
+        'cancellation': cancellation_stats(),
+        'deadlines': deadline_stats(),
+        'hedging': hedging_stats(),
+        'circuit_breakers': {'providers': breaker_stats()},
+        'async_providers': async_provider_stats(),
+        'hub': hub_monitor.stats(),
+        'structured_output': structured_output_stats(),
+        'prompt_tokens': prompt_token_stats(),
+        'gemini_usage': FreeGeminiService.usage_stats(),
+        'rate_limits': get_rate_limiter().stats()
+    }
+    if orchestrator is not None:
+        report.update({
+            'cache': orchestrator.cache_stats(),
+            'pipeline': orchestrator.pipeline_stats(),
+            'pipeline_modes': orchestrator.pipeline_mode_stats(),
+            'model_routing': orchestrator.router.stats(),
+        })
+        report['circuit_breakers']['fallback_stages'] = orchestrator.breaker_fallbacks
+    # Each background service may have failed to start on its own
+    if warmup is not None:
+        report['warmup'] = warmup.stats()
+    if prefetcher is not None:
+        report['prefetch'] = prefetcher.stats()
+    return report, 200
+
 @socketio.on('connect')
 def handle_connect():
     session_id = request.sid
@@ -60,6 +194,17 @@ def handle_connect():
 def handle_disconnect():
     session_id = request.sid
     logger.info(f"Client {session_id} disconnected")
+    abandon_generations(session_id)
+    scheduler.forget_session(session_id)
+
+def abandon_generations(session_id, keep_key=None):
+    """Cancel generations no connected session is waiting for any more."""
+    for flight in generation_flights.leave(session_id, keep_key):
+        if flight.job is not None and scheduler.cancel(flight.job):
+            # Never started: the whole pipeline's calls are saved
+            record_cancelled(dropped_before_start=True)
+            orchestrator.record_cancelled_from('fused' if flight.pipeline_mode == 'fused' else 'plan')
+        print(f"🛑 Cancelling abandoned generation: {flight.key}")
 
 @socketio.on('user_question')
 def handle_user_question(data):
@@ -71,120 +216,166 @@ def handle_user_question(data):
     if not question:
         emit('error', {'message': 'No question provided'})
         return
+    if orchestrator is None:
+        emit('error', {'message': 'The tutor failed to start; please try again later.', 'tier': 'FREE'})
+        return
 
     # Emit immediate confirmation
     emit('task_started', {'message': 'Processing your question...'})
     
-    # Start background task with proper error handling
-    socketio.start_background_task(safe_process_visual_generation, question, session_id)
-    print(f"🚀 Background task started for: {question}")
+    # A new question supersedes whatever this session was still waiting for
+    question_key = normalize_question(question)
+    abandon_generations(session_id, keep_key=question_key)
+    
+    flight, is_leader, missed_events = generation_flights.join(question_key, session_id)
+    if not is_leader:
+        # Same question already generating: replay what was sent so far and wait for the rest
+        print(f"🤝 Joined in-flight generation for: {question}")
+        for event, payload in missed_events:
+            emit(event, payload)
+        return
+    
+    # Staged or fused pipeline, per request or by A/B assignment of the session
+    flight.pipeline_mode = orchestrator.pick_pipeline_mode(session_id, data.get('pipeline_mode'))
+    
+    # Queue the generation behind other sessions' fair share
+    try:
+        flight.job = scheduler.submit(
+            session_id,
+            lambda: safe_process_visual_generation(question, flight),
+            on_status=lambda status: flight.publish('queue_status', status, replay=False)
+        )
+    except AdmissionRejected as e:
+        generation_flights.finish(flight)
+        emit('error', {'message': str(e), 'retry_after': round(e.retry_after, 1), 'tier': 'FREE'})
+        return
+    print(f"🚀 Generation queued for: {question}")
 
-def safe_process_visual_generation(question, session_id):
+def safe_process_visual_generation(question, flight):
     """Wrapper for process_free_visual_generation with comprehensive error handling."""
     try:
-        process_free_visual_generation(question, session_id)
+        process_free_visual_generation(question, flight)
+    except Cancelled:
+        record_cancelled()
+        print(f"🛑 Generation cancelled: {flight.cancel_token.reason}")
     except Exception as e:
         print(f"💥 FATAL ERROR in background task: {e}")
         traceback.print_exc()
         
         # Try to emit error to frontend
         try:
-            socketio.emit('error', {
+            flight.publish('error', {
                 'message': f'System error: {str(e)}',
                 'tier': 'FREE',
                 'fatal': True
-            }, room=session_id)
+            })
         except:
             print("❌ Could not emit error to frontend")
+    finally:
+        generation_flights.finish(flight)
+
+def process_free_visual_generation(question, flight):
+    """Process visual generation with robust error handling.
 
-def process_free_visual_generation(question, session_id):
-    """Process visual generation with robust error handling."""
+    Every event goes through flight.publish so coalesced waiters receive it too.
+    Raises Cancelled once no session is waiting for the result. Stages that overrun
+    their share of the deadline are answered with fallbacks instead of stalling.
+    """
+    session_id = flight.leader_session
+    cancel_token = flight.cancel_token
+    deadline = Deadline()
     
     try:
         print(f"🎯 Starting generation for session: {session_id}")
         
         # Step 1: Emit planning status
-        socketio.emit('status', {
+        flight.publish('status', {
             'step': 'planning', 
             'message': 'AI analyzing question...'
-        }, room=session_id)
+        })
         
-        # Get visual plan with timeout protection
-        visual_plan = None
-        try:
-            visual_plan = orchestrator.create_visual_plan_free(question)
+        def on_stage_done(stage, output):
+            # The explanation goes out as soon as the plan is ready, while the diagram is still being built
+            if stage != 'plan' or not output:
+                return
             print(f"📋 Visual plan created successfully")
-        except Exception as e:
-            print(f"❌ Visual plan creation failed: {e}")
-            raise Exception(f"Planning failed: {str(e)}")
+            flight.publish('explanation_ready', {
+                'explanation': output.get('explanation', 'Let me explain this topic...'),
+                'visual_type': output.get('visual_type', 'canvas_drawing'),
+                'free_tier': True
+            })
+            print(f"✅ Explanation sent")
+            if output.get('needs_image', False):
+                print(f"🖼️ Generating SVG diagram...")
+                flight.publish('status', {
+                    'step': 'generating', 
+                    'message': 'Creating educational diagram...'
+                })
         
-        if not visual_plan:
-            raise Exception("Visual plan is None")
+        # Plan and content analysis run in parallel; diagram stages start as their inputs are ready
+        result = orchestrator.run_lesson_pipeline(question, cancel_token=cancel_token, deadline=deadline,
+                                                  on_stage_done=on_stage_done, mode=flight.pipeline_mode)
         
-        # Send explanation
-        socketio.emit('explanation_ready', {
-            'explanation': visual_plan.get('explanation', 'Let me explain this topic...'),
-            'visual_type': visual_plan.get('visual_type', 'canvas_drawing'),
-            'free_tier': True
-        }, room=session_id)
-        print(f"✅ Explanation sent")
+        visual_plan = result.outputs.get('plan')
+        if not visual_plan:
+            error = result.errors.get('plan', 'Visual plan is None')
+            print(f"❌ Visual plan creation failed: {error}")
+            raise Exception(f"Planning failed: {str(error)}")
         
-        # Step 2: Generate diagram
+        # Step 2: Send the diagram
         if visual_plan.get('needs_image', False):
-            print(f"🖼️ Generating SVG diagram...")
-            socketio.emit('status', {
-                'step': 'generating', 
-                'message': 'Creating educational diagram...'
-            }, room=session_id)
+            image_result = result.outputs.get('render')
             
-            try:
-                image_result = orchestrator.generate_educational_diagram(question)
-                
-                if image_result and image_result.get('data'):
-                    socketio.emit('image_ready', {
-                        'image_data': image_result['data'],
-                        'source': 'multi_agent_svg'
-                    }, room=session_id)
-                    
-                    socketio.emit('canvas_instructions', {
-                        'instructions': [],
-                        'explanation': visual_plan['explanation'],
-                        'composition_type': 'multi_agent_complete',
-                        'svg_complete': True
-                    }, room=session_id)
-                    
-                    print(f"✅ SVG diagram sent")
+            if image_result and (image_result.get('url') or image_result.get('data')):
+                # Send the store URL so browsers can cache it; inline data only as a fallback
+                if image_result.get('url'):
+                    image_payload = {'image_url': image_result['url']}
                 else:
-                    raise Exception("SVG generation returned empty result")
-                    
-            except Exception as svg_error:
+                    image_payload = {'image_data': image_result['data']}
+                image_payload['source'] = 'multi_agent_svg'
+                flight.publish('image_ready', image_payload)
+                
+                flight.publish('canvas_instructions', {
+                    'instructions': [],
+                    'explanation': visual_plan['explanation'],
+                    'composition_type': 'multi_agent_complete',
+                    'svg_complete': True
+                })
+                
+                print(f"✅ SVG diagram sent")
+            else:
+                svg_error = next((result.errors[stage] for stage in ('content', 'layout', 'visual', 'render')
+                                  if stage in result.errors), "SVG generation returned empty result")
                 print(f"❌ SVG generation failed: {svg_error}")
                 # Fall back to canvas only
                 canvas_instructions = orchestrator.create_canvas_instructions(visual_plan)
-                socketio.emit('canvas_instructions', {
+                flight.publish('canvas_instructions', {
                     'instructions': canvas_instructions or [],
                     'explanation': visual_plan['explanation'],
                     'composition_type': 'canvas_only_free',
                     'svg_complete': False
-                }, room=session_id)
+                })
                 print(f"✅ Canvas fallback sent")
         else:
             # Canvas only mode
             print(f"🎨 Using canvas-only mode")
             canvas_instructions = orchestrator.create_canvas_instructions(visual_plan)
-            socketio.emit('canvas_instructions', {
+            flight.publish('canvas_instructions', {
                 'instructions': canvas_instructions or [],
                 'explanation': visual_plan['explanation'],
                 'composition_type': 'canvas_only_free',
                 'svg_complete': False
-            }, room=session_id)
+            })
             print(f"✅ Canvas instructions sent")
         
         # Final completion signal
-        socketio.emit('generation_complete', {
+        deadline.finish()
+        flight.publish('generation_complete', {
             'tier': 'FREE',
-            'success': True
-        }, room=session_id)
+            'success': True,
+            'degraded_stages': deadline.degraded,
+            'pipeline_mode': flight.pipeline_mode
+        })
         
         print(f"🎉 Generation completed successfully for session {session_id}")
         
@@ -192,10 +383,10 @@ def process_free_visual_generation(question, session_id):
         print(f"💥 Error in generation process: {e}")
         traceback.print_exc()
         
-        socketio.emit('error', {
+        flight.publish('error', {
             'message': f'Generation failed: {str(e)}',
             'tier': 'FREE'
-        }, room=session_id)
+        })
 
 if __name__ == '__main__':
     # Production configuration
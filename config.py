@@ -15,6 +15,7 @@ class Config:
     
     # Models
     GEMINI_MODEL = "gemini-2.5-flash"
+    GEMINI_LIGHT_MODEL = os.environ.get('GEMINI_LIGHT_MODEL', 'gemini-2.5-flash-lite')
     STABLE_DIFFUSION_MODEL = "stabilityai/stable-diffusion-xl-base-1.0"
     USE_PERPLEXITY_FOR_CONTENT = True  # Toggle to enable/disable
     USE_PERPLEXITY_FOR_CONTENT = True
@@ -34,3 +35,154 @@ class Config:
     
     # Rate limiting
     PERPLEXITY_RATE_LIMIT = 1.0  # seconds between calls
+
+    # Result caching
+    CACHE_DIR = os.environ.get('CACHE_DIR', 'temp/cache')  # Empty disables the disk tier
+    CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', 7 * 24 * 3600))
+    CACHE_MEMORY_ENTRIES = 256
+    CACHE_DISK_ENTRIES = 5000
+
+    # Shared cache across worker processes (e.g. redis://redis:6379/0)
+    REDIS_URL = os.environ.get('REDIS_URL')
+    REDIS_SOCKET_TIMEOUT = 0.5
+    NEAR_CACHE_TTL_SECONDS = 60  # Local copies of Redis entries are refreshed after this
+
+    # Content-addressed store for rendered diagrams, served at /diagrams/<sha256>.svg
+    DIAGRAM_STORE_DIR = os.environ.get('DIAGRAM_STORE_DIR', 'temp/diagrams')
+
+    # Near-duplicate question matching (MinHash/LSH)
+    SIMILARITY_THRESHOLD = float(os.environ.get('SIMILARITY_THRESHOLD', 0.6))
+    # Near-duplicates tried in order when the closest one is no longer cached
+    SIMILARITY_MAX_CANDIDATES = int(os.environ.get('SIMILARITY_MAX_CANDIDATES', 3))
+    SIMILARITY_INDEX_PATH = os.path.join(CACHE_DIR, 'question_index.jsonl') if CACHE_DIR else None
+
+    # Startup warm-up of the suggested-topic library
+    WARMUP_LIBRARY_PATH = 'data/topic_library.json'  # Bundled with the app
+    WARMUP_STATE_PATH = 'temp/topic_library.json'  # Entries regenerated at runtime
+    WARMUP_MAX_AGE_SECONDS = 7 * 24 * 3600
+    WARMUP_INTERVAL_SECONDS = 30
+    WARMUP_RETRY_SECONDS = 30 * 60  # Back-off after a failed regeneration
+    WARMUP_HEADROOM_CALLS = 1  # Requests left in a provider's bucket for live traffic before each warm-up call
+    WARMUP_REFRESH_ENABLED = os.environ.get('WARMUP_REFRESH_ENABLED', 'true').lower() == 'true'
+
+    # Image positioning analysis
+    POSITIONING_MAX_SIDE = 512  # Longest side sent to the vision model
+    POSITIONING_CACHE_ENTRIES = 256
+    POSITIONING_HASH_DISTANCE = 6  # Max differing dHash bits to reuse an analysis
+    POSITIONING_MAX_CONCURRENT_DECODES = 2
+
+    # Static prompt registration (explicit context caching needs a minimum prompt size)
+    GEMINI_EXPLICIT_PROMPT_CACHE = os.environ.get('GEMINI_EXPLICIT_PROMPT_CACHE', 'true').lower() == 'true'
+    GEMINI_PROMPT_CACHE_MIN_TOKENS = 1024
+    GEMINI_PROMPT_CACHE_TTL_SECONDS = 3600
+    GEMINI_PROMPT_MODELS_MAX = 32
+
+    # Idle-quota prefetch of likely follow-up questions
+    PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', 'true').lower() == 'true'
+    PREFETCH_MAX_PER_TOPIC = 3
+    PREFETCH_QUEUE_SIZE = 50
+    PREFETCH_HEADROOM_CALLS = 2  # More than warm-up keeps free: prefetching is the lowest priority
+    PREFETCH_POLL_SECONDS = 5
+
+    # Shared token-bucket rate limits per provider (requests and tokens per minute)
+    RATE_LIMIT_STATE_PATH = 'temp/rate_limits.json'
+    # Requests a provider may make back to back; the rest of its per-minute limit is spread evenly
+    RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', 3))
+    GEMINI_TOKENS_PER_MINUTE = int(os.environ.get('GEMINI_TOKENS_PER_MINUTE', 250000))
+    GEMINI_LIGHT_RATE_LIMIT = int(os.environ.get('GEMINI_LIGHT_RATE_LIMIT', 15))  # Free-tier quota is per model
+    RATE_LIMITS = {
+        'gemini': {'rpm': GEMINI_RATE_LIMIT, 'tpm': GEMINI_TOKENS_PER_MINUTE},
+        'gemini_light': {'rpm': GEMINI_LIGHT_RATE_LIMIT, 'tpm': GEMINI_TOKENS_PER_MINUTE},
+        'perplexity': {'rpm': 60 / PERPLEXITY_RATE_LIMIT},
+        'huggingface': {'rpm': HF_RATE_LIMIT / 60},
+    }
+    # Per-provider circuit breakers and retries of transient provider errors
+    CIRCUIT_BREAKER = {'failure_threshold': 3, 'reset_seconds': 15.0, 'max_reset_seconds': 300.0,
+                       'half_open_probes': 1}
+    RETRY_MAX_ATTEMPTS = 3
+    RETRY_BASE_SECONDS = 0.5
+    RETRY_MAX_BACKOFF_SECONDS = 8.0
+    RETRY_MAX_WAIT_SECONDS = 10.0  # Longer Retry-After hints are not waited out; we fall back instead
+
+    # How often a rate-limit wait checks whether its generation was cancelled
+    CANCEL_POLL_SECONDS = 0.25
+
+    # Fair-share scheduling of generations across sessions
+    GENERATION_QUEUE_MAX_DEPTH = int(os.environ.get('GENERATION_QUEUE_MAX_DEPTH', 20))
+    SCHEDULER_MAX_PENDING_PER_SESSION = 2
+    SCHEDULER_MAX_JOBS_PER_MINUTE = 6
+    SCHEDULER_DEFAULT_STAGE_SECONDS = 4.0  # Used until real stage latencies are observed
+    QUEUE_STATUS_INTERVAL_SECONDS = 2
+
+    # Threads running pipeline stages (and, separately, their budgeted provider calls)
+    PIPELINE_STAGE_THREADS = 8
+
+    # Hub stall watchdog: a green thread ticks every interval and a real thread logs the
+    # hub's stack when a tick is threshold overdue. Blocking calls made on the hub run in
+    # eventlet's OS thread pool instead.
+    HUB_WATCHDOG_ENABLED = os.environ.get('HUB_WATCHDOG_ENABLED', 'true').lower() == 'true'
+    HUB_WATCHDOG_INTERVAL_SECONDS = 0.1
+    HUB_STALL_THRESHOLD_SECONDS = 0.5
+    HUB_STALL_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    HUB_OFFLOAD_THREADS = 20
+
+    # Plan, content and visual stages await their Gemini calls on one shared asyncio
+    # loop instead of each holding a thread; calls in flight are capped per provider
+    ASYNC_PROVIDERS = os.environ.get('ASYNC_PROVIDERS', 'true').lower() == 'true'
+    ASYNC_MAX_IN_FLIGHT = {'gemini': 200, 'perplexity': 50}
+
+    # Generations the scheduler runs at once. A running generation holds one offload
+    # thread while it waits on its pipeline; with async providers that is all it holds,
+    # so half the offload pool may run (never more than the Gemini in-flight cap allows
+    # at four calls each). Blocking providers also hold a stage thread per call.
+    GENERATION_WORKERS = int(os.environ.get(
+        'GENERATION_WORKERS',
+        min(HUB_OFFLOAD_THREADS // 2, ASYNC_MAX_IN_FLIGHT['gemini'] // 4) if ASYNC_PROVIDERS else 2
+    ))
+
+    # End-to-end budget for one generation, shared out across its stages by weight;
+    # a stage that overruns its share is replaced by the agent's fallback output
+    GENERATION_DEADLINE_SECONDS = float(os.environ.get('GENERATION_DEADLINE_SECONDS', 45))
+    DEADLINE_STAGE_SHARES = {'plan': 0.25, 'content': 0.2, 'layout': 0.25, 'visual': 0.2, 'render': 0.1}
+    DEADLINE_COMBINED_STAGES = {'fused': ('plan', 'content', 'layout', 'visual')}
+
+    # Fused mode: one Gemini call returns explanation, content, layout and visuals together.
+    # Requests may ask for a mode; otherwise this share of sessions is assigned to fused (A/B).
+    FUSED_PIPELINE_SHARE = float(os.environ.get('FUSED_PIPELINE_SHARE', 0.0))
+
+    # Layout and visual answers in the short-key dialect of services/wire_format.py; Gemini
+    # usage is labelled '<agent>.compact' so tokens and latency can be compared with the
+    # verbose format (set to false to measure the baseline)
+    COMPACT_WIRE_FORMAT = os.environ.get('COMPACT_WIRE_FORMAT', 'true').lower() == 'true'
+
+    # Complexity routing: the plan and content stages of questions a local classifier
+    # scores below ROUTER_HEAVY_SCORE go to the light model tier, the rest to the heavy one
+    MODEL_ROUTING_ENABLED = os.environ.get('MODEL_ROUTING_ENABLED', 'true').lower() == 'true'
+    # rate_limit names the tier's quota bucket, which also keys its circuit breaker
+    MODEL_TIERS = {
+        'light': {'model': GEMINI_LIGHT_MODEL, 'rate_limit': 'gemini_light'},
+        'heavy': {'model': GEMINI_MODEL, 'rate_limit': 'gemini'},
+    }
+    ROUTER_HEAVY_SCORE = 1
+    ROUTER_SHORT_QUESTION_WORDS = 8
+    ROUTER_LONG_QUESTION_WORDS = 20
+    ROUTER_MEMO_ENTRIES = 256
+
+    # Estimated-token ceiling for the variable (user) part of each stage's prompt; the
+    # prompt builder drops trailing list items from the upstream output to stay under it
+    PROMPT_TOKEN_BUDGETS = {'layout': 1200, 'visual': 1600}
+
+    # Hedged requests: a backup provider is asked when the primary is slower than its
+    # usual tail latency; first valid answer wins. Configured per agent.
+    HEDGE_DEFAULT_DELAY_SECONDS = 8.0  # Used until min_samples primary latencies are known
+    AGENT_HEDGING = {
+        'layout': {
+            'enabled': os.environ.get('HEDGE_LAYOUT', 'true').lower() == 'true',
+            'primary': 'gemini',
+            'backup': 'perplexity',
+            'percentile': 90,
+            'min_samples': 10,
+            'max_ratio': 0.2,  # At most ~1 hedge per 5 calls
+            'headroom_calls': 2,  # Backup quota that must stay free for non-hedged use
+        },
+    }
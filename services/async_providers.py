@@ -0,0 +1,179 @@
+# Create: services/async_providers.py
+import asyncio
+import functools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict
+
+from config import Config
+from services.circuit_breaker import CircuitOpen, call_with_breaker_async
+from services.hub_monitor import offload
+from services.rate_limiter import get_rate_limiter
+
+
+class ProviderLoop:
+    """One asyncio event loop, on its own OS thread, that all async provider calls share.
+
+    Pending calls are coroutines rather than blocked threads, so the loop can hold
+    hundreds of them at once. Sync code hands work over with submit() / run().
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='provider-loop', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedule coro on the loop and return a concurrent.futures.Future for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: float = None):
+        """Run coro on the loop and block the calling thread (never the hub) until it finishes."""
+        return offload(self.submit(coro).result, timeout)
+
+
+_provider_loop = None
+_provider_loop_lock = threading.Lock()
+
+
+def get_provider_loop() -> ProviderLoop:
+    global _provider_loop
+    with _provider_loop_lock:
+        if _provider_loop is None:
+            _provider_loop = ProviderLoop()
+        return _provider_loop
+
+
+async def run_blocking(func: Callable[..., Any], *args) -> Any:
+    """Run a blocking call (cache, disk, SDK setup) off the loop so it does not stall other calls."""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+
+# Per-provider cap on calls in flight; semaphores belong to the loop that created them
+_slots: Dict[str, asyncio.Semaphore] = {}
+_in_flight: Dict[str, Dict[str, int]] = {}
+_in_flight_lock = threading.Lock()
+
+
+@asynccontextmanager
+async def provider_slot(provider: str):
+    if provider not in _slots:
+        _slots[provider] = asyncio.Semaphore(Config.ASYNC_MAX_IN_FLIGHT.get(provider, 50))
+    async with _slots[provider]:
+        with _in_flight_lock:
+            stats = _in_flight.setdefault(provider, {'calls': 0, 'in_flight': 0, 'peak_in_flight': 0})
+            stats['calls'] += 1
+            stats['in_flight'] += 1
+            stats['peak_in_flight'] = max(stats['peak_in_flight'], stats['in_flight'])
+        try:
+            yield
+        finally:
+            with _in_flight_lock:
+                _in_flight[provider]['in_flight'] -= 1
+
+
+def async_provider_stats() -> Dict[str, Any]:
+    with _in_flight_lock:
+        report = {provider: dict(stats) for provider, stats in _in_flight.items()}
+    for provider, limit in Config.ASYNC_MAX_IN_FLIGHT.items():
+        report.setdefault(provider, {'calls': 0, 'in_flight': 0, 'peak_in_flight': 0})['max_in_flight'] = limit
+    return report
+
+
+class AsyncGeminiService:
+    """Async counterpart of FreeGeminiService.generate_response.
+
+    Shares the prompt-bound models, usage accounting, rate limiter and circuit
+    breaker with the sync service; the SDK keeps one gRPC channel per event loop,
+    so every call on the provider loop reuses the same connections.
+    """
+
+    def __init__(self):
+        import google.generativeai as genai
+
+        genai.configure(api_key=Config.GOOGLE_API_KEY)
+
+    async def generate_response(self, question: str, system_prompt: str, label: str = 'default',
+                                cancel_token=None, response_schema: dict = None, tier: str = None) -> str:
+        from services.gemini_service import FreeGeminiService, estimate_tokens, request_options
+
+        model_name, quota, label = FreeGeminiService.resolve_tier(tier, label)
+        try:
+            # May register cached content with the API the first time a prompt is seen
+            model = await run_blocking(FreeGeminiService._model_for_prompt, system_prompt, response_schema,
+                                       model_name)
+
+            async def attempt():
+                await get_rate_limiter().acquire_async(
+                    quota, tokens=estimate_tokens(system_prompt) + estimate_tokens(question),
+                    cancel_token=cancel_token)
+                async with provider_slot('gemini'):
+                    started = time.time()
+                    response = await model.generate_content_async(question or "Respond now.",
+                                                                  **request_options(cancel_token))
+                    return response, time.time() - started
+
+            response, latency = await call_with_breaker_async(quota, attempt, cancel_token)
+            FreeGeminiService._record_usage(label, response, latency)
+            return response.text
+        except CircuitOpen:
+            raise
+        except Exception as e:
+            raise Exception(f"FREE Gemini API error: {str(e)}")
+
+
+class AsyncPerplexityService:
+    """Async counterpart of PerplexityService.generate_content on one shared HTTP connection pool."""
+
+    _client = None
+
+    def __init__(self):
+        self.api_key = os.environ.get("PERPLEXITY_API_KEY")
+        self.model = "sonar-pro"
+
+    @classmethod
+    def _shared_client(cls, api_key: str):
+        if cls._client is None:
+            import httpx
+            from perplexity import AsyncPerplexity
+
+            limit = Config.ASYNC_MAX_IN_FLIGHT.get('perplexity', 50)
+            cls._client = AsyncPerplexity(api_key=api_key, http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit)))
+        return cls._client
+
+    async def generate_content(self, prompt: str, system_prompt: str = None, cancel_token=None,
+                               response_schema: dict = None) -> Dict[str, Any]:
+        from services.perplexity_service import PerplexityService
+
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        extra = PerplexityService.response_format(response_schema)
+
+        async def attempt():
+            await get_rate_limiter().acquire_async('perplexity', cancel_token=cancel_token)
+            async with provider_slot('perplexity'):
+                return await self._shared_client(self.api_key).chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=0.1,
+                    max_tokens=4000,
+                    top_p=0.9,
+                    **extra,
+                    **PerplexityService.request_timeout(cancel_token)
+                )
+
+        try:
+            completion = await call_with_breaker_async('perplexity', attempt, cancel_token)
+            return PerplexityService.parse_content(completion.choices[0].message.content)
+        except Exception as e:
+            print(f"Perplexity API error: {e}")
+            return PerplexityService.fallback_content(e)
@@ -0,0 +1,433 @@
+# Create: services/cache_service.py
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different phrasings share a cache key."""
+    text = unicodedata.normalize('NFKC', question or '').lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def stable_hash(value: Any) -> str:
+    """Canonical hash of a JSON-compatible value, independent of dict key order."""
+    canonical = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _dumps(value: Any) -> str:
+    """Compact JSON serialization used by every cache tier."""
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+class MemoryTier:
+    """In-process LRU tier with per-entry expiry."""
+
+    name = 'memory'
+
+    def __init__(self, max_entries: int = 256, max_ttl: float = None):
+        self.max_entries = max_entries
+        # Caps entry lifetime when this tier is a near-cache in front of a shared store
+        self.max_ttl = max_ttl
+        # Called with each key dropped by expiry or LRU eviction (not by delete)
+        self.on_evict: Optional[Callable[[str], None]] = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evicted(self, keys: List[str]):
+        if self.on_evict:
+            for key in keys:
+                self.on_evict(key)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            expired = bool(expires_at and expires_at < time.time())
+            if expired:
+                del self._entries[key]
+            else:
+                self._entries.move_to_end(key)
+        if expired:
+            self._evicted([key])
+            return None
+        return payload
+
+    def set(self, key: str, payload: str, ttl: float = None):
+        if self.max_ttl:
+            ttl = min(ttl, self.max_ttl) if ttl else self.max_ttl
+        expires_at = time.time() + ttl if ttl else 0
+        evicted = []
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+        self._evicted(evicted)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskTier:
+    """Persistent tier storing one JSON file per entry, evicting least recently used files."""
+
+    name = 'disk'
+
+    def __init__(self, directory: str, max_entries: int = 5000):
+        self.directory = directory
+        self.max_entries = max_entries
+        # Called with each key dropped by expiry or pruning (not by delete)
+        self.on_evict: Optional[Callable[[str], None]] = None
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get('key') != key:
+            return None
+        expires_at = entry.get('expires_at', 0)
+        if expires_at and expires_at < time.time():
+            self.delete(key)
+            if self.on_evict:
+                self.on_evict(key)
+            return None
+
+        # Touch the file so pruning keeps recently read entries
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry.get('payload')
+
+    def set(self, key: str, payload: str, ttl: float = None):
+        expires_at = time.time() + ttl if ttl else 0
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(_dumps({'key': key, 'expires_at': expires_at, 'payload': payload}))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Disk cache write failed: {e}")
+            return
+
+        with self._lock:
+            self._writes_since_prune += 1
+            should_prune = self._writes_since_prune >= max(1, self.max_entries // 10)
+            if should_prune:
+                self._writes_since_prune = 0
+        if should_prune:
+            self.prune()
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def prune(self):
+        """Drop expired entries, then the least recently used ones above max_entries."""
+        now = time.time()
+        files = []
+        evicted = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                expires_at = entry.get('expires_at', 0)
+                if expires_at and expires_at < now:
+                    os.remove(path)
+                    evicted.append(entry.get('key'))
+                    continue
+                files.append((os.path.getmtime(path), path, entry.get('key')))
+            except (OSError, ValueError):
+                continue
+
+        files.sort()
+        for _, path, key in files[:max(0, len(files) - self.max_entries)]:
+            try:
+                os.remove(path)
+                evicted.append(key)
+            except OSError:
+                pass
+
+        if self.on_evict:
+            for key in evicted:
+                if key:
+                    self.on_evict(key)
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+
+
+class RedisTier:
+    """Shared tier backed by Redis so every worker process sees the same entries.
+
+    Payloads above a small size are zlib-compressed. Any client exposing get, set(ex=),
+    delete and pipeline() works, so an in-memory fake can stand in for tests.
+    Connection errors are treated as misses so a Redis outage only costs hit rate.
+    """
+
+    name = 'redis'
+    COMPRESS_MIN_BYTES = 512
+
+    def __init__(self, client, prefix: str = 'aitutor:'):
+        self.client = client
+        self.prefix = prefix
+        self._errors = 0
+
+    def _encode(self, payload: str) -> bytes:
+        raw = payload.encode('utf-8')
+        if len(raw) >= self.COMPRESS_MIN_BYTES:
+            return b'z' + zlib.compress(raw, 6)
+        return b'j' + raw
+
+    def _decode(self, value) -> Optional[str]:
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        marker, body = value[:1], value[1:]
+        if marker == b'z':
+            body = zlib.decompress(body)
+        return body.decode('utf-8')
+
+    def _failed(self, action: str, error: Exception):
+        self._errors += 1
+        if self._errors == 1 or self._errors % 100 == 0:
+            print(f"⚠️ Redis cache {action} failed ({self._errors} errors): {error}")
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            return self._decode(self.client.get(self.prefix + key))
+        except Exception as e:
+            self._failed('get', e)
+            return None
+
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        """Fetch several keys in one round trip."""
+        try:
+            pipe = self.client.pipeline()
+            for key in keys:
+                pipe.get(self.prefix + key)
+            return [self._decode(value) for value in pipe.execute()]
+        except Exception as e:
+            self._failed('pipelined get', e)
+            return [None] * len(keys)
+
+    def set(self, key: str, payload: str, ttl: float = None):
+        try:
+            self.client.set(self.prefix + key, self._encode(payload), ex=int(ttl) if ttl else None)
+        except Exception as e:
+            self._failed('set', e)
+
+    def delete(self, key: str):
+        try:
+            self.client.delete(self.prefix + key)
+        except Exception as e:
+            self._failed('delete', e)
+
+
+class TieredCache:
+    """Read-through cache over ordered tiers; hits in slower tiers are copied into faster ones."""
+
+    def __init__(self, namespace: str, tiers: list, ttl: float = None):
+        self.namespace = namespace
+        self.tiers = tiers
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._hits = {tier.name: 0 for tier in tiers}
+        self._misses = 0
+        self._sets = 0
+        self._eviction_listeners: List[Callable[[str], None]] = []
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def add_eviction_listener(self, listener: Callable[[str], None]):
+        """Call listener with each key whose entry expires or is evicted from the last tier.
+
+        Only the last tier holds the authoritative copy; entries dropped from faster tiers
+        are still cached. Redis expires keys silently, so callers relying on this must also
+        treat a miss on a key they expected as a removal.
+        """
+        self._eviction_listeners.append(listener)
+        if hasattr(self.tiers[-1], 'on_evict'):
+            self.tiers[-1].on_evict = self._evicted
+
+    def _evicted(self, full_key: str):
+        prefix = f"{self.namespace}:"
+        if not full_key.startswith(prefix):
+            return
+        for listener in self._eviction_listeners:
+            try:
+                listener(full_key[len(prefix):])
+            except Exception as e:
+                print(f"⚠️ Cache eviction listener failed: {e}")
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a fresh copy of the cached value, or None on a miss."""
+        full_key = self._key(key)
+        for index, tier in enumerate(self.tiers):
+            payload = tier.get(full_key)
+            if payload is None:
+                continue
+            for faster in self.tiers[:index]:
+                faster.set(full_key, payload, self.ttl)
+            with self._lock:
+                self._hits[tier.name] += 1
+            return json.loads(payload)
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Fetch several candidate keys for one logical lookup.
+
+        Tiers supporting pipelined reads are queried in a single round trip. The call
+        counts as one hit if any key is found, otherwise as one miss.
+        """
+        full_keys = [self._key(key) for key in keys]
+        found = {}
+        hit_tier = None
+        for index, tier in enumerate(self.tiers):
+            pending = [k for k in full_keys if k not in found]
+            if not pending:
+                break
+            if hasattr(tier, 'get_many'):
+                payloads = tier.get_many(pending)
+            else:
+                payloads = [tier.get(k) for k in pending]
+            for full_key, payload in zip(pending, payloads):
+                if payload is None:
+                    continue
+                for faster in self.tiers[:index]:
+                    faster.set(full_key, payload, self.ttl)
+                found[full_key] = payload
+                hit_tier = hit_tier or tier.name
+
+        with self._lock:
+            if hit_tier:
+                self._hits[hit_tier] += 1
+            else:
+                self._misses += 1
+        prefix_len = len(self.namespace) + 1
+        return {full_key[prefix_len:]: json.loads(payload) for full_key, payload in found.items()}
+
+    def contains_many(self, keys: List[str]) -> set:
+        """Keys that are cached in any tier; not counted in hit statistics."""
+        present = set()
+        for tier in self.tiers:
+            pending = [key for key in keys if key not in present]
+            if not pending:
+                break
+            full_keys = [self._key(key) for key in pending]
+            if hasattr(tier, 'get_many'):
+                payloads = tier.get_many(full_keys)
+            else:
+                payloads = [tier.get(k) for k in full_keys]
+            present.update(key for key, payload in zip(pending, payloads) if payload is not None)
+        return present
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        payload = _dumps(value)
+        full_key = self._key(key)
+        for tier in self.tiers:
+            tier.set(full_key, payload, ttl or self.ttl)
+        with self._lock:
+            self._sets += 1
+
+    def delete(self, key: str):
+        full_key = self._key(key)
+        for tier in self.tiers:
+            tier.delete(full_key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = dict(self._hits)
+            misses = self._misses
+            sets = self._sets
+        total_hits = sum(hits.values())
+        lookups = total_hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'sets': sets,
+            'hit_rate': round(total_hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+_redis_client = None
+
+
+def get_redis_client():
+    """Shared Redis client for Config.REDIS_URL, or None when Redis is not configured."""
+    global _redis_client
+    from config import Config
+
+    if _redis_client is None and Config.REDIS_URL and redis is not None:
+        _redis_client = redis.Redis.from_url(
+            Config.REDIS_URL,
+            socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=Config.REDIS_SOCKET_TIMEOUT
+        )
+    return _redis_client
+
+
+def create_result_cache(namespace: str) -> TieredCache:
+    """Build the standard cache configured in Config.
+
+    With Redis configured, a short-lived in-process near-cache sits in front of the
+    shared Redis tier. Otherwise results live in memory backed by the local disk tier.
+    """
+    from config import Config
+
+    client = get_redis_client()
+    if client is not None:
+        tiers = [
+            MemoryTier(Config.CACHE_MEMORY_ENTRIES, max_ttl=Config.NEAR_CACHE_TTL_SECONDS),
+            RedisTier(client)
+        ]
+    else:
+        if Config.REDIS_URL and redis is None:
+            print("⚠️ REDIS_URL is set but the redis package is not installed; using local cache")
+        tiers = [MemoryTier(Config.CACHE_MEMORY_ENTRIES)]
+        if Config.CACHE_DIR:
+            tiers.append(DiskTier(os.path.join(Config.CACHE_DIR, namespace), Config.CACHE_DISK_ENTRIES))
+    return TieredCache(namespace, tiers, ttl=Config.CACHE_TTL_SECONDS)
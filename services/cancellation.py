@@ -0,0 +1,107 @@
+# Create: services/cancellation.py
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# Shortest timeout given to a provider request, however close its deadline
+MIN_REQUEST_TIMEOUT_SECONDS = 1.0
+
+
+class Cancelled(BaseException):
+    """Raised inside a pipeline whose result nobody is waiting for any more.
+
+    A BaseException (like asyncio.CancelledError) so the agents' broad
+    `except Exception` fallbacks do not turn a cancellation into a fallback result.
+    """
+
+
+class CancellationToken:
+    """Cooperative cancellation flag checked between stages and while waiting for quota.
+
+    A child token (parent=...) is cancelled on its own or together with its parent,
+    so one stage can be abandoned without cancelling the whole generation. A token
+    with expires_at also tells provider calls how long their requests may take. A
+    background token's admit(provider) is asked before each provider call takes
+    rate-limit capacity; once it says no, the token is cancelled.
+    """
+
+    def __init__(self, parent: 'CancellationToken' = None, expires_at: float = None,
+                 admit: Callable[[str], bool] = None):
+        self.parent = parent
+        self.expires_at = expires_at
+        self.admit = admit
+        self._reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason: str = 'cancelled'):
+        if not self._event.is_set():
+            self._reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    @property
+    def reason(self):
+        if self._event.is_set() or self.parent is None:
+            return self._reason
+        return self.parent.reason
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise Cancelled(self.reason)
+
+    def raise_if_not_admitted(self, provider: str):
+        """Cancel the background work and raise Cancelled if a call to provider may not start now."""
+        token = self
+        while token is not None:
+            if token.admit is not None and not token.admit(provider):
+                token.cancel(f"{provider} capacity is kept for live requests")
+                break
+            token = token.parent
+        self.raise_if_cancelled()
+
+    def time_left(self) -> Optional[float]:
+        """Seconds until the earliest expires_at of this token and its parents, or None if none is set."""
+        expiries = []
+        token = self
+        while token is not None:
+            if token.expires_at is not None:
+                expiries.append(token.expires_at)
+            token = token.parent
+        return min(expiries) - time.time() if expiries else None
+
+
+def request_timeout(cancel_token: Optional[CancellationToken]) -> Optional[float]:
+    """Timeout for a provider request made under cancel_token, or None when it has no deadline."""
+    time_left = cancel_token.time_left() if cancel_token is not None else None
+    if time_left is None:
+        return None
+    return max(MIN_REQUEST_TIMEOUT_SECONDS, time_left)
+
+
+_stats = {'cancelled_generations': 0, 'dropped_before_start': 0, 'reservations_released': 0}
+_calls_avoided: Dict[str, int] = {}
+_stats_lock = threading.Lock()
+
+
+def record_cancelled(dropped_before_start: bool = False):
+    with _stats_lock:
+        _stats['dropped_before_start' if dropped_before_start else 'cancelled_generations'] += 1
+
+
+def record_calls_avoided(calls: Dict[str, int]):
+    with _stats_lock:
+        for provider, count in calls.items():
+            _calls_avoided[provider] = _calls_avoided.get(provider, 0) + count
+
+
+def record_reservation_released():
+    with _stats_lock:
+        _stats['reservations_released'] += 1
+
+
+def cancellation_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats, calls_avoided=dict(_calls_avoided))
@@ -0,0 +1,243 @@
+# Create: services/circuit_breaker.py
+import asyncio
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from config import Config
+from services.cancellation import Cancelled
+from services.rate_limiter import pause, pause_async
+
+# Gemini puts the server's retry hint in the error text rather than a header
+_RETRY_HINT_PATTERNS = (
+    re.compile(r'retry in (\d+(?:\.\d+)?)\s*s', re.IGNORECASE),
+    re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)', re.IGNORECASE),
+)
+
+
+class CircuitOpen(Exception):
+    """A provider's breaker is open: it recently kept failing, so calls fail fast locally."""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} circuit open, retry in {retry_after:.1f}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one provider.
+
+    failure_threshold consecutive transient failures (or a 429 carrying a
+    Retry-After) open it. While open every call fails fast with CircuitOpen. After
+    the cool-down a limited number of half-open probe calls go through: a success
+    closes the breaker, a failure re-opens it with a doubled, jittered cool-down.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_seconds: float = 15.0,
+                 max_reset_seconds: float = 300.0, half_open_probes: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.max_reset_seconds = max_reset_seconds
+        self.half_open_probes = half_open_probes
+        self.state = 'closed'
+        self._failures = 0
+        self._trips = 0  # Consecutive openings without a successful probe in between
+        self._open_until = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'failures': 0, 'short_circuited': 0, 'opened': 0}
+
+    def is_open(self) -> bool:
+        """True while calls would be rejected (open and still cooling down)."""
+        with self._lock:
+            return self.state == 'open' and time.time() < self._open_until
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpen."""
+        with self._lock:
+            now = time.time()
+            if self.state == 'open':
+                if now < self._open_until:
+                    self._stats['short_circuited'] += 1
+                    raise CircuitOpen(self.name, self._open_until - now)
+                self.state = 'half_open'
+                self._probes = 0
+            if self.state == 'half_open':
+                if self._probes >= self.half_open_probes:
+                    self._stats['short_circuited'] += 1
+                    raise CircuitOpen(self.name, self.reset_seconds)
+                self._probes += 1
+            self._stats['calls'] += 1
+
+    def record_success(self):
+        with self._lock:
+            if self.state == 'half_open':
+                print(f"✅ {self.name} circuit closed")
+            self.state = 'closed'
+            self._failures = 0
+            self._trips = 0
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self._stats['failures'] += 1
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold or retry_after:
+                self._open(retry_after)
+
+    def release(self):
+        """A call was abandoned (e.g. cancelled) without telling us anything about the provider."""
+        with self._lock:
+            if self.state == 'half_open' and self._probes > 0:
+                self._probes -= 1
+
+    def _open(self, retry_after: Optional[float]):
+        if retry_after:
+            # The server said when to come back; the first call after that is the probe
+            cooldown = retry_after
+        else:
+            cooldown = min(self.max_reset_seconds, self.reset_seconds * 2 ** self._trips)
+            cooldown = random.uniform(cooldown / 2, cooldown)
+        self._open_until = time.time() + cooldown
+        if self.state != 'open':
+            self._stats['opened'] += 1
+            print(f"🔌 {self.name} circuit open for {self._open_until - time.time():.1f}s")
+        self.state = 'open'
+        self._trips += 1
+        self._failures = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            report = dict(self._stats, state=self.state)
+            if self.state == 'open':
+                report['open_for_s'] = round(max(0.0, self._open_until - time.time()), 1)
+            return report
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    for candidate in (getattr(error, 'status_code', None),
+                      getattr(getattr(error, 'response', None), 'status_code', None),
+                      getattr(error, 'code', None)):
+        try:
+            if candidate is not None:
+                return int(candidate)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    value = headers.get('retry-after') if hasattr(headers, 'get') else None
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    for pattern in _RETRY_HINT_PATTERNS:
+        match = pattern.search(str(error))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def classify_error(error: Exception) -> Tuple[bool, Optional[float]]:
+    """(transient, retry_after) for a provider error.
+
+    Rate limiting, server errors, timeouts and connection problems are transient;
+    other client errors (bad request, auth) are not and would fail again on retry.
+    """
+    status = _status_code(error)
+    if status is not None:
+        transient = status in (408, 429) or status >= 500
+    else:
+        name = type(error).__name__.lower()
+        transient = isinstance(error, (TimeoutError, ConnectionError)) or 'timeout' in name or 'connection' in name
+    return transient, _retry_after(error) if transient else None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(Config.RETRY_MAX_BACKOFF_SECONDS, Config.RETRY_BASE_SECONDS * 2 ** attempt))
+    return max(delay, retry_after or 0.0)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider, **Config.CIRCUIT_BREAKER)
+        return _breakers[provider]
+
+
+def call_with_breaker(provider: str, call: Callable[[], Any], cancel_token=None) -> Any:
+    """Run call through the provider's breaker, retrying transient failures with backoff.
+
+    Raises CircuitOpen straight away while the breaker is open. A Retry-After longer
+    than RETRY_MAX_WAIT_SECONDS is not waited out: the breaker stays open for it and
+    the error is raised so the caller can fall back.
+    """
+    breaker = get_breaker(provider)
+    for attempt in range(Config.RETRY_MAX_ATTEMPTS):
+        breaker.before_call()
+        try:
+            result = call()
+        except Cancelled:
+            breaker.release()
+            raise
+        except Exception as e:
+            transient, retry_after = classify_error(e)
+            if not transient:
+                # The provider answered; the request itself was bad
+                breaker.record_success()
+                raise
+            breaker.record_failure(retry_after)
+            delay = backoff_delay(attempt, retry_after)
+            if attempt + 1 >= Config.RETRY_MAX_ATTEMPTS or delay > Config.RETRY_MAX_WAIT_SECONDS:
+                raise
+            print(f"🔁 {provider} call failed ({e}), retrying in {delay:.1f}s")
+            pause(delay, cancel_token)
+            continue
+        breaker.record_success()
+        return result
+
+
+async def call_with_breaker_async(provider: str, call: Callable[[], Awaitable[Any]], cancel_token=None) -> Any:
+    """call_with_breaker() for coroutines; a cancelled task releases its half-open probe."""
+    breaker = get_breaker(provider)
+    for attempt in range(Config.RETRY_MAX_ATTEMPTS):
+        breaker.before_call()
+        try:
+            result = await call()
+        except (Cancelled, asyncio.CancelledError):
+            breaker.release()
+            raise
+        except Exception as e:
+            transient, retry_after = classify_error(e)
+            if not transient:
+                breaker.record_success()
+                raise
+            breaker.record_failure(retry_after)
+            delay = backoff_delay(attempt, retry_after)
+            if attempt + 1 >= Config.RETRY_MAX_ATTEMPTS or delay > Config.RETRY_MAX_WAIT_SECONDS:
+                raise
+            print(f"🔁 {provider} call failed ({e}), retrying in {delay:.1f}s")
+            await pause_async(delay, cancel_token)
+            continue
+        breaker.record_success()
+        return result
+
+
+def breaker_stats() -> Dict[str, Dict[str, Any]]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
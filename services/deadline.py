@@ -0,0 +1,68 @@
+# Create: services/deadline.py
+import threading
+import time
+from typing import Dict, List
+
+from config import Config
+
+
+class Deadline:
+    """End-to-end time budget for one generation, shared out across its stages.
+
+    A stage gets its configured share of whatever time is left, relative to the
+    shares of the stages still to come. Time a fast or cached stage does not use
+    therefore carries over to later stages, and the last stage always has its own
+    share reserved. A combined stage (e.g. the fused call) gets the shares of all the
+    stages it replaces.
+    """
+
+    def __init__(self, total_seconds: float = None, shares: Dict[str, float] = None,
+                 combined: Dict[str, tuple] = None):
+        self.total_seconds = total_seconds or Config.GENERATION_DEADLINE_SECONDS
+        self.shares = shares or Config.DEADLINE_STAGE_SHARES
+        self.combined = combined or Config.DEADLINE_COMBINED_STAGES
+        self.started_at = time.time()
+        self.expires_at = self.started_at + self.total_seconds
+        self.degraded: List[str] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.time())
+
+    def stage_budget(self, stage: str) -> float:
+        covered = self.combined.get(stage, (stage,))
+        stages = list(self.shares)
+        share = sum(self.shares[name] for name in covered)
+        upcoming = sum(self.shares[name] for name in stages[stages.index(covered[0]):])
+        return self.remaining() * share / upcoming if upcoming else self.remaining()
+
+    def mark_degraded(self, stage: str):
+        if stage not in self.degraded:
+            self.degraded.append(stage)
+        record_degraded(stage)
+
+    def finish(self):
+        """Record how this generation went against its deadline."""
+        record_generation(bool(self.degraded), time.time() > self.expires_at)
+
+
+_stats = {'generations': 0, 'degraded_generations': 0, 'deadline_missed': 0}
+_degraded_stages: Dict[str, int] = {}
+_stats_lock = threading.Lock()
+
+
+def record_degraded(stage: str):
+    with _stats_lock:
+        _degraded_stages[stage] = _degraded_stages.get(stage, 0) + 1
+
+
+def record_generation(degraded: bool, missed: bool):
+    with _stats_lock:
+        _stats['generations'] += 1
+        _stats['degraded_generations'] += int(degraded)
+        _stats['deadline_missed'] += int(missed)
+
+
+def deadline_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats, degraded_stages=dict(_degraded_stages),
+                    deadline_seconds=Config.GENERATION_DEADLINE_SECONDS)
@@ -0,0 +1,100 @@
+# Create: services/diagram_store.py
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, Dict, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# Content-Encoding name -> file suffix of the precompressed variant
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def svg_data_url(svg_content: str) -> str:
+    """Inline data URL for an SVG, used when the store cannot be written."""
+    svg_b64 = base64.b64encode(svg_content.encode('utf-8')).decode('utf-8')
+    return f"data:image/svg+xml;base64,{svg_b64}"
+
+
+class DiagramStore:
+    """Content-addressed store of rendered SVG diagrams (sha256 -> SVG + metadata).
+
+    Compressed variants are written once at store time so serving a diagram is a
+    plain file read. Identical diagrams share one entry.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def is_valid_digest(digest: str) -> bool:
+        return bool(_DIGEST_RE.match(digest or ''))
+
+    def _path(self, digest: str, suffix: str = '.svg') -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}{suffix}")
+
+    def put(self, svg_content: str, metadata: Dict[str, Any] = None) -> str:
+        """Store an SVG and return its digest; storing the same SVG twice is a no-op."""
+        raw = svg_content.encode('utf-8')
+        digest = hashlib.sha256(raw).hexdigest()
+        if self.contains(digest):
+            return digest
+
+        os.makedirs(os.path.dirname(self._path(digest)), exist_ok=True)
+        variants = {'.gz': gzip.compress(raw, 9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(raw, quality=11)
+        # Compressed variants and metadata first, so a visible .svg implies a complete entry
+        for suffix, data in variants.items():
+            self._write(self._path(digest, suffix), data)
+        self._write(self._path(digest, '.json'), json.dumps({
+            'digest': digest,
+            'size': len(raw),
+            'created_at': time.time(),
+            'metadata': metadata or {}
+        }).encode('utf-8'))
+        self._write(self._path(digest), raw)
+        return digest
+
+    def _write(self, path: str, data: bytes):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def contains(self, digest: str) -> bool:
+        return self.is_valid_digest(digest) and os.path.exists(self._path(digest))
+
+    def read(self, digest: str, encoding: str = None) -> Optional[bytes]:
+        """Return the stored bytes in the requested Content-Encoding, or None if unavailable."""
+        if not self.is_valid_digest(digest):
+            return None
+        suffix = ENCODING_SUFFIXES.get(encoding, '.svg') if encoding else '.svg'
+        try:
+            with open(self._path(digest, suffix), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def metadata(self, digest: str) -> Optional[Dict[str, Any]]:
+        if not self.is_valid_digest(digest):
+            return None
+        try:
+            with open(self._path(digest, '.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def available_encodings(self) -> list:
+        """Encodings this store can serve, best first."""
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
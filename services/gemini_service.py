@@ -1,30 +1,258 @@
 import google.generativeai as genai
+from google.generativeai import caching
 from config import Config
+import datetime
+import hashlib
 import json
 import base64
 from PIL import Image
 import io  
+import threading
+import time
+
+from services.image_cache import PerceptualHashCache, dhash
+from services.rate_limiter import get_rate_limiter
+from services.cancellation import request_timeout
+from services.circuit_breaker import CircuitOpen, call_with_breaker
+from services.hub_monitor import offload
+from services.structured_output import gemini_generation_config, parse_response
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for budgeting without an API call."""
+    return (len(text) + 3) // 4
+
+
+def request_options(cancel_token) -> dict:
+    """generate_content kwargs limiting the request to the time its cancel_token has left."""
+    timeout = request_timeout(cancel_token)
+    return {'request_options': {'timeout': timeout}} if timeout is not None else {}
+
+
+# Coordinates Gemini reports for text, arrows and main elements of a generated image
+POSITIONING_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'main_elements': {'type': 'array', 'items': {
+            'type': 'object',
+            'properties': {
+                'name': {'type': 'string'},
+                'center': {'type': 'array', 'items': {'type': 'number'}},
+                'bounds': {'type': 'array', 'items': {'type': 'number'}},
+            },
+            'required': ['name', 'center'],
+        }},
+        'text_positions': {'type': 'array', 'items': {
+            'type': 'object',
+            'properties': {
+                'label': {'type': 'string'},
+                'optimal_xy': {'type': 'array', 'items': {'type': 'number'}},
+                'region': {'type': 'string'},
+            },
+            'required': ['label', 'optimal_xy'],
+        }},
+        'arrow_paths': {'type': 'array', 'items': {
+            'type': 'object',
+            'properties': {
+                'from': {'type': 'array', 'items': {'type': 'number'}},
+                'to': {'type': 'array', 'items': {'type': 'number'}},
+                'purpose': {'type': 'string'},
+            },
+            'required': ['from', 'to'],
+        }},
+    },
+    'required': ['main_elements', 'text_positions', 'arrow_paths'],
+}
 
 
 class FreeGeminiService:
     """FREE Google Gemini API service."""
     
+    # Near-identical images reuse one positioning analysis
+    _positioning_cache = PerceptualHashCache(
+        max_entries=Config.POSITIONING_CACHE_ENTRIES,
+        max_distance=Config.POSITIONING_HASH_DISTANCE
+    )
+    # Caps how many full-size images are decoded at once
+    _decode_slots = threading.BoundedSemaphore(Config.POSITIONING_MAX_CONCURRENT_DECODES)
+    
+    # Models bound to a static system prompt: (model_name, prompt_hash) -> (model, expires_at)
+    _prompt_models = {}
+    _prompt_models_lock = threading.Lock()
+    # One build lock per key, so concurrent first calls register a prompt only once
+    _prompt_model_builds = {}
+    
+    # Per-label token and latency accounting
+    _usage = {}
+    _usage_lock = threading.Lock()
+    
     def __init__(self):
         genai.configure(api_key=Config.GOOGLE_API_KEY)
         self.model = genai.GenerativeModel(Config.GEMINI_MODEL)
     
-    def generate_response(self, question: str, system_prompt: str) -> str:
-        """Generate response using FREE Gemini API."""
+    def generate_response(self, question: str, system_prompt: str, label: str = 'default',
+                          cancel_token=None, response_schema: dict = None, tier: str = None) -> str:
+        """Generate response using FREE Gemini API.
+
+        The static system prompt is registered once, as explicit cached content when it
+        is large enough and otherwise as the model's system instruction (a stable prefix
+        Gemini can cache implicitly), so each call only carries the variable part.
+        A fired cancel_token raises Cancelled before the call is made. Transient errors
+        are retried through the circuit breaker of the tier's model; while it is open
+        CircuitOpen is raised immediately. With a response_schema, Gemini's JSON mode constrains the
+        answer to that schema. tier names an entry of Config.MODEL_TIERS (model and quota)
+        and is appended to the usage label; without one the call uses GEMINI_MODEL.
+        """
+        model_name, quota, label = self.resolve_tier(tier, label)
         try:
-            # Combine system prompt with question
-            full_prompt = f"{system_prompt}\n\nUser Question: {question}"
+            model = offload(self._model_for_prompt, system_prompt, response_schema, model_name)
             
-            response = self.model.generate_content(full_prompt)
+            def attempt():
+                # All agents share one quota per model, so every call goes through the shared limiter
+                get_rate_limiter().acquire(quota, tokens=estimate_tokens(system_prompt) + estimate_tokens(question),
+                                           cancel_token=cancel_token)
+                started = time.time()
+                response = offload(model.generate_content, question or "Respond now.",
+                                   **request_options(cancel_token))
+                return response, time.time() - started
+            
+            # Tiers are separate models with separate quotas, so each has its own breaker
+            response, latency = call_with_breaker(quota, attempt, cancel_token)
+            self._record_usage(label, response, latency)
             return response.text
+        except CircuitOpen:
+            raise
         except Exception as e:
             raise Exception(f"FREE Gemini API error: {str(e)}")
 
-    def analyze_image_for_positioning(self, image_data: str, concept: str) -> dict:
+    @staticmethod
+    def quotas() -> list:
+        """Every rate-limit bucket (and circuit breaker) a Gemini call may use, one per model tier."""
+        return sorted({'gemini'} | {settings['rate_limit'] for settings in Config.MODEL_TIERS.values()})
+
+    @staticmethod
+    def resolve_tier(tier: str, label: str) -> tuple:
+        """(model name, rate-limit and breaker key, usage label) for a call on tier."""
+        if tier is None:
+            return Config.GEMINI_MODEL, 'gemini', label
+        settings = Config.MODEL_TIERS[tier]
+        return settings['model'], settings['rate_limit'], f"{label}.{tier}"
+
+    @classmethod
+    def _model_for_prompt(cls, system_prompt: str, response_schema: dict = None, model_name: str = None):
+        model_name = model_name or Config.GEMINI_MODEL
+        key = (model_name, hashlib.sha256(system_prompt.encode('utf-8')).hexdigest(),
+               json.dumps(response_schema, sort_keys=True) if response_schema else None)
+        model = cls._cached_prompt_model(key)
+        if model is not None:
+            return model
+        
+        with cls._prompt_models_lock:
+            build_lock = cls._prompt_model_builds.setdefault(key, threading.Lock())
+        try:
+            with build_lock:
+                # Another caller may have built it while this one waited
+                model = cls._cached_prompt_model(key)
+                if model is not None:
+                    return model
+                generation_config = gemini_generation_config(response_schema) if response_schema else None
+                model, expires_at = cls._build_prompt_model(system_prompt, generation_config, model_name)
+                with cls._prompt_models_lock:
+                    if len(cls._prompt_models) >= Config.GEMINI_PROMPT_MODELS_MAX:
+                        cls._prompt_models.pop(next(iter(cls._prompt_models)))
+                    cls._prompt_models[key] = (model, expires_at)
+                return model
+        finally:
+            with cls._prompt_models_lock:
+                if cls._prompt_model_builds.get(key) is build_lock:
+                    del cls._prompt_model_builds[key]
+
+    @classmethod
+    def _cached_prompt_model(cls, key: tuple):
+        with cls._prompt_models_lock:
+            entry = cls._prompt_models.get(key)
+            if entry and (entry[1] is None or entry[1] > time.time()):
+                return entry[0]
+        return None
+
+    @staticmethod
+    def _build_prompt_model(system_prompt: str, generation_config: dict = None, model_name: str = None) -> tuple:
+        """Returns (model, expires_at); expires_at is None for models without server-side state."""
+        model_name = model_name or Config.GEMINI_MODEL
+        if (Config.GEMINI_EXPLICIT_PROMPT_CACHE
+                and estimate_tokens(system_prompt) >= Config.GEMINI_PROMPT_CACHE_MIN_TOKENS):
+            try:
+                ttl = Config.GEMINI_PROMPT_CACHE_TTL_SECONDS
+                cached_content = caching.CachedContent.create(
+                    model=f"models/{model_name}",
+                    system_instruction=system_prompt,
+                    ttl=datetime.timedelta(seconds=ttl)
+                )
+                print(f"📌 Registered cached prompt context ({estimate_tokens(system_prompt)} tokens est.)")
+                # Rebuild a little before the server drops it
+                model = genai.GenerativeModel.from_cached_content(cached_content, generation_config=generation_config)
+                return model, time.time() + ttl - 60
+            except Exception as e:
+                print(f"⚠️ Explicit prompt cache unavailable, using system instruction: {e}")
+        return genai.GenerativeModel(model_name, system_instruction=system_prompt,
+                                     generation_config=generation_config), None
+
+    @classmethod
+    def _record_usage(cls, label: str, response, latency: float):
+        usage = getattr(response, 'usage_metadata', None)
+        with cls._usage_lock:
+            stats = cls._usage.setdefault(label, {
+                'calls': 0, 'input_tokens': 0, 'cached_input_tokens': 0,
+                'output_tokens': 0, 'latency_total': 0.0
+            })
+            stats['calls'] += 1
+            stats['input_tokens'] += getattr(usage, 'prompt_token_count', 0) or 0
+            stats['cached_input_tokens'] += getattr(usage, 'cached_content_token_count', 0) or 0
+            stats['output_tokens'] += getattr(usage, 'candidates_token_count', 0) or 0
+            stats['latency_total'] += latency
+
+    @classmethod
+    def usage_stats(cls) -> dict:
+        """Per-label call counts, token totals and average latency."""
+        with cls._usage_lock:
+            report = {}
+            for label, stats in cls._usage.items():
+                calls = stats['calls'] or 1
+                report[label] = {
+                    'calls': stats['calls'],
+                    'input_tokens': stats['input_tokens'],
+                    'cached_input_tokens': stats['cached_input_tokens'],
+                    'uncached_input_tokens_per_call': round((stats['input_tokens'] - stats['cached_input_tokens']) / calls, 1),
+                    'output_tokens_per_call': round(stats['output_tokens'] / calls, 1),
+                    'avg_latency_s': round(stats['latency_total'] / calls, 3)
+                }
+            return report
+
+    @classmethod
+    def positioning_cache_stats(cls) -> dict:
+        return cls._positioning_cache.stats()
+
+    @classmethod
+    def _prepare_image_for_analysis(cls, image_bytes: bytes) -> tuple:
+        """Decode, hash and downscale an image; returns (perceptual_hash, upload_blob).
+
+        Only the small JPEG leaves this method, so the full-size decode is released
+        immediately and the upload is a fraction of the original bytes.
+        """
+        max_side = Config.POSITIONING_MAX_SIDE
+        with cls._decode_slots:
+            with Image.open(io.BytesIO(image_bytes)) as image:
+                # Lets JPEG decode straight to a reduced size instead of full resolution
+                image.draft('RGB', (max_side, max_side))
+                image_hash = dhash(image)
+                small = image.convert('RGB')
+                small.thumbnail((max_side, max_side), Image.LANCZOS)
+        
+        buffer = io.BytesIO()
+        small.save(buffer, format='JPEG', quality=85)
+        return image_hash, {'mime_type': 'image/jpeg', 'data': buffer.getvalue()}
+
+    def analyze_image_for_positioning(self, image_data: str, concept: str, cancel_token=None) -> dict:
         """Analyze generated image to determine optimal element positioning."""
         
         # Convert base64 to PIL Image for Gemini
@@ -32,11 +260,18 @@ class FreeGeminiService:
             image_data = image_data.split(',')[1]
         
         image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
+        image_hash, upload = offload(self._prepare_image_for_analysis, image_bytes)
+        del image_bytes
+        
+        cached = self._positioning_cache.get(image_hash, concept)
+        if cached is not None:
+            print(f"⚡ Positioning cache hit for: {concept}")
+            return cached
         
         prompt = f"""Analyze this educational image about "{concept}".
 
-                    Canvas dimensions: 1024x768 pixels.
+                    Canvas dimensions: 1024x768 pixels. The image may be shown downscaled;
+                    always report coordinates in canvas pixels.
 
                     Identify and return JSON with exact coordinates:
                     {{
@@ -57,8 +292,23 @@ class FreeGeminiService:
                     Be precise with coordinates. Avoid placing text over complex image areas."""
 
         try:
-            response = self.model.generate_content([prompt, image])
-            return json.loads(response.text)
+            def attempt():
+                # Images are billed at a flat ~258 tokens each
+                get_rate_limiter().acquire('gemini', tokens=estimate_tokens(prompt) + 258,
+                                           cancel_token=cancel_token)
+                started = time.time()
+                response = offload(self.model.generate_content, [prompt, upload],
+                                   generation_config=gemini_generation_config(POSITIONING_SCHEMA),
+                                   **request_options(cancel_token))
+                return response, time.time() - started
+            
+            response, latency = call_with_breaker('gemini', attempt, cancel_token)
+            self._record_usage('positioning', response, latency)
+            analysis = parse_response('positioning', response.text, POSITIONING_SCHEMA)
+            if analysis is None:
+                raise ValueError("unusable positioning analysis")
+            self._positioning_cache.set(image_hash, concept, analysis)
+            return analysis
         except Exception as e:
             # Fallback to basic positioning
             return {
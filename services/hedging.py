@@ -0,0 +1,228 @@
+# Create: services/hedging.py
+import asyncio
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import Config
+from services.cancellation import Cancelled, CancellationToken
+from services.latency_tracker import LatencyTracker
+from services.rate_limiter import counting_grants, get_rate_limiter
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='hedge')
+_hedgers: Dict[str, 'Hedger'] = {}
+
+
+class Hedger:
+    """Sends a backup request to a second provider when the first is slow.
+
+    The primary call starts alone. If it has not produced a valid result by its
+    observed latency percentile (p90 by default), the backup provider is called too
+    and the first valid result wins. The loser is cancelled: a task is cancelled
+    outright, aborting its request or its wait for quota; a thread that has not
+    started never runs, and one waiting for quota stops and hands its reservation
+    back (a request already sent is left to finish unwaited). If the primary fails
+    outright, the backup is started immediately. Hedges are limited to max_ratio of
+    all calls and only sent while the backup provider keeps headroom_calls of spare
+    quota.
+    run() races threads; run_async() races tasks on the running event loop.
+    """
+
+    def __init__(self, name: str, primary: str, backup: str, settings: Dict[str, Any] = None):
+        self.name = name
+        self.primary = primary
+        self.backup = backup
+        self.settings = settings or {}
+        self.latency = LatencyTracker()
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'hedged': 0, 'failovers': 0, 'primary_wins': 0, 'backup_wins': 0,
+                       'no_valid_result': 0, 'skipped_budget': 0}
+        self._wasted_calls = {primary: 0, backup: 0}
+        _hedgers[name] = self
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.get('enabled', False)
+
+    def hedge_delay(self) -> float:
+        """Seconds to give the primary before hedging: its latency percentile once known."""
+        default = self.settings.get('default_delay_seconds', Config.HEDGE_DEFAULT_DELAY_SECONDS)
+        if self.latency.count(self.primary) < self.settings.get('min_samples', 10):
+            return default
+        return self.latency.percentile(self.primary, self.settings.get('percentile', 90), default)
+
+    def _may_hedge(self) -> bool:
+        with self._lock:
+            within_ratio = self._stats['hedged'] < self.settings.get('max_ratio', 0.2) * self._stats['calls'] + 1
+        if not within_ratio:
+            return False
+        headroom = self.settings.get('headroom_calls', 2)
+        return get_rate_limiter().available(self.backup) >= 1 + headroom
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def run(self, primary: Callable[[CancellationToken], Any], backup: Callable[[CancellationToken], Any],
+            is_valid: Callable[[Any], bool], cancel_token: CancellationToken = None) -> Optional[Any]:
+        """Return the first valid result from primary (or the hedged backup), or None if neither gives one.
+
+        Each callable receives its own cancellation token to pass to its provider call.
+        """
+        self._count('calls')
+        tokens = {self.primary: CancellationToken(parent=cancel_token)}
+        reached = {}
+        futures = {self._submit(self.primary, primary, tokens[self.primary], reached): self.primary}
+        hedge_at = time.time() + self.hedge_delay()
+
+        try:
+            while futures:
+                timeout = None if hedge_at is None else max(0.0, hedge_at - time.time())
+                done, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    provider = futures.pop(future)
+                    result = self._result(future)
+                    if result is not None and is_valid(result):
+                        self._count('primary_wins' if provider == self.primary else 'backup_wins')
+                        return result
+
+                start_backup, hedge_at = self._backup_due(tokens, futures, hedge_at, cancel_token)
+                if start_backup:
+                    futures[self._submit(self.backup, backup, tokens[self.backup], reached)] = self.backup
+        finally:
+            self._abandon(futures, tokens, reached)
+
+        return self._no_result(cancel_token)
+
+    async def run_async(self, primary: Callable[[CancellationToken], Awaitable[Any]],
+                        backup: Callable[[CancellationToken], Awaitable[Any]],
+                        is_valid: Callable[[Any], bool], cancel_token: CancellationToken = None) -> Optional[Any]:
+        """run() for coroutines: both providers are awaited as tasks on the running loop."""
+        self._count('calls')
+        tokens = {self.primary: CancellationToken(parent=cancel_token)}
+        reached = {}
+        tasks = {self._submit_async(self.primary, primary, tokens[self.primary], reached): self.primary}
+        hedge_at = time.time() + self.hedge_delay()
+
+        try:
+            while tasks:
+                timeout = None if hedge_at is None else max(0.0, hedge_at - time.time())
+                done, _ = await asyncio.wait(list(tasks), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    provider = tasks.pop(task)
+                    result = self._result(task)
+                    if result is not None and is_valid(result):
+                        self._count('primary_wins' if provider == self.primary else 'backup_wins')
+                        return result
+
+                start_backup, hedge_at = self._backup_due(tokens, tasks, hedge_at, cancel_token)
+                if start_backup:
+                    tasks[self._submit_async(self.backup, backup, tokens[self.backup], reached)] = self.backup
+        finally:
+            self._abandon(tasks, tokens, reached)
+
+        return self._no_result(cancel_token)
+
+    def _backup_due(self, tokens: Dict[str, CancellationToken], pending: dict, hedge_at: Optional[float],
+                    cancel_token: CancellationToken) -> tuple:
+        """Whether to start the backup now (creating its token), and the hedge time still ahead."""
+        if self.backup in tokens:
+            return False, hedge_at
+        if not pending:
+            self._count('failovers')
+        elif hedge_at is not None and time.time() >= hedge_at:
+            hedge_at = None
+            if not self._may_hedge():
+                self._count('skipped_budget')
+                return False, hedge_at
+            self._count('hedged')
+        else:
+            return False, hedge_at
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        tokens[self.backup] = CancellationToken(parent=cancel_token)
+        return True, hedge_at
+
+    def _abandon(self, pending: dict, tokens: Dict[str, CancellationToken], reached: dict):
+        # Whoever is still running lost the race
+        for call, provider in pending.items():
+            tokens[provider].cancel(f"{self.name}: another provider answered first")
+            call.cancel()
+            call.add_done_callback(lambda done, provider=provider: self._account_loser(provider, done, reached[provider]))
+
+    def _no_result(self, cancel_token: CancellationToken) -> None:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        self._count('no_valid_result')
+        return None
+
+    def _finish_call(self, provider: str, counter, started: Optional[float], reached: Dict[str, bool]):
+        if counter.count:
+            reached[provider] = True
+            if started is not None:
+                # Failures count too; only the request is timed, not the wait for quota
+                self.latency.record(provider, time.time() - started - counter.waited)
+
+    def _submit(self, provider: str, call: Callable[[CancellationToken], Any], token: CancellationToken,
+                reached: Dict[str, bool]):
+        reached[provider] = False
+
+        def timed():
+            with counting_grants() as counter:
+                started = time.time()
+                try:
+                    return call(token)
+                finally:
+                    self._finish_call(provider, counter, started, reached)
+
+        return _executor.submit(timed)
+
+    def _submit_async(self, provider: str, call: Callable[[CancellationToken], Awaitable[Any]],
+                      token: CancellationToken, reached: Dict[str, bool]):
+        reached[provider] = False
+
+        async def timed():
+            with counting_grants() as counter:
+                started = time.time()
+                try:
+                    return await call(token)
+                except asyncio.CancelledError:
+                    # Cut short by the race, so its duration says nothing about the provider
+                    started = None
+                    raise
+                finally:
+                    self._finish_call(provider, counter, started, reached)
+
+        return asyncio.ensure_future(timed())
+
+    @staticmethod
+    def _result(future):
+        try:
+            return future.result()
+        except Cancelled:
+            return None
+        except Exception as e:
+            print(f"⚠️ Hedged call failed: {e}")
+            return None
+
+    def _account_loser(self, provider: str, call, reached_provider: bool):
+        # Read the loser's outcome so a failed asyncio task is not reported as never retrieved
+        if not call.cancelled():
+            call.exception()
+        # A loser stopped while waiting for quota, or refused by an open breaker, sent no request
+        if not reached_provider:
+            return
+        with self._lock:
+            self._wasted_calls[provider] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            report = dict(self._stats, wasted_calls=dict(self._wasted_calls))
+        report['hedge_delay_s'] = round(self.hedge_delay(), 2)
+        report['latency'] = self.latency.stats()
+        return report
+
+
+def hedging_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: hedger.stats() for name, hedger in _hedgers.items()}
@@ -0,0 +1,119 @@
+# Create: services/hub_monitor.py
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from config import Config
+
+# Blocking calls made on the hub thread go here; app.py swaps in eventlet's tpool.execute
+_offload: Optional[Callable[..., Any]] = None
+_hub_thread_id: Optional[int] = None
+
+
+def set_offload_function(offload_function: Callable[..., Any], hub_thread_id: int = None):
+    """Route offload() calls made on hub_thread_id (default: the calling thread) through offload_function."""
+    global _offload, _hub_thread_id
+    _offload = offload_function
+    _hub_thread_id = hub_thread_id if hub_thread_id is not None else threading.get_ident()
+
+
+def offload(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Call func in a real OS thread if we are on the hub thread, otherwise call it directly.
+
+    All green threads share the hub's OS thread, so a blocking SDK call, wait or
+    image decode made there freezes every socket until it returns. Calls already on
+    a worker thread (pipeline stages, the provider loop) do not need the hop.
+    """
+    if _offload is None or threading.get_ident() != _hub_thread_id:
+        return func(*args, **kwargs)
+
+    def call():
+        # tpool only re-raises Exception subclasses; carry the rest (e.g. Cancelled) across ourselves
+        try:
+            return func(*args, **kwargs), None
+        except BaseException as e:
+            return None, e
+
+    result, error = _offload(call)
+    if error is not None:
+        raise error
+    return result
+
+
+class HubStallMonitor:
+    """Measures how long the eventlet hub goes without switching green threads.
+
+    A green thread sleeps for interval and records how much later than that it woke
+    up: the hub's scheduling lag, kept as a histogram. A watchdog on a real OS thread
+    notices a tick overdue by threshold while the stall is still going on and logs
+    the hub thread's stack at that moment, which names the blocking call.
+    """
+
+    def __init__(self, interval: float = None, threshold: float = None, buckets=None):
+        self.interval = interval or Config.HUB_WATCHDOG_INTERVAL_SECONDS
+        self.threshold = threshold or Config.HUB_STALL_THRESHOLD_SECONDS
+        self.buckets = tuple(buckets or Config.HUB_STALL_BUCKETS)
+        self._histogram = [0] * (len(self.buckets) + 1)
+        self._stats = {'ticks': 0, 'stalls': 0, 'stalled_seconds': 0.0, 'max_lag_s': 0.0}
+        self._recent = deque(maxlen=10)
+        self._last_tick = time.monotonic()
+        self._pending_stack = None  # Stack captured by the watchdog for the stall in progress
+        self._hub_thread_id = None
+        self._lock = threading.Lock()
+
+    def start(self, spawn: Callable[..., Any], sleep: Callable[[float], None]):
+        """Start ticking on the hub (via spawn/sleep, called from the hub thread) and watching from a thread."""
+        self._hub_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        spawn(self._tick_loop, sleep)
+        threading.Thread(target=self._watch_loop, name='hub-watchdog', daemon=True).start()
+
+    def _tick_loop(self, sleep: Callable[[float], None]):
+        while True:
+            before = time.monotonic()
+            sleep(self.interval)
+            now = time.monotonic()
+            self._record_lag(max(0.0, now - before - self.interval), now)
+
+    def _record_lag(self, lag: float, now: float):
+        index = next((i for i, bound in enumerate(self.buckets) if lag <= bound), len(self.buckets))
+        with self._lock:
+            self._last_tick = now
+            self._histogram[index] += 1
+            self._stats['ticks'] += 1
+            self._stats['max_lag_s'] = max(self._stats['max_lag_s'], lag)
+            stack, self._pending_stack = self._pending_stack, None
+            if lag < self.threshold:
+                return
+            self._stats['stalls'] += 1
+            self._stats['stalled_seconds'] += lag
+            self._recent.append({'at': time.time(), 'duration_s': round(lag, 3),
+                                 'blocked_in': stack[-1].strip().splitlines()[0] if stack else None})
+        print(f"🐢 Event loop hub stalled for {lag:.2f}s")
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                overdue = time.monotonic() - self._last_tick - self.interval
+                if overdue < self.threshold or self._pending_stack is not None:
+                    continue
+                frame = sys._current_frames().get(self._hub_thread_id)
+                self._pending_stack = traceback.format_stack(frame) if frame is not None else ['<unknown>\n']
+                stack = self._pending_stack
+            print(f"🐢 Event loop hub blocked for {overdue:.2f}s so far, in:\n{''.join(stack)}")
+
+    def stats(self) -> Dict[str, Any]:
+        labels = [f"<={bound}s" for bound in self.buckets] + [f">{self.buckets[-1]}s"]
+        with self._lock:
+            return dict(
+                self._stats,
+                stalled_seconds=round(self._stats['stalled_seconds'], 3),
+                max_lag_s=round(self._stats['max_lag_s'], 3),
+                threshold_s=self.threshold,
+                lag_histogram=dict(zip(labels, self._histogram)),
+                recent_stalls=list(self._recent)
+            )
@@ -4,6 +4,9 @@ import io
 from typing import Dict, Any
 from huggingface_hub import InferenceClient
 from config import Config
+from services.circuit_breaker import call_with_breaker
+from services.rate_limiter import get_rate_limiter
+from services.hub_monitor import offload
 
 class FreeHuggingFaceService:
     """FREE HuggingFace Inference API service using InferenceClient."""
@@ -14,8 +17,14 @@ class FreeHuggingFaceService:
             api_key=Config.HUGGINGFACE_TOKEN  # Will use HF_TOKEN env var
         )
     
-    def generate_image(self, prompt: str) -> Dict[str, Any]:
-        """Generate image using FREE HuggingFace InferenceClient."""
+    def generate_image(self, prompt: str, cancel_token=None) -> Dict[str, Any]:
+        """Generate image using FREE HuggingFace InferenceClient.
+
+        Every attempt, retries included, takes its own reservation from the shared limiter.
+        """
+        
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
         
         # Enhanced prompt for educational content
         enhanced_prompt = f"Educational diagram, simple illustration, {prompt}, white background, clean art style"
@@ -23,20 +32,17 @@ class FreeHuggingFaceService:
         try:
             print(f"🎨 Generating image with HF InferenceClient: {enhanced_prompt}")
             
-            # Use the modern text_to_image method
-            pil_image = self.client.text_to_image(
-                enhanced_prompt,
-                model=Config.STABLE_DIFFUSION_MODEL
-            )
+            def attempt():
+                get_rate_limiter().acquire('huggingface', cancel_token=cancel_token)
+                return offload(self.client.text_to_image, enhanced_prompt, model=Config.STABLE_DIFFUSION_MODEL)
             
-            print("✅ PIL Image generated successfully")
+            # Use the modern text_to_image method, retried through the HF circuit breaker
+            pil_image = call_with_breaker('huggingface', attempt, cancel_token)
             
-            # Convert PIL Image to base64
-            buffer = io.BytesIO()
-            pil_image.save(buffer, format='PNG')
-            buffer.seek(0)
+            print("✅ PIL Image generated successfully")
             
-            image_data = base64.b64encode(buffer.getvalue()).decode()
+            # Convert PIL Image to base64 (PNG encoding is CPU work, kept off the hub)
+            image_data = offload(self._encode_png, pil_image)
             print("✅ Image converted to base64")
             
             return {
@@ -51,6 +57,12 @@ class FreeHuggingFaceService:
             print(f"❌ {error_msg}")
             raise Exception(error_msg)
 
+
+    @staticmethod
+    def _encode_png(pil_image) -> str:
+        buffer = io.BytesIO()
+        pil_image.save(buffer, format='PNG')
+        return base64.b64encode(buffer.getvalue()).decode()
     
     def query_text_model(self, prompt: str, model: str = "microsoft/DialoGPT-medium") -> str:
         """Query FREE text model if needed."""
@@ -0,0 +1,64 @@
+# Create: services/image_cache.py
+import copy
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from PIL import Image
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """64-bit difference hash: stable under rescaling and small re-encodes of the same picture."""
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class PerceptualHashCache:
+    """Bounded LRU of results keyed by (perceptual hash, context), matched within a Hamming radius."""
+
+    def __init__(self, max_entries: int = 256, max_distance: int = 6):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_hash: int, context: str) -> Optional[Any]:
+        with self._lock:
+            best_key, best_distance = None, self.max_distance + 1
+            for key in self._entries:
+                if key[1] != context:
+                    continue
+                distance = hamming_distance(key[0], image_hash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+                    if distance == 0:
+                        break
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return copy.deepcopy(self._entries[best_key])
+
+    def set(self, image_hash: int, context: str, value: Any):
+        with self._lock:
+            self._entries[(image_hash, context)] = value
+            self._entries.move_to_end((image_hash, context))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,50 @@
+# Create: services/latency_tracker.py
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+
+class LatencyTracker:
+    """Sliding window of observed latencies per key (stage, provider, ...)."""
+
+    def __init__(self, window: int = 100):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def count(self, key: str) -> int:
+        with self._lock:
+            return len(self._samples.get(key, ()))
+
+    def mean(self, key: str, default: Optional[float] = None) -> Optional[float]:
+        with self._lock:
+            samples = self._samples.get(key)
+            if not samples:
+                return default
+            return sum(samples) / len(samples)
+
+    def percentile(self, key: str, pct: float, default: Optional[float] = None) -> Optional[float]:
+        with self._lock:
+            samples = self._samples.get(key)
+            if not samples:
+                return default
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            keys = list(self._samples)
+        return {
+            key: {
+                'count': len(self._samples[key]),
+                'mean_s': round(self.mean(key), 3),
+                'p50_s': round(self.percentile(key, 50), 3),
+                'p90_s': round(self.percentile(key, 90), 3),
+            }
+            for key in keys
+        }
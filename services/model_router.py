@@ -0,0 +1,135 @@
+# Create: services/model_router.py
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import Config
+from services.cache_service import normalize_question
+from services.latency_tracker import LatencyTracker
+
+# Words and phrases that mark a question as needing multi-step reasoning
+COMPLEX_TERMS = {
+    'explain', 'why', 'mechanism', 'process', 'cycle', 'compare', 'difference', 'differences', 'derive',
+    'prove', 'proof', 'theory', 'relationship', 'cause', 'causes', 'effect', 'effects', 'evolution',
+    'krebs', 'photosynthesis', 'respiration', 'mitosis', 'meiosis', 'dna', 'protein', 'quantum',
+    'relativity', 'calculus', 'derivative', 'integral', 'equation', 'equations', 'electromagnetic',
+    'thermodynamics', 'ecosystem', 'economy', 'government', 'algorithm',
+}
+COMPLEX_PHRASES = ('how does', 'how do', 'what happens', 'step by step', 'in detail')
+# Openings of one-fact questions
+SIMPLE_OPENINGS = ('what is', 'what are', 'who is', 'who was', 'define', 'what color', 'how many', 'name ')
+# "what is 2+2", "12 x 7": pure arithmetic
+ARITHMETIC = re.compile(r'^(what is |what\'s |calculate )?[\d\s.+\-*/x×÷=^()]+$')
+
+# What earlier analyses of similar questions said about them
+HISTORY_COMPLEXITY = {'high': 2, 'middle': 1, 'elementary': -1}
+HISTORY_DIAGRAM_TYPES = {'cycle': 1, 'flow': 1, 'timeline': 1}
+
+
+class ComplexityRouter:
+    """Chooses the Gemini model tier for a question's plan and content calls.
+
+    A cheap local score: question length, topic keywords, and the complexity_level /
+    diagram_type of the cached analysis of the same or a similar question. Questions
+    scoring below Config.ROUTER_HEAVY_SCORE go to the light tier, the rest to the heavy
+    one. Per stage and tier it keeps call latency and how often the answer had to be
+    replaced by a fallback, so the threshold can be tuned against quality.
+    """
+
+    def __init__(self, content_cache=None, question_index=None):
+        self.content_cache = content_cache
+        self.question_index = question_index
+        self.latency = LatencyTracker()
+        self._memo: 'OrderedDict[str, Tuple[str, int]]' = OrderedDict()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._routed = {'light': 0, 'heavy': 0, 'history_hits': 0}
+        self._lock = threading.Lock()
+
+    def route(self, question: str) -> Optional[str]:
+        """Tier for question, or None (default model) when routing is disabled.
+
+        Blocking: the history lookup may read the shared cache.
+        """
+        if not Config.MODEL_ROUTING_ENABLED:
+            return None
+        key = normalize_question(question)
+        with self._lock:
+            if key in self._memo:
+                # Plan and content ask about the same question at the same time
+                self._memo.move_to_end(key)
+                return self._memo[key][0]
+
+        score = self.score(question) + self._history_score(key, question)
+        tier = 'heavy' if score >= Config.ROUTER_HEAVY_SCORE else 'light'
+        with self._lock:
+            self._memo[key] = (tier, score)
+            if len(self._memo) > Config.ROUTER_MEMO_ENTRIES:
+                self._memo.popitem(last=False)
+            self._routed[tier] += 1
+        print(f"🧮 Routing '{question[:60]}' to the {tier} model tier (score {score})")
+        return tier
+
+    @staticmethod
+    def score(question: str) -> int:
+        """Complexity score from the question text alone."""
+        text = ' '.join(question.lower().split())
+        if ARITHMETIC.match(text.rstrip('?')):
+            return -3
+        words = re.findall(r"[a-z0-9']+", text)
+        score = 0
+        if len(words) <= Config.ROUTER_SHORT_QUESTION_WORDS:
+            score -= 1
+        elif len(words) >= Config.ROUTER_LONG_QUESTION_WORDS:
+            score += 2
+        score += 2 * min(2, len(COMPLEX_TERMS.intersection(words)) + sum(p in text for p in COMPLEX_PHRASES))
+        if text.startswith(SIMPLE_OPENINGS):
+            score -= 1
+        return score
+
+    def _history_score(self, key: str, question: str) -> int:
+        """Score from the cached analysis of this question or its nearest cached neighbour."""
+        if self.content_cache is None:
+            return 0
+        keys = [key]
+        if self.question_index is not None:
+            keys += [similar for similar, _ in self.question_index.query(question) if similar != key]
+        try:
+            found = self.content_cache.get_many(keys)
+        except Exception as e:
+            print(f"⚠️ Routing history lookup failed: {e}")
+            return 0
+        analysis = next((found[k] for k in keys if k in found), None)
+        if not isinstance(analysis, dict) or analysis.get('fallback'):
+            return 0
+        with self._lock:
+            self._routed['history_hits'] += 1
+        return (HISTORY_COMPLEXITY.get(analysis.get('complexity_level'), 0)
+                + HISTORY_DIAGRAM_TYPES.get(analysis.get('diagram_type'), 0))
+
+    def record(self, stage: str, tier: Optional[str], seconds: float, output: Any):
+        """Count one routed call and whether its answer was usable."""
+        if tier is None:
+            return
+        name = f"{stage}.{tier}"
+        self.latency.record(name, seconds)
+        with self._lock:
+            stats = self._stats.setdefault(name, {'calls': 0, 'fallbacks': 0})
+            stats['calls'] += 1
+            if not isinstance(output, dict) or output.get('fallback'):
+                stats['fallbacks'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        latency = self.latency.stats()
+        with self._lock:
+            stages = {
+                name: dict(stats, usable_rate=round(1 - stats['fallbacks'] / stats['calls'], 3),
+                           **latency.get(name, {}))
+                for name, stats in self._stats.items()
+            }
+            return {
+                'enabled': Config.MODEL_ROUTING_ENABLED,
+                'tiers': {tier: settings['model'] for tier, settings in Config.MODEL_TIERS.items()},
+                'routed': dict(self._routed),
+                'stages': stages,
+            }
@@ -1,9 +1,14 @@
 import os
 import json
-import time
 from typing import Dict, Any
 from perplexity import Perplexity
 
+from services.rate_limiter import get_rate_limiter
+from services.circuit_breaker import call_with_breaker
+from services.hub_monitor import offload
+from services.structured_output import to_json_schema
+from services.cancellation import request_timeout
+
 class PerplexityService:
     """Perplexity API service using the official Perplexity SDK."""
     
@@ -11,52 +16,72 @@ class PerplexityService:
         self.api_key = os.environ.get("PERPLEXITY_API_KEY")
         self.client = Perplexity(api_key=self.api_key)
         self.model = "sonar-pro"  # Latest Perplexity model
-        self.last_call_time = 0
-        self.rate_limit_delay = 1.0  # 1 second between calls
     
-    def generate_content(self, prompt: str, system_prompt: str = None) -> Dict[str, Any]:
-        """Generate content using Perplexity Sonar reasoning."""
-        
-        # Rate limiting
-        current_time = time.time()
-        time_since_last = current_time - self.last_call_time
-        if time_since_last < self.rate_limit_delay:
-            time.sleep(self.rate_limit_delay - time_since_last)
+    def generate_content(self, prompt: str, system_prompt: str = None, cancel_token=None,
+                         response_schema: dict = None) -> Dict[str, Any]:
+        """Generate content using Perplexity Sonar reasoning (JSON constrained to response_schema if given)."""
         
         # Build messages
         messages = []
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
         messages.append({"role": "user", "content": prompt})
+        extra = self.response_format(response_schema)
         
-        try:
+        def attempt():
+            # Rate limiting (shared across instances, threads and workers)
+            get_rate_limiter().acquire('perplexity', cancel_token=cancel_token)
             # Use official Perplexity SDK
-            completion = self.client.chat.completions.create(
+            return offload(
+                self.client.chat.completions.create,
                 model=self.model,
                 messages=messages,
                 temperature=0.1,  # Lower temperature for more consistent reasoning
                 max_tokens=4000,
-                top_p=0.9
+                top_p=0.9,
+                **extra,
+                **self.request_timeout(cancel_token)
             )
+        
+        try:
+            # Transient errors are retried; an open breaker fails fast into the fallback below
+            completion = call_with_breaker('perplexity', attempt, cancel_token)
             
-            content = completion.choices[0].message.content
-            
-            # Try to parse as JSON, fallback to string
-            try:
-                return json.loads(content)
-            except json.JSONDecodeError:
-                return {"content": content, "raw_response": True}
+            return self.parse_content(completion.choices[0].message.content)
                 
         except Exception as e:
             print(f"Perplexity API error: {e}")
-            # Fallback response
-            return {
-                "error": "API call failed",
-                "fallback": True,
-                "content": f"Analysis of topic failed due to API error: {e}"
-            }
-        finally:
-            self.last_call_time = time.time()
+            return self.fallback_content(e)
+    
+    @staticmethod
+    def request_timeout(cancel_token) -> Dict[str, Any]:
+        """Request kwargs limiting the HTTP call to the time its cancel_token has left (none without a deadline)."""
+        timeout = request_timeout(cancel_token)
+        return {"timeout": timeout} if timeout is not None else {}
+    
+    @staticmethod
+    def response_format(response_schema: dict = None) -> Dict[str, Any]:
+        """Request kwargs for Sonar's structured output mode (none without a schema)."""
+        if not response_schema:
+            return {}
+        return {"response_format": {"type": "json_schema", "json_schema": {"schema": to_json_schema(response_schema)}}}
+    
+    @staticmethod
+    def parse_content(content: str) -> Dict[str, Any]:
+        """Parse a completion as JSON, falling back to the raw string."""
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            return {"content": content, "raw_response": True}
+    
+    @staticmethod
+    def fallback_content(error: Exception) -> Dict[str, Any]:
+        """Response returned when the API call fails."""
+        return {
+            "error": "API call failed",
+            "fallback": True,
+            "content": f"Analysis of topic failed due to API error: {error}"
+        }
     
     def analyze_educational_content(self, topic: str) -> Dict[str, Any]:
         """Specialized method for educational content analysis with reasoning."""
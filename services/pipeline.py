@@ -0,0 +1,142 @@
+# Create: services/pipeline.py
+import inspect
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, List
+
+from services.cancellation import Cancelled, record_calls_avoided
+from services.hub_monitor import offload
+
+
+class Stage:
+    """One node of a pipeline DAG.
+
+    run receives the outputs of its inputs as keyword arguments. after lists extra
+    stages that must finish first without passing their output (ordering only).
+    when, given all outputs so far, decides whether the stage runs at all; a skipped
+    stage has no output and its dependents are skipped too. calls is the provider
+    calls the stage makes, for cancellation accounting.
+    """
+
+    def __init__(self, name: str, run: Callable[..., Any], inputs: Iterable[str] = (),
+                 after: Iterable[str] = (), when: Callable[[Dict[str, Any]], bool] = None,
+                 calls: Dict[str, int] = None):
+        self.name = name
+        self.run = run
+        self.inputs = tuple(inputs)
+        self.after = tuple(after)
+        self.when = when
+        self.calls = calls or {}
+
+    @property
+    def dependencies(self):
+        return self.inputs + self.after
+
+
+class PipelineResult:
+    def __init__(self, dependencies: Dict[str, tuple]):
+        self.dependencies = dependencies
+        self.outputs: Dict[str, Any] = {}
+        self.errors: Dict[str, BaseException] = {}
+        self.skipped: List[str] = []
+        self.timings: Dict[str, tuple] = {}  # name -> (started, finished)
+        self.started_at = time.time()
+        self.finished_at = None
+
+    @property
+    def duration(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    def critical_path(self) -> List[str]:
+        """Stages on the longest dependency chain, ending at the last stage to finish."""
+        if not self.timings:
+            return []
+        path = [max(self.timings, key=lambda name: self.timings[name][1])]
+        while True:
+            deps = [dep for dep in self.dependencies.get(path[-1], ()) if dep in self.timings]
+            if not deps:
+                return list(reversed(path))
+            path.append(max(deps, key=lambda name: self.timings[name][1]))
+
+
+class DagExecutor:
+    """Runs a DAG of stages on a thread pool, starting every stage whose inputs are ready.
+
+    Each stage runs at most once per run and its output is memoized for all
+    dependents. A stage that raises is recorded in errors and its dependents are
+    skipped, so independent branches still finish. Cancelled aborts the whole run
+    and counts the calls of stages that never got to make theirs as avoided.
+    Completion callbacks run on the calling thread.
+
+    Stages whose run is a coroutine function are awaited on loop (a ProviderLoop)
+    instead of taking a thread; both kinds can be mixed in one DAG.
+    """
+
+    def __init__(self, executor, loop=None):
+        self.executor = executor
+        self.loop = loop
+
+    def _submit(self, stage: Stage, kwargs: Dict[str, Any]):
+        if self.loop is not None and inspect.iscoroutinefunction(stage.run):
+            return self.loop.submit(stage.run(**kwargs))
+        return self.executor.submit(stage.run, **kwargs)
+
+    def run(self, stages: List[Stage], on_stage_done: Callable[[str, Any], None] = None) -> PipelineResult:
+        """Run stages (listed in dependency order) and return their outputs, errors and timings."""
+        seen = set()
+        for stage in stages:
+            unknown = [dep for dep in stage.dependencies if dep not in seen]
+            if unknown:
+                raise ValueError(f"Stage {stage.name} depends on {unknown}, which must be listed before it")
+            seen.add(stage.name)
+
+        result = PipelineResult({stage.name: stage.dependencies for stage in stages})
+        pending = {stage.name: stage for stage in stages}
+        running = {}
+
+        try:
+            while pending or running:
+                busy = set(pending) | {stage.name for stage in running.values()}
+                for stage in list(pending.values()):
+                    deps = stage.dependencies
+                    if any(dep in busy for dep in deps):
+                        continue
+                    del pending[stage.name]
+                    if any(dep in result.skipped or dep in result.errors for dep in deps) or (
+                            stage.when is not None and not stage.when(result.outputs)):
+                        result.skipped.append(stage.name)
+                        busy.discard(stage.name)
+                        continue
+                    kwargs = {name: result.outputs[name] for name in stage.inputs}
+                    result.timings[stage.name] = (time.time(), None)
+                    running[self._submit(stage, kwargs)] = stage
+
+                if not running:
+                    continue
+                # Called from a green thread this would block the whole hub, so it waits on an OS thread
+                done, _ = offload(wait, list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    result.timings[stage.name] = (result.timings[stage.name][0], time.time())
+                    try:
+                        result.outputs[stage.name] = future.result()
+                    except Cancelled:
+                        # Nothing was sent for a stage cancelled before its call
+                        pending[stage.name] = stage
+                        raise
+                    except Exception as e:
+                        print(f"❌ Pipeline stage {stage.name} failed: {e}")
+                        result.errors[stage.name] = e
+                        continue
+                    if on_stage_done is not None:
+                        on_stage_done(stage.name, result.outputs[stage.name])
+        except Cancelled:
+            avoided = {}
+            for stage in pending.values():
+                for provider, count in stage.calls.items():
+                    avoided[provider] = avoided.get(provider, 0) + count
+            record_calls_avoided(avoided)
+            raise
+        finally:
+            result.finished_at = time.time()
+        return result
@@ -0,0 +1,136 @@
+# Create: services/prefetch_service.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+from config import Config
+from services.cache_service import normalize_question
+from services.cancellation import CancellationToken, Cancelled
+
+_IMPORTANCE_RANK = {'high': 0, 'medium': 1, 'low': 2}
+
+
+def follow_up_questions(content_analysis: Dict[str, Any], limit: int = 3) -> List[str]:
+    """Likely next questions from a content analysis, most important elements first.
+
+    Elements that other elements flow into or come from are the ones students tend
+    to ask about next ("what is evaporation" after "water cycle").
+    """
+    main = normalize_question(content_analysis.get('main_concept', ''))
+    connected = set()
+    for relationship in content_analysis.get('relationships', []):
+        connected.add(relationship.get('from'))
+        connected.add(relationship.get('to'))
+
+    ranked = []
+    for element in content_analysis.get('visual_elements', []):
+        name = (element.get('name') or '').replace('_', ' ').strip()
+        if not name or normalize_question(name) == main:
+            continue
+        rank = (_IMPORTANCE_RANK.get(element.get('importance'), 1), element.get('name') not in connected)
+        ranked.append((rank, name))
+
+    questions = []
+    for _, name in sorted(ranked, key=lambda item: item[0]):
+        question = f"What is {name}?"
+        if question not in questions:
+            questions.append(question)
+    return questions[:limit]
+
+
+class PrefetchService:
+    """Low-priority background generation of likely follow-up questions.
+
+    Every provider call is admitted separately: only while no live generation is
+    running and the provider's bucket keeps PREFETCH_HEADROOM_CALLS requests on hand
+    after it. Otherwise the prefetch is abandoned and its question re-queued, so
+    prefetching never delays a user's request. Results land in the normal result caches.
+    """
+
+    def __init__(self, orchestrator, is_idle: Callable[[], bool] = lambda: True):
+        self.orchestrator = orchestrator
+        self.is_idle = is_idle
+        self._queue = OrderedDict()  # normalized key -> question, oldest first
+        self._lock = threading.Lock()
+        self._current = None
+        self.stats_counters = {'enqueued': 0, 'prefetched': 0, 'already_cached': 0, 'dropped': 0, 'failed': 0,
+                               'yielded': 0}
+
+    def on_content_analysis(self, topic: str, content_analysis: Dict[str, Any]):
+        """Analysis listener: queue follow-ups of live questions (not of prefetched ones)."""
+        if self._current and normalize_question(topic) == self._current:
+            return
+        for question in follow_up_questions(content_analysis, Config.PREFETCH_MAX_PER_TOPIC):
+            self.enqueue(question)
+
+    def enqueue(self, question: str):
+        key = normalize_question(question)
+        with self._lock:
+            if key in self._queue:
+                return
+            self._queue[key] = question
+            self.stats_counters['enqueued'] += 1
+            while len(self._queue) > Config.PREFETCH_QUEUE_SIZE:
+                self._queue.popitem(last=False)
+                self.stats_counters['dropped'] += 1
+
+    def _can_run(self, provider: str = None) -> bool:
+        return self.is_idle() and self.orchestrator.has_spare_capacity(
+            1, Config.PREFETCH_HEADROOM_CALLS, provider
+        )
+
+    def _next(self):
+        with self._lock:
+            if not self._queue:
+                return None
+            # Newest first: follow-ups of the latest question are the likeliest next asks
+            return self._queue.popitem(last=True)
+
+    def prefetch_one(self) -> bool:
+        """Generate one queued question if allowed; returns True if work was done."""
+        if not self._can_run():
+            return False
+        item = self._next()
+        if item is None:
+            return False
+
+        key, question = item
+        plan, diagram = self.orchestrator.get_cached(question)
+        if plan and (diagram or not plan.get('needs_image')):
+            self.stats_counters['already_cached'] += 1
+            return True
+
+        self._current = key
+        # Checked again before every provider call the generation makes
+        token = CancellationToken(admit=self._can_run)
+        try:
+            print(f"🔮 Prefetching follow-up: {question}")
+            plan = self.orchestrator.create_visual_plan_free(question, cancel_token=token)
+            if plan and plan.get('needs_image') and not plan.get('fallback'):
+                self.orchestrator.generate_educational_diagram(question, cancel_token=token)
+            self.stats_counters['prefetched'] += 1
+        except Cancelled:
+            # Stages already finished stay cached, so a later retry picks up from there
+            with self._lock:
+                self._queue.setdefault(key, question)
+            self.stats_counters['yielded'] += 1
+            return False
+        except Exception as e:
+            print(f"⚠️ Prefetch failed for '{question}': {e}")
+            self.stats_counters['failed'] += 1
+        finally:
+            self._current = None
+        return True
+
+    def run_forever(self, sleep: Callable[[float], None] = time.sleep):
+        while True:
+            if not self.prefetch_one():
+                sleep(Config.PREFETCH_POLL_SECONDS)
+            else:
+                # Yield between items so live requests re-check the quota first
+                sleep(0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats_counters, queued=len(self._queue))
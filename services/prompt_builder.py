@@ -0,0 +1,103 @@
+# Create: services/prompt_builder.py
+import json
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config import Config
+from services.gemini_service import estimate_tokens
+
+# A projection names the fields a stage reads from an upstream output: a key maps to
+# None (keep the value as is) or to the keys to keep from each dict in a list value.
+Projection = Dict[str, Optional[Sequence[str]]]
+
+
+def project(value: Dict[str, Any], projection: Projection) -> Dict[str, Any]:
+    """Only the projected fields of value, in projection order; missing keys are skipped."""
+    projected = {}
+    for key, item_keys in projection.items():
+        if key not in value:
+            continue
+        field = value[key]
+        if isinstance(field, list):
+            # Always a new list: budget trimming must not touch the upstream output
+            field = [{k: item[k] for k in item_keys if k in item}
+                     if item_keys is not None and isinstance(item, dict) else item
+                     for item in field]
+        projected[key] = field
+    return projected
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def _render(sections: List[Tuple[str, Dict[str, Any]]]) -> str:
+    return '\n'.join(f"{title}: {_dumps(value)}" for title, value in sections)
+
+
+def _longest_list(sections: List[Tuple[str, Dict[str, Any]]]) -> Optional[list]:
+    lists = [field for _, value in sections for field in value.values() if isinstance(field, list) and field]
+    return max(lists, key=len) if lists else None
+
+
+def build_prompt(stage: str, sections: Sequence[Tuple[str, Dict[str, Any], Projection]]) -> str:
+    """User prompt for stage from (title, upstream output, projection) sections.
+
+    Each upstream output is cut down to the projected fields and written as minified
+    JSON. If the estimate still exceeds the stage's budget (Config.PROMPT_TOKEN_BUDGETS),
+    items are dropped from the end of the longest list until it fits.
+    """
+    projected = [(title, project(value or {}, projection)) for title, value, projection in sections]
+    prompt = _render(projected)
+    budget = Config.PROMPT_TOKEN_BUDGETS.get(stage)
+    dropped = 0
+    while budget and estimate_tokens(prompt) > budget:
+        longest = _longest_list(projected)
+        if longest is None:
+            break
+        longest.pop()
+        dropped += 1
+        prompt = _render(projected)
+
+    # What the stage used to send: every field, pretty-printed
+    verbose = '\n'.join(f"{title}: {json.dumps(value, indent=2)}" for title, value, _ in sections)
+    _record(stage, estimate_tokens(prompt), estimate_tokens(verbose), budget, dropped)
+    if dropped:
+        print(f"✂️ {stage} prompt over its {budget}-token budget; dropped {dropped} list items")
+    return prompt
+
+
+_stats: Dict[str, Dict[str, Any]] = {}
+_stats_lock = threading.Lock()
+
+
+def _record(stage: str, tokens: int, verbose_tokens: int, budget: Optional[int], dropped: int):
+    with _stats_lock:
+        stats = _stats.setdefault(stage, {'calls': 0, 'tokens': 0, 'max_tokens': 0, 'verbose_tokens': 0,
+                                          'trimmed_calls': 0, 'dropped_items': 0})
+        stats['calls'] += 1
+        stats['tokens'] += tokens
+        stats['max_tokens'] = max(stats['max_tokens'], tokens)
+        stats['verbose_tokens'] += verbose_tokens
+        stats['budget'] = budget
+        if dropped:
+            stats['trimmed_calls'] += 1
+            stats['dropped_items'] += dropped
+
+
+def prompt_token_stats() -> Dict[str, Dict[str, Any]]:
+    """Per stage: estimated user-prompt tokens per call, the largest, and what full indented JSON would cost."""
+    with _stats_lock:
+        report = {}
+        for stage, stats in _stats.items():
+            calls = stats['calls'] or 1
+            report[stage] = {
+                'calls': stats['calls'],
+                'est_tokens_per_call': round(stats['tokens'] / calls, 1),
+                'max_est_tokens': stats['max_tokens'],
+                'budget': stats['budget'],
+                'verbose_est_tokens_per_call': round(stats['verbose_tokens'] / calls, 1),
+                'trimmed_calls': stats['trimmed_calls'],
+                'dropped_items': stats['dropped_items'],
+            }
+        return report
@@ -0,0 +1,374 @@
+# Create: services/rate_limiter.py
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+from config import Config
+from services.cancellation import Cancelled, record_reservation_released
+
+# Blocking waits use this; app.py swaps in socketio.sleep so waiting yields the eventlet hub
+_sleep: Callable[[float], None] = time.sleep
+
+
+def set_sleep_function(sleep: Callable[[float], None]):
+    global _sleep
+    _sleep = sleep
+
+
+class GrantCounter:
+    """Reservations granted inside a counting_grants() block and the seconds waited for them."""
+
+    def __init__(self):
+        self.count = 0
+        self.waited = 0.0
+
+
+# Each thread and each asyncio task sees its own counter
+_grant_counter: contextvars.ContextVar = contextvars.ContextVar('rate_limit_grant_counter', default=None)
+
+
+@contextmanager
+def counting_grants():
+    """Count what acquire() / acquire_async() grant in the current thread or task within the block.
+
+    Tells whether a provider call reached the provider and how much of its duration was
+    rate-limit wait rather than the request itself.
+    """
+    counter = GrantCounter()
+    reset = _grant_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _grant_counter.reset(reset)
+
+
+def _record_grant(waited: float):
+    counter = _grant_counter.get()
+    if counter is not None:
+        counter.count += 1
+        counter.waited += waited
+
+
+def pause(seconds: float, cancel_token=None, sleep: Callable[[float], None] = None):
+    """Sleep for seconds; with a cancel_token, wake up periodically and raise Cancelled if it fired."""
+    sleep = sleep or _sleep
+    until = time.time() + seconds
+    while True:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        remaining = until - time.time()
+        if remaining <= 0:
+            return
+        sleep(min(remaining, Config.CANCEL_POLL_SECONDS) if cancel_token is not None else remaining)
+
+
+async def pause_async(seconds: float, cancel_token=None):
+    """pause() for coroutines: await the delay, polling cancel_token if given."""
+    until = time.time() + seconds
+    while True:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        remaining = until - time.time()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, Config.CANCEL_POLL_SECONDS) if cancel_token is not None else remaining)
+
+
+def _refill(tokens: float, updated_at: float, capacity: float, rate: float, now: float) -> float:
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+class MemoryBucketStore:
+    """Token buckets in process memory, optionally persisted to a JSON file.
+
+    With a state path, every update runs under an exclusive file lock and re-reads
+    the file, so several processes on one host share the same buckets and the
+    state survives restarts.
+    """
+
+    def __init__(self, state_path: str = None):
+        self.state_path = state_path
+        self._state: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        if state_path:
+            directory = os.path.dirname(state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    def take(self, key: str, capacity: float, rate: float, cost: float, now: float) -> float:
+        """Refill, subtract cost (negative refunds) and return the remaining tokens, which may go below zero."""
+        with self._lock:
+            lock_file = self._lock_state_file()
+            try:
+                state = self._read_state() if self.state_path else self._state
+                tokens, updated_at = state.get(key, (capacity, now))
+                tokens = min(capacity, _refill(tokens, updated_at, capacity, rate, now) - cost)
+                state[key] = [tokens, now]
+                if self.state_path:
+                    self._write_state(state)
+                return tokens
+            finally:
+                if lock_file:
+                    lock_file.close()
+
+    def peek(self, key: str, capacity: float, rate: float, now: float) -> float:
+        with self._lock:
+            state = self._read_state() if self.state_path else self._state
+            tokens, updated_at = state.get(key, (capacity, now))
+            return _refill(tokens, updated_at, capacity, rate, now)
+
+    def _lock_state_file(self):
+        if not self.state_path or fcntl is None:
+            return None
+        lock_file = open(f"{self.state_path}.lock", 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _read_state(self) -> Dict[str, list]:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                self._state = json.load(f)
+        except (OSError, ValueError):
+            pass
+        return self._state
+
+    def _write_state(self, state: Dict[str, list]):
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            print(f"⚠️ Could not persist rate limiter state: {e}")
+
+
+class RedisBucketStore:
+    """Token buckets in Redis, updated atomically by a Lua script so all workers share them.
+
+    Refill is measured with the Redis server clock, so workers with skewed clocks
+    cannot mint tokens; the caller's now is ignored.
+    """
+
+    _TAKE_SCRIPT = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local tokens = tonumber(redis.call('HGET', KEYS[1], 't'))
+local updated_at = tonumber(redis.call('HGET', KEYS[1], 'ts'))
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+if tokens == nil then
+    tokens = capacity
+    updated_at = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate) - cost
+tokens = math.min(capacity, tokens)
+if cost == 0 then
+    return tostring(tokens)
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 86400)
+return tostring(tokens)
+"""
+
+    def __init__(self, client, prefix: str = 'aitutor:ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+        self._take = client.register_script(self._TAKE_SCRIPT)
+
+    def take(self, key: str, capacity: float, rate: float, cost: float, now: float) -> float:
+        return float(self._take(keys=[self.prefix + key], args=[capacity, rate, cost]))
+
+    def peek(self, key: str, capacity: float, rate: float, now: float) -> float:
+        return self.take(key, capacity, rate, 0, now)
+
+
+class Reservation:
+    """Capacity reserved from one provider's buckets.
+
+    The tokens are already taken; the caller must wait delay() seconds before
+    calling the provider, or cancel() to hand back capacity it will not use.
+    """
+
+    def __init__(self, limiter: 'RateLimiter', provider: str, costs: Dict[str, float], ready_at: float):
+        self.limiter = limiter
+        self.provider = provider
+        self.costs = costs
+        self.ready_at = ready_at
+        self.cancelled = False
+
+    def delay(self) -> float:
+        return max(0.0, self.ready_at - time.time())
+
+    def wait(self, sleep: Callable[[float], None] = None, cancel_token=None):
+        """Sleep until due; with a cancel_token, poll it and hand the capacity back if it fires."""
+        try:
+            pause(self.delay(), cancel_token, sleep)
+        except Cancelled:
+            # The call will never be made, so the tokens go back even if already due
+            self._release()
+            raise
+
+    async def wait_async(self, cancel_token=None):
+        """wait() for coroutines; the capacity is also handed back if the awaiting task is cancelled."""
+        try:
+            await pause_async(self.delay(), cancel_token)
+        except (Cancelled, asyncio.CancelledError):
+            self._release()
+            raise
+
+    def cancel(self) -> bool:
+        """Refund the reserved tokens if the call has not become due yet."""
+        if self.cancelled or time.time() >= self.ready_at:
+            return False
+        return self._release()
+
+    def _release(self) -> bool:
+        if self.cancelled:
+            return False
+        self.cancelled = True
+        self.limiter._refund(self)
+        record_reservation_released()
+        return True
+
+
+class RateLimiter:
+    """Per-provider token buckets for requests (RPM) and tokens (TPM).
+
+    A bucket holds only a small burst (a provider's 'burst' limit, default
+    Config.RATE_LIMIT_BURST requests) and refills with the rest of the per-minute
+    limit, so burst plus refill never exceeds the limit in any 60-second window.
+    """
+
+    def __init__(self, store, limits: Dict[str, Dict[str, float]]):
+        self.store = store
+        self.limits = limits
+        self._fallback_store = MemoryBucketStore()
+        self._lock = threading.Lock()
+        self._stats = {provider: {'reservations': 0, 'waited': 0, 'wait_seconds': 0.0, 'refunds': 0}
+                       for provider in limits}
+
+    def _shape(self, provider: str, unit: str) -> tuple:
+        """(capacity, refill per second) of one of a provider's buckets."""
+        limits = self.limits[provider]
+        rpm = limits['rpm']
+        # Never more than half the limit, so some of it is always spread over the minute
+        burst_share = min(limits.get('burst', Config.RATE_LIMIT_BURST), rpm / 2) / rpm
+        per_minute = limits[unit]
+        return per_minute * burst_share, per_minute * (1 - burst_share) / 60.0
+
+    def _buckets(self, provider: str, tokens: float):
+        yield 'rpm', 1
+        if self.limits[provider].get('tpm') and tokens:
+            yield 'tpm', tokens
+
+    def _store_call(self, method: str, *args):
+        try:
+            return getattr(self.store, method)(*args)
+        except Exception as e:
+            # A shared-store outage degrades to per-process limiting rather than failing requests
+            print(f"⚠️ Rate limiter store error, using local buckets: {e}")
+            return getattr(self._fallback_store, method)(*args)
+
+    def reserve(self, provider: str, tokens: float = 0) -> Reservation:
+        """Take capacity now and return immediately; the reservation says how long to wait."""
+        now = time.time()
+        delay = 0.0
+        costs = {}
+        for unit, cost in self._buckets(provider, tokens):
+            capacity, rate = self._shape(provider, unit)
+            remaining = self._store_call('take', f"{provider}:{unit}", capacity, rate, cost, now)
+            costs[unit] = cost
+            if remaining < 0:
+                delay = max(delay, -remaining / rate)
+
+        with self._lock:
+            stats = self._stats[provider]
+            stats['reservations'] += 1
+            if delay > 0:
+                stats['waited'] += 1
+                stats['wait_seconds'] += delay
+        return Reservation(self, provider, costs, now + delay)
+
+    def acquire(self, provider: str, tokens: float = 0, sleep: Callable[[float], None] = None,
+                cancel_token=None) -> Reservation:
+        """Reserve and wait until the call may proceed.
+
+        Raises Cancelled (after releasing the reservation) if cancel_token fires first,
+        and before reserving anything if the token's background admission check declines.
+        """
+        if cancel_token is not None:
+            cancel_token.raise_if_not_admitted(provider)
+        started = time.time()
+        reservation = self.reserve(provider, tokens)
+        reservation.wait(sleep, cancel_token)
+        _record_grant(time.time() - started)
+        return reservation
+
+    async def acquire_async(self, provider: str, tokens: float = 0, cancel_token=None) -> Reservation:
+        """acquire() for coroutines: the wait does not hold a thread."""
+        if cancel_token is not None:
+            cancel_token.raise_if_not_admitted(provider)
+        started = time.time()
+        reservation = self.reserve(provider, tokens)
+        await reservation.wait_async(cancel_token)
+        _record_grant(time.time() - started)
+        return reservation
+
+    def _refund(self, reservation: Reservation):
+        now = time.time()
+        for unit, cost in reservation.costs.items():
+            capacity, rate = self._shape(reservation.provider, unit)
+            self._store_call('take', f"{reservation.provider}:{unit}", capacity, rate, -cost, now)
+        with self._lock:
+            self._stats[reservation.provider]['refunds'] += 1
+
+    def available(self, provider: str) -> float:
+        """Requests the provider could start right now without waiting: the tokens on hand, no future refill."""
+        capacity, rate = self._shape(provider, 'rpm')
+        return self._store_call('peek', f"{provider}:rpm", capacity, rate, time.time())
+
+    def capacity(self, provider: str) -> float:
+        """Most requests the provider's bucket holds, i.e. the largest value available() reaches."""
+        return self._shape(provider, 'rpm')[0]
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            report = {}
+            for provider, stats in self._stats.items():
+                report[provider] = dict(stats, wait_seconds=round(stats['wait_seconds'], 2),
+                                        available=round(self.available(provider), 2))
+            return report
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide limiter; Redis-backed when REDIS_URL is configured."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            from services.cache_service import get_redis_client
+
+            client = get_redis_client()
+            if client is not None:
+                store = RedisBucketStore(client)
+            else:
+                store = MemoryBucketStore(Config.RATE_LIMIT_STATE_PATH)
+            _limiter = RateLimiter(store, Config.RATE_LIMITS)
+        return _limiter
@@ -0,0 +1,250 @@
+# Create: services/scheduler.py
+import heapq
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from config import Config
+from services.cancellation import Cancelled
+from services.latency_tracker import LatencyTracker
+
+
+class AdmissionRejected(Exception):
+    """A generation was not queued; retry_after says when trying again makes sense."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QuotaExceeded(AdmissionRejected):
+    """A session asked for more generations than its fair share allows."""
+
+
+class QueueFull(AdmissionRejected):
+    """The generation queue is at its maximum depth."""
+
+
+class ScheduledJob:
+    def __init__(self, session_id: str, run: Callable[[], None], start_tag: float, finish_tag: float,
+                 seq: int, on_status: Callable[[dict], None] = None):
+        self.session_id = session_id
+        self.run = run
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.on_status = on_status
+        self.submitted_at = time.time()
+
+    def __lt__(self, other):
+        return (self.finish_tag, self.seq) < (other.finish_tag, other.seq)
+
+
+class FairScheduler:
+    """Bounded, weighted-fair generation queue served by a fixed pool of workers.
+
+    Each session's jobs get virtual finish tags spaced by 1/weight, so a session that
+    submits a burst cannot starve the others: dispatch order interleaves sessions.
+    At most max_depth jobs wait; beyond that submissions are rejected with a
+    retry-after hint, so overload degrades into queueing instead of every request
+    timing out together. Queued jobs periodically receive their position and an
+    estimated start time derived from observed per-stage latency.
+
+    Workers block on a wake-up queue from make_queue (an eventlet-aware queue under
+    Flask-SocketIO) holding one token per submitted job, so idle workers cost nothing.
+
+    Per-session state lives only while it matters: fair-share tags until the session's
+    last job finishes, and submit times for the per-minute quota until they are a minute
+    old or the session disconnects (forget_session).
+    """
+
+    def __init__(self, spawn: Callable[..., Any], estimate_job_seconds: Callable[[], float],
+                 workers: int = None, max_depth: int = None,
+                 make_queue: Callable[[], Any] = queue.Queue):
+        self.spawn = spawn
+        self.estimate_job_seconds = estimate_job_seconds
+        self.workers = workers or Config.GENERATION_WORKERS
+        self.max_depth = max_depth or Config.GENERATION_QUEUE_MAX_DEPTH
+        self._wakeups = make_queue()
+        self._started = False
+        self.wait_times = LatencyTracker(window=500)
+        self._peak_depth = 0
+        self._queue: List[ScheduledJob] = []
+        self._running: Dict[int, float] = {}  # seq -> start time
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._session_pending: Dict[str, int] = {}
+        self._session_submits: Dict[str, deque] = {}
+        self._last_sweep = time.time()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'rejected_quota': 0, 'rejected_full': 0, 'dispatched': 0}
+
+    def start(self):
+        """Spawn the worker pool (idempotent)."""
+        if self._started:
+            return
+        self._started = True
+        for _ in range(self.workers):
+            self.spawn(self._worker_loop)
+
+    def submit(self, session_id: str, run: Callable[[], None], weight: float = 1.0,
+               on_status: Callable[[dict], None] = None) -> ScheduledJob:
+        """Queue a job for a session.
+
+        Raises QueueFull when the queue is at max depth and QuotaExceeded when the
+        session is over its share.
+        """
+        now = time.time()
+        with self._lock:
+            if len(self._queue) >= self.max_depth:
+                self._stats['rejected_full'] += 1
+                raise QueueFull("The tutor is very busy right now; please try again shortly.",
+                                retry_after=self._drain_seconds(len(self._queue)))
+            self._sweep_submits(now)
+            self._check_quota(session_id, now)
+            start_tag = max(self._virtual_time, self._last_finish.get(session_id, 0.0))
+            finish_tag = start_tag + 1.0 / max(weight, 0.01)
+            self._last_finish[session_id] = finish_tag
+            job = ScheduledJob(session_id, run, start_tag, finish_tag, next(self._seq), on_status)
+            heapq.heappush(self._queue, job)
+            self._session_pending[session_id] = self._session_pending.get(session_id, 0) + 1
+            self._session_submits.setdefault(session_id, deque()).append(now)
+            self._stats['submitted'] += 1
+            self._peak_depth = max(self._peak_depth, len(self._queue))
+
+        self._wakeups.put(job.seq)
+        return job
+
+    def _drain_seconds(self, depth: int) -> float:
+        """Rough time for the pool to work through depth queued jobs plus one."""
+        return (depth // self.workers + 1) * self.estimate_job_seconds()
+
+    def _check_quota(self, session_id: str, now: float):
+        if self._session_pending.get(session_id, 0) >= Config.SCHEDULER_MAX_PENDING_PER_SESSION:
+            self._stats['rejected_quota'] += 1
+            raise QuotaExceeded("You already have questions being answered; please wait for them.",
+                                retry_after=self.estimate_job_seconds())
+
+        submits = self._session_submits.get(session_id)
+        if submits:
+            while submits and submits[0] < now - 60:
+                submits.popleft()
+            if len(submits) >= Config.SCHEDULER_MAX_JOBS_PER_MINUTE:
+                self._stats['rejected_quota'] += 1
+                raise QuotaExceeded("Too many questions this minute; please slow down.",
+                                    retry_after=submits[0] + 60 - now)
+
+    def _sweep_submits(self, now: float):
+        """Drop submit times older than the quota window, and sessions left with none (at most once a minute)."""
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for session_id, submits in list(self._session_submits.items()):
+            while submits and submits[0] < now - 60:
+                submits.popleft()
+            if not submits:
+                del self._session_submits[session_id]
+
+    def forget_session(self, session_id: str):
+        """Drop a disconnected session's quota history.
+
+        Its queued jobs are left alone: other sessions may be waiting for the same
+        generation, and abandoned ones are cancelled individually with cancel().
+        """
+        with self._lock:
+            self._session_submits.pop(session_id, None)
+
+    def cancel(self, job: ScheduledJob) -> bool:
+        """Drop one queued job; returns False if it already started (or finished)."""
+        with self._lock:
+            if job not in self._queue:
+                return False
+            self._queue.remove(job)
+            heapq.heapify(self._queue)
+            self._release(job.session_id)
+        return True
+
+    def _release(self, session_id: str, count: int = 1):
+        pending = self._session_pending.get(session_id, 0) - count
+        if pending > 0:
+            self._session_pending[session_id] = pending
+        else:
+            self._session_pending.pop(session_id, None)
+            self._last_finish.pop(session_id, None)
+
+    def _next_job(self) -> Optional[ScheduledJob]:
+        with self._lock:
+            if not self._queue:
+                return None  # Its job was cancelled while queued
+            job = heapq.heappop(self._queue)
+            self._virtual_time = max(self._virtual_time, job.start_tag)
+            self._running[job.seq] = time.time()
+            self._stats['dispatched'] += 1
+        self.wait_times.record('queue_wait', time.time() - job.submitted_at)
+        return job
+
+    def _worker_loop(self):
+        while True:
+            self._wakeups.get()
+            job = self._next_job()
+            if job is None:
+                continue
+            try:
+                job.run()
+            except Cancelled:
+                pass
+            except Exception as e:
+                print(f"💥 Generation job failed: {e}")
+            finally:
+                with self._lock:
+                    self._running.pop(job.seq, None)
+                    self._release(job.session_id)
+
+    def queue_positions(self) -> List[dict]:
+        """Position and estimated start for every queued job, in dispatch order."""
+        now = time.time()
+        job_seconds = self.estimate_job_seconds()
+        with self._lock:
+            ordered = sorted(self._queue)
+            # Simulate worker slots: running jobs free up after their expected duration
+            slots = [max(now, started + job_seconds) for started in self._running.values()]
+            slots += [now] * (self.workers - len(slots))
+        heapq.heapify(slots)
+
+        positions = []
+        for position, job in enumerate(ordered, start=1):
+            start_at = heapq.heappop(slots)
+            heapq.heappush(slots, start_at + job_seconds)
+            positions.append({
+                'job': job,
+                'position': position,
+                'queued': len(ordered),
+                'estimated_start_seconds': round(start_at - now, 1)
+            })
+        return positions
+
+    def emit_queue_status(self):
+        for entry in self.queue_positions():
+            job = entry.pop('job')
+            if job.on_status:
+                try:
+                    job.on_status(entry)
+                except Exception as e:
+                    print(f"⚠️ queue_status emit failed: {e}")
+
+    def run_status_loop(self, sleep: Callable[[float], None] = time.sleep):
+        while True:
+            sleep(Config.QUEUE_STATUS_INTERVAL_SECONDS)
+            self.emit_queue_status()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            report = dict(self._stats, queued=len(self._queue), peak_queued=self._peak_depth,
+                          max_depth=self.max_depth, workers=self.workers, busy_workers=len(self._running))
+        report['estimated_job_seconds'] = round(self.estimate_job_seconds(), 2)
+        report['wait_time'] = self.wait_times.stats().get('queue_wait', {})
+        return report
@@ -0,0 +1,249 @@
+# Create: services/similarity_index.py
+import json
+import os
+import random
+import struct
+import threading
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+from services.cache_service import normalize_question
+
+# Words that change the phrasing of a question but not its topic
+FILLER_WORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'do', 'does', 'did', 'can', 'could',
+    'what', 'whats', 'how', 'why', 'when', 'where', 'which', 'who', 'explain', 'show', 'me',
+    'tell', 'about', 'describe', 'teach', 'please', 'i', 'you', 'we', 'of', 'to', 'in', 'on',
+    'for', 'and', 'work', 'works', 'mean', 'means', 'happen', 'happens', 'it', 'this', 'that',
+}
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _shingle_hash(shingle: str) -> int:
+    return struct.unpack('<I', hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest())[0]
+
+
+# Tokens that flip or pin down a question's meaning; candidates must match them exactly.
+# Contractions are split by normalization ("isn't" -> "isn t").
+NEGATION_WORDS = {'not', 'no', 'without', 'non', 'never', 'nor', 'none', 'cannot',
+                  'isn', 'aren', 'doesn', 'don', 'didn', 'wasn', 'weren', 'won', 't'}
+
+# Different ways of asking how something comes about ("how does rain form" / "the rain cycle")
+PROCESS_WORDS = {
+    'form', 'forms', 'formed', 'forming', 'formation', 'cycle', 'cycles', 'process', 'processes',
+    'made', 'make', 'makes', 'create', 'creates', 'created', 'produce', 'produces', 'produced',
+}
+
+
+def _topic_words(question: str) -> List[str]:
+    words = [w for w in normalize_question(question).split() if w not in FILLER_WORDS]
+    words = ['process' if w in PROCESS_WORDS else w for w in words]
+    # Crude plural folding so "clouds" and "cloud" share shingles
+    return [w[:-1] if len(w) > 3 and w.endswith('s') and not w.endswith('ss') else w for w in words]
+
+
+def question_shingles(question: str) -> set:
+    """Word and character 3-gram shingles of the topic words in a question."""
+    words = _topic_words(question)
+    if not words:
+        return set()
+
+    shingles = set(words)
+    joined = f" {' '.join(words)} "
+    shingles.update(joined[i:i + 3] for i in range(len(joined) - 2))
+    return shingles
+
+
+def exact_tokens(question: str) -> Tuple[str, ...]:
+    """Numbers and negations in a question, in order: "war 1" is not "war 2", "not a mammal" is not "a mammal"."""
+    return tuple(w for w in normalize_question(question).split()
+                 if w in NEGATION_WORDS or any(c.isdigit() for c in w))
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class MinHashLSHIndex:
+    """Approximate near-duplicate question index using MinHash signatures and LSH banding.
+
+    Lookups hash the question once, probe one bucket per band and compare only the
+    colliding candidates, so cost stays flat as the index grows. Keys are normalized
+    questions, so each candidate is then verified exactly: its numbers and negations
+    must be the same and the Jaccard similarity of its full shingle set (not the
+    MinHash estimate) must reach the threshold.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.6,
+                 persist_path: str = None, seed: int = 1, max_candidates: int = 3):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.persist_path = persist_path
+        self.max_candidates = max_candidates
+
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randint(1, _MERSENNE_PRIME - 1), rng.randint(0, _MERSENNE_PRIME - 1))
+            for _ in range(num_perm)
+        ]
+        self._buckets: List[Dict[Tuple[int, ...], List[str]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[str, Tuple[int, ...]] = {}
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._near_hits = 0
+        self._rejected = 0
+        self._removed = 0
+
+        if persist_path:
+            self._load()
+
+    def signature(self, question: str) -> Optional[Tuple[int, ...]]:
+        hashes = [_shingle_hash(s) for s in question_shingles(question)]
+        if not hashes:
+            return None
+        return tuple(
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes) & _MAX_HASH
+            for a, b in self._perms
+        )
+
+    def _band_keys(self, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def add(self, key: str) -> bool:
+        """Index a cached question under its cache key (the normalized question); False if it has no topic words."""
+        signature = self.signature(key)
+        if signature is None:
+            return False
+        with self._lock:
+            if key in self._signatures:
+                return True
+            self._insert(key, signature)
+        self._append(key, signature)
+        return True
+
+    def _insert(self, key: str, signature: Tuple[int, ...]):
+        self._signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+    def remove(self, key: str) -> bool:
+        """Forget a key whose cached results expired or were evicted; False if it was not indexed."""
+        with self._lock:
+            signature = self._signatures.pop(key, None)
+            if signature is None:
+                return False
+            for band, band_key in self._band_keys(signature):
+                bucket = self._buckets[band].get(band_key)
+                if bucket and key in bucket:
+                    bucket.remove(key)
+                    if not bucket:
+                        del self._buckets[band][band_key]
+            self._removed += 1
+        self._append(key, None)
+        return True
+
+    def query(self, question: str, limit: int = None) -> List[Tuple[str, float]]:
+        """Up to limit (cache_key, similarity) pairs above threshold, most similar first.
+
+        Callers try them in order, so a best match whose entry has expired falls
+        through to the next one.
+        """
+        signature = self.signature(question)
+        with self._lock:
+            self._lookups += 1
+        if signature is None:
+            return []
+
+        with self._lock:
+            candidates = set()
+            for band, band_key in self._band_keys(signature):
+                candidates.update(self._buckets[band].get(band_key, ()))
+            estimated = [
+                key for key in candidates
+                if sum(1 for x, y in zip(signature, self._signatures[key]) if x == y) / self.num_perm >= self.threshold
+            ]
+
+        shingles = question_shingles(question)
+        tokens = exact_tokens(question)
+        matches = []
+        rejected = 0
+        for key in estimated:
+            similarity = jaccard(shingles, question_shingles(key))
+            if similarity >= self.threshold and exact_tokens(key) == tokens:
+                matches.append((key, similarity))
+            else:
+                rejected += 1
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        matches = matches[:limit or self.max_candidates]
+
+        with self._lock:
+            self._rejected += rejected
+            if matches:
+                self._near_hits += 1
+        return matches
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'indexed': len(self._signatures),
+                'lookups': self._lookups,
+                'near_hits': self._near_hits,
+                'rejected_candidates': self._rejected,
+                'removed': self._removed,
+                'threshold': self.threshold,
+            }
+
+    def _append(self, key: str, signature: Optional[Tuple[int, ...]]):
+        """Persist an addition, or a removal when signature is None."""
+        if not self.persist_path:
+            return
+        entry = {'key': key, 'sig': signature} if signature is not None else {'key': key, 'removed': True}
+        try:
+            with open(self.persist_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        except OSError as e:
+            print(f"⚠️ Similarity index append failed: {e}")
+
+    def _load(self):
+        directory = os.path.dirname(self.persist_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self.persist_path):
+            return
+        lines = 0
+        with open(self.persist_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                    key = entry['key']
+                    if entry.get('removed'):
+                        self.remove(key)
+                        continue
+                    signature = tuple(entry['sig'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if len(signature) == self.num_perm and key not in self._signatures:
+                    self._insert(key, signature)
+        self._removed = 0
+        if lines > len(self._signatures):
+            self._compact()
+        print(f"📚 Loaded {len(self._signatures)} questions into similarity index")
+
+    def _compact(self):
+        """Rewrite the log with only the live entries, dropping removals and duplicates."""
+        tmp_path = f"{self.persist_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for key, signature in self._signatures.items():
+                    f.write(json.dumps({'key': key, 'sig': signature}) + '\n')
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            print(f"⚠️ Similarity index compaction failed: {e}")
@@ -0,0 +1,118 @@
+# Create: services/single_flight.py
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from services.cancellation import CancellationToken
+
+# Gemini calls a full staged generation makes (plan, content, layout, visuals)
+LLM_CALLS_PER_GENERATION = 4
+
+
+class Flight:
+    """One in-flight generation and the sessions waiting on its events."""
+
+    def __init__(self, key: str, leader_session: str, emit: Callable[[str, dict, str], None]):
+        self.key = key
+        self.leader_session = leader_session
+        self.sessions = [leader_session]
+        self.events: List[Tuple[str, dict]] = []
+        self.started_at = time.time()
+        self.cancel_token = CancellationToken()
+        self.job = None  # Scheduler job running this flight, once queued
+        self.pipeline_mode = 'staged'  # 'staged' or 'fused', chosen by the leader's request
+        self._emit = emit
+        self._lock = threading.Lock()
+
+    def publish(self, event: str, data: dict, replay: bool = True):
+        """Send an event to every attached session, recording it for late joiners if replay is set."""
+        with self._lock:
+            if replay:
+                self.events.append((event, data))
+            sessions = list(self.sessions)
+        for session_id in sessions:
+            try:
+                self._emit(event, data, session_id)
+            except Exception as e:
+                print(f"⚠️ Could not emit {event} to {session_id}: {e}")
+
+    def attach(self, session_id: str) -> List[Tuple[str, dict]]:
+        """Attach a waiter and return the events it has missed so far."""
+        with self._lock:
+            if session_id not in self.sessions:
+                self.sessions.append(session_id)
+            return list(self.events)
+
+    def detach(self, session_id: str) -> bool:
+        """Stop sending events to a session; returns True if no session is left."""
+        with self._lock:
+            if session_id in self.sessions:
+                self.sessions.remove(session_id)
+            return not self.sessions
+
+
+class SingleFlight:
+    """Coalesces identical in-flight generations so only the first request runs the pipeline."""
+
+    def __init__(self, emit: Callable[[str, dict, str], None]):
+        self._emit = emit
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self._leaders = 0
+        self._coalesced = 0
+        self._abandoned = 0
+
+    def join(self, key: str, session_id: str) -> Tuple[Flight, bool, List[Tuple[str, dict]]]:
+        """Join or start the flight for key.
+
+        Returns (flight, is_leader, missed_events). Only the leader should run the
+        pipeline; waiters replay missed_events and then receive live ones.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = Flight(key, session_id, self._emit)
+                self._flights[key] = flight
+                self._leaders += 1
+                return flight, True, []
+            self._coalesced += 1
+        return flight, False, flight.attach(session_id)
+
+    def finish(self, flight: Flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def leave(self, session_id: str, keep_key: str = None) -> List[Flight]:
+        """Detach a session from its flights (except keep_key's) and cancel the abandoned ones.
+
+        A flight is abandoned once its last session leaves: its cancel token fires and
+        it is forgotten, so the same question asked later starts a fresh run. Returns
+        the abandoned flights so the caller can also drop their queued jobs.
+        """
+        abandoned = []
+        with self._lock:
+            for key, flight in list(self._flights.items()):
+                if key == keep_key or session_id not in flight.sessions:
+                    continue
+                if flight.detach(session_id):
+                    del self._flights[key]
+                    abandoned.append(flight)
+            self._abandoned += len(abandoned)
+        for flight in abandoned:
+            flight.cancel_token.cancel(f"no session is waiting for '{flight.key}'")
+        return abandoned
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self._leaders,
+                'coalesced_requests': self._coalesced,
+                'abandoned': self._abandoned,
+                'llm_calls_saved_estimate': self._coalesced * LLM_CALLS_PER_GENERATION,
+            }
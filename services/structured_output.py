@@ -0,0 +1,131 @@
+# Create: services/structured_output.py
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+# Schemas use the OpenAPI subset both Gemini (response_schema) and JSON Schema accept:
+# type, properties, required, items, nullable.
+_TYPE_CHECKS = {
+    'object': lambda value: isinstance(value, dict),
+    'array': lambda value: isinstance(value, list),
+    'string': lambda value: isinstance(value, str),
+    'integer': lambda value: isinstance(value, int) and not isinstance(value, bool),
+    'number': lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    'boolean': lambda value: isinstance(value, bool),
+}
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = '$') -> List[str]:
+    """Return the ways value breaks schema (empty if it conforms)."""
+    if value is None:
+        return [] if schema.get('nullable') else [f"{path} is null"]
+    expected = schema.get('type', 'object').lower()
+    if not _TYPE_CHECKS[expected](value):
+        return [f"{path} should be {expected}, got {type(value).__name__}"]
+    errors = []
+    if expected == 'object':
+        errors += [f"{path}.{key} is missing" for key in schema.get('required', ()) if key not in value]
+        for key, subschema in schema.get('properties', {}).items():
+            if key in value:
+                errors += validate(value[key], subschema, f"{path}.{key}")
+    elif expected == 'array' and 'items' in schema:
+        for index, item in enumerate(value):
+            errors += validate(item, schema['items'], f"{path}[{index}]")
+    return errors
+
+
+def gemini_generation_config(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Generation config that makes Gemini answer with JSON conforming to schema."""
+    return {'response_mime_type': 'application/json', 'response_schema': _to_gemini_schema(schema)}
+
+
+def _to_gemini_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """The same schema with the upper-case type names of Gemini's Schema proto."""
+    converted = dict(schema, type=schema.get('type', 'object').upper())
+    if 'properties' in schema:
+        converted['properties'] = {key: _to_gemini_schema(value) for key, value in schema['properties'].items()}
+    if 'items' in schema:
+        converted['items'] = _to_gemini_schema(schema['items'])
+    return converted
+
+
+def to_json_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """The same schema as plain JSON Schema (nullable becomes a type union), e.g. for Perplexity."""
+    converted = {key: value for key, value in schema.items() if key not in ('properties', 'items', 'nullable')}
+    if 'properties' in schema:
+        converted['properties'] = {key: to_json_schema(value) for key, value in schema['properties'].items()}
+    if 'items' in schema:
+        converted['items'] = to_json_schema(schema['items'])
+    converted['type'] = schema.get('type', 'object').lower()
+    if schema.get('nullable'):
+        converted['type'] = [converted['type'], 'null']
+    return converted
+
+
+def _loads_lenient(text: str) -> Any:
+    """Parse JSON wrapped in prose or a code fence: the outermost {...} in the text."""
+    start = text.find('{')
+    end = text.rfind('}') + 1
+    if start == -1 or end <= start:
+        raise ValueError("no JSON object in response")
+    return json.loads(text[start:end])
+
+
+def parse_response(agent: str, response: Any, schema: Dict[str, Any],
+                   repair: Callable[[Any], Any] = None) -> Optional[Any]:
+    """Parse and validate one agent response; None (counted as a parse failure) if unusable.
+
+    response is the provider's text, or an already decoded value. Text that is not
+    pure JSON is recovered locally (outermost object, then the agent's own repair
+    function) rather than by asking the provider again.
+    """
+    outcome = 'parsed'
+    value = response
+    if isinstance(response, str):
+        try:
+            value = json.loads(response)
+        except ValueError:
+            outcome = 'repaired'
+            try:
+                value = _loads_lenient(response)
+            except ValueError:
+                value = None
+    errors = validate(value, schema)
+
+    if errors and repair is not None:
+        outcome = 'repaired'
+        try:
+            value = repair(response)
+        except Exception as e:
+            value = None
+            print(f"⚠️ {agent} response repair failed: {e}")
+        errors = validate(value, schema)
+
+    if errors:
+        _record(agent, 'failed', errors[0])
+        print(f"❌ {agent} response does not match its schema: {errors[0]}")
+        return None
+    _record(agent, outcome)
+    return value
+
+
+_stats: Dict[str, Dict[str, Any]] = {}
+_stats_lock = threading.Lock()
+
+
+def _record(agent: str, outcome: str, error: str = None):
+    with _stats_lock:
+        stats = _stats.setdefault(agent, {'responses': 0, 'parsed': 0, 'repaired': 0, 'failed': 0})
+        stats['responses'] += 1
+        stats[outcome] += 1
+        if error:
+            stats['last_error'] = error
+
+
+def structured_output_stats() -> Dict[str, Dict[str, Any]]:
+    """Per agent: responses, how many parsed directly / needed local repair / failed, and the failure rate."""
+    with _stats_lock:
+        return {
+            agent: dict(stats, failure_rate=round(stats['failed'] / stats['responses'], 3))
+            for agent, stats in _stats.items()
+        }
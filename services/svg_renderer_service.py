@@ -1,5 +1,4 @@
 # Create: services/svg_renderer_service.py
-import base64
 from typing import Dict, Any
 import math
 
@@ -15,12 +14,8 @@ class SVGEducationalRenderer:
         
         svg_content = self._build_svg(content_analysis, layout_plan, visual_design)
         
-        # Convert to base64 for web use
-        svg_b64 = base64.b64encode(svg_content.encode('utf-8')).decode('utf-8')
-        data_url = f"data:image/svg+xml;base64,{svg_b64}"
-        
+        # Publishing (content-addressed URL or data URL) is left to the caller
         return {
-            'data': data_url,
             'source': 'multi_agent_svg',
             'svg_content': svg_content,
             'metadata': {
@@ -0,0 +1,147 @@
+# Create: services/warmup_service.py
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+from config import Config
+from services.cache_service import normalize_question
+from services.cancellation import CancellationToken, Cancelled
+
+
+def read_library(path: str) -> List[Dict[str, Any]]:
+    """Read topic entries from a library file; a missing or corrupt file yields no entries."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('topics', [])
+    except (OSError, ValueError) as e:
+        if os.path.exists(path):
+            print(f"⚠️ Could not read topic library {path}: {e}")
+        return []
+
+
+def write_library(path: str, entries: List[Dict[str, Any]]):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'topics': entries}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def merge_libraries(bundled: List[Dict[str, Any]], refreshed: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Overlay refreshed entries on the bundled ones, keeping the newest per question."""
+    merged = {}
+    for entry in bundled + refreshed:
+        key = normalize_question(entry.get('question', ''))
+        if not key:
+            continue
+        current = merged.get(key)
+        if current is None or entry.get('generated_at', 0) >= current.get('generated_at', 0):
+            merged[key] = entry
+    return list(merged.values())
+
+
+class WarmupService:
+    """Loads a precomputed topic library into the result caches and keeps it fresh.
+
+    The bundled library ships with the app; entries regenerated at runtime are written
+    to a separate state file on the temp volume so they survive restarts. Regeneration
+    only runs when the Gemini quota has headroom to spare for live requests.
+    """
+
+    def __init__(self, orchestrator, library_path: str = None, state_path: str = None):
+        self.orchestrator = orchestrator
+        self.library_path = library_path or Config.WARMUP_LIBRARY_PATH
+        self.state_path = state_path or Config.WARMUP_STATE_PATH
+        self.max_age = Config.WARMUP_MAX_AGE_SECONDS
+        self.entries: List[Dict[str, Any]] = []
+        self.stats_counters = {'loaded': 0, 'refreshed': 0, 'refresh_failures': 0, 'skipped_no_quota': 0}
+
+    def load(self) -> int:
+        """Seed the caches from the library; returns how many entries had results."""
+        self.entries = merge_libraries(read_library(self.library_path), read_library(self.state_path))
+        loaded = 0
+        for entry in self.entries:
+            if entry.get('plan') or entry.get('diagram'):
+                self.orchestrator.seed_cache(entry['question'], entry.get('plan'), entry.get('diagram'))
+                loaded += 1
+        self.stats_counters['loaded'] = loaded
+        print(f"🔥 Warm-up loaded {loaded}/{len(self.entries)} library topics")
+        return loaded
+
+    def _needs_refresh(self, entry: Dict[str, Any]) -> bool:
+        # Don't keep spending quota on a topic that just failed
+        if time.time() - entry.get('last_failure', 0) < Config.WARMUP_RETRY_SECONDS:
+            return False
+        if not entry.get('plan'):
+            return True
+        if entry['plan'].get('needs_image') and not entry.get('diagram'):
+            return True
+        return time.time() - entry.get('generated_at', 0) > self.max_age
+
+    def _has_spare_capacity(self, provider: str = None) -> bool:
+        return self.orchestrator.has_spare_capacity(1, Config.WARMUP_HEADROOM_CALLS, provider)
+
+    def refresh_entry(self, entry: Dict[str, Any]) -> bool:
+        """Regenerate one entry; returns True if it was refreshed."""
+        question = entry['question']
+        print(f"🔥 Warm-up regenerating: {question}")
+        # Every provider call must leave WARMUP_HEADROOM_CALLS for live requests, not just the first
+        token = CancellationToken(admit=self._has_spare_capacity)
+        try:
+            plan = self.orchestrator.create_visual_plan_free(question, use_cache=False, cancel_token=token)
+            if not plan or plan.get('fallback'):
+                raise Exception("planning returned a fallback plan")
+            diagram = None
+            if plan.get('needs_image'):
+                result = self.orchestrator.generate_educational_diagram(question, use_cache=False,
+                                                                        cancel_token=token)
+                diagram = {key: result[key] for key in ('source', 'svg_content', 'metadata') if key in result}
+        except Cancelled:
+            print(f"⏸️ Warm-up of '{question}' paused: quota is needed by live requests")
+            self.stats_counters['skipped_no_quota'] += 1
+            return False
+        except Exception as e:
+            print(f"⚠️ Warm-up refresh failed for '{question}': {e}")
+            self.stats_counters['refresh_failures'] += 1
+            entry['last_failure'] = time.time()
+            return False
+
+        entry.update({'plan': plan, 'diagram': diagram, 'generated_at': time.time()})
+        self.stats_counters['refreshed'] += 1
+        try:
+            write_library(self.state_path, self.entries)
+        except OSError as e:
+            print(f"⚠️ Could not persist refreshed topic library: {e}")
+        return True
+
+    def run_forever(self, sleep: Callable[[float], None] = time.sleep):
+        """Background loop: refresh stale entries one at a time while quota is spare."""
+        while True:
+            stale = sorted((e for e in self.entries if self._needs_refresh(e)),
+                           key=lambda e: e.get('generated_at', 0))
+            for entry in stale:
+                if not self._has_spare_capacity():
+                    self.stats_counters['skipped_no_quota'] += 1
+                    break
+                self.refresh_entry(entry)
+                sleep(Config.WARMUP_INTERVAL_SECONDS)
+            sleep(Config.WARMUP_INTERVAL_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.stats_counters, topics=len(self.entries),
+                    stale=sum(1 for entry in self.entries if self._needs_refresh(entry)))
+
+
+if __name__ == '__main__':
+    # python -m services.warmup_service export
+    # Folds runtime-refreshed entries back into the bundled library before a release.
+    if sys.argv[1:] == ['export']:
+        entries = merge_libraries(read_library(Config.WARMUP_LIBRARY_PATH), read_library(Config.WARMUP_STATE_PATH))
+        write_library(Config.WARMUP_LIBRARY_PATH, entries)
+        print(f"✅ Exported {len(entries)} topics to {Config.WARMUP_LIBRARY_PATH}")
+    else:
+        print("Usage: python -m services.warmup_service export")
@@ -0,0 +1,197 @@
+# Create: services/wire_format.py
+from typing import Any, Dict, List
+
+from config import Config
+
+# Compact response dialect for the layout and visual agents. Output tokens dominate
+# generation latency, so answers use one-letter keys, [x, y, w, h] boxes instead of
+# four named fields, and leave out anything equal to its default. expand_layout() and
+# expand_visuals() turn them back into the verbose dicts the renderer reads.
+
+LAYOUT_PRIORITIES = {'p': 'primary', 's': 'secondary', 't': 'tertiary'}
+PATH_TYPES = {'s': 'straight', 'c': 'curved', 't': 'stepped'}
+
+# Defaults match what SVGEducationalRenderer assumes for a missing field
+VISUAL_ELEMENT_KEYS = {'n': 'name', 's': 'shape', 'f': 'fill_color', 'k': 'stroke_color',
+                       'w': 'stroke_width', 'p': 'pattern'}
+VISUAL_ELEMENT_DEFAULTS = {'shape': 'rectangle', 'fill_color': '#4A90E2', 'stroke_color': '#2C3E50',
+                           'stroke_width': 2, 'pattern': 'solid'}
+CONNECTION_STYLE_KEYS = {'f': 'from', 't': 'to', 'a': 'arrow_style', 'k': 'color', 'w': 'thickness',
+                         'm': 'animation_hint'}
+CONNECTION_STYLE_DEFAULTS = {'arrow_style': 'simple', 'color': '#2C3E50', 'thickness': 2, 'animation_hint': 'none'}
+TEXT_STYLE_KEYS = {'k': 'type', 'z': 'font_size', 'c': 'color', 'b': 'weight'}
+TEXT_STYLE_DEFAULTS = {'font_size': 14, 'color': '#2C3E50', 'weight': 'normal'}
+DEFAULT_TEXT_ZONES = [{'type': 'title', 'x': 600, 'y': 50, 'max_width': 400}]
+
+COMPACT_LAYOUT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        's': {'type': 'string'},
+        'e': {'type': 'array', 'items': {
+            'type': 'object',
+            'properties': {
+                'n': {'type': 'string'},
+                'b': {'type': 'array', 'items': {'type': 'number'}},
+                'r': {'type': 'string'},
+            },
+            'required': ['n', 'b'],
+        }},
+        'c': {'type': 'array', 'items': {
+            'type': 'object',
+            'properties': {
+                'f': {'type': 'string'},
+                't': {'type': 'string'},
+                'k': {'type': 'string'},
+                'p': {'type': 'array', 'items': {'type': 'array', 'items': {'type': 'number'}}},
+            },
+            'required': ['f', 't'],
+        }},
+        'h': {'type': 'array', 'items': {'type': 'string'}},
+    },
+    'required': ['s', 'e'],
+}
+
+COMPACT_VISUAL_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'e': {'type': 'array', 'items': {
+            'type': 'object',
+            'properties': {
+                'n': {'type': 'string'},
+                's': {'type': 'string'},
+                'f': {'type': 'string'},
+                'k': {'type': 'string'},
+                'w': {'type': 'number'},
+                'p': {'type': 'string'},
+            },
+            'required': ['n'],
+        }},
+        'c': {'type': 'array', 'items': {
+            'type': 'object',
+            'properties': {
+                'f': {'type': 'string'},
+                't': {'type': 'string'},
+                'a': {'type': 'string'},
+                'k': {'type': 'string'},
+                'w': {'type': 'number'},
+                'm': {'type': 'string'},
+            },
+            'required': ['f', 't'],
+        }},
+        't': {'type': 'array', 'items': {
+            'type': 'object',
+            'properties': {
+                'k': {'type': 'string'},
+                'z': {'type': 'number'},
+                'c': {'type': 'string'},
+                'b': {'type': 'boolean'},
+            },
+            'required': ['k'],
+        }},
+        'th': {'type': 'string'},
+    },
+    'required': ['e'],
+}
+
+_COMPACT_INTRO = "Respond with compact JSON (short keys; leave out any field equal to its default):\n"
+
+COMPACT_LAYOUT_EXAMPLE = """{
+  "s": "center_focus|left_to_right|top_to_bottom|circular|radial",
+  "e": [
+    {"n": "element_name", "b": [100, 150, 120, 80], "r": "p"},
+    {"n": "element2", "b": [300, 200, 100, 60]}
+  ],
+  "c": [
+    {"f": "element1", "t": "element2", "k": "c", "p": [[200, 120]]}
+  ],
+  "h": ["most_important_element", "second_important", "supporting_elements"]
+}"""
+
+COMPACT_LAYOUT_KEYS = """s = layout strategy. e = elements: n = name, b = [x, y, width, height],
+r = priority p|s|t (primary|secondary|tertiary, default s).
+c = connection paths: f = from, t = to, k = path type s|c|t (straight|curved|stepped, default s),
+p = control points (default none). h = visual hierarchy, most important first (default: order of e)."""
+
+COMPACT_VISUAL_EXAMPLE = """{
+  "e": [
+    {"n": "element_name", "s": "circle", "f": "#E3F2FD", "k": "#1565C0", "w": 3}
+  ],
+  "c": [
+    {"f": "element1", "t": "element2", "a": "curved", "m": "flow"}
+  ],
+  "t": [
+    {"k": "title", "z": 24, "b": true},
+    {"k": "label"}
+  ],
+  "th": "friendly"
+}"""
+
+COMPACT_VISUAL_KEYS = """e = elements: n = name, s = shape (default rectangle), f = fill color, k = stroke color (default #2C3E50),
+w = stroke width (default 2), p = pattern (default solid).
+c = connection styles: f = from, t = to, a = arrow style simple|curved|double|dashed (default simple),
+k = color (default #2C3E50), w = thickness (default 2), m = animation hint none|flow|pulse|grow (default none).
+t = text styles: k = type title|label|annotation, z = font size (default 14), c = color (default #2C3E50),
+b = bold (default false). th = overall theme modern|friendly|scientific|playful."""
+
+COMPACT_LAYOUT_PROMPT = _COMPACT_INTRO + COMPACT_LAYOUT_EXAMPLE + "\n" + COMPACT_LAYOUT_KEYS
+COMPACT_VISUAL_PROMPT = _COMPACT_INTRO + COMPACT_VISUAL_EXAMPLE + "\n" + COMPACT_VISUAL_KEYS
+
+
+def compact_enabled() -> bool:
+    return Config.COMPACT_WIRE_FORMAT
+
+
+def usage_label(agent: str) -> str:
+    """Gemini usage label for agent; compact calls are counted apart so both dialects can be compared."""
+    return f"{agent}.compact" if compact_enabled() else agent
+
+
+def _expand(item: Dict[str, Any], keys: Dict[str, str], defaults: Dict[str, Any]) -> Dict[str, Any]:
+    expanded = dict(defaults)
+    expanded.update({keys[key]: value for key, value in item.items() if key in keys})
+    return expanded
+
+
+def expand_layout(compact: Dict[str, Any]) -> Dict[str, Any]:
+    """Verbose layout dict (element_positions, connection_paths, ...) from a compact answer."""
+    positions = []
+    for element in compact['e']:
+        box = list(element['b']) + [None] * 4
+        positions.append({
+            'name': element['n'],
+            'x': box[0] or 0,
+            'y': box[1] or 0,
+            'width': box[2] or 100,
+            'height': box[3] or 60,
+            'priority': LAYOUT_PRIORITIES.get(element.get('r', 's'), 'secondary'),
+        })
+    paths = [{
+        'from': path['f'],
+        'to': path['t'],
+        'path_type': PATH_TYPES.get(path.get('k', 's'), 'straight'),
+        'control_points': path.get('p', []),
+    } for path in compact.get('c', [])]
+    return {
+        'layout_strategy': compact['s'],
+        'element_positions': positions,
+        'connection_paths': paths,
+        'text_zones': [dict(zone) for zone in DEFAULT_TEXT_ZONES],
+        'visual_hierarchy': compact.get('h') or [position['name'] for position in positions],
+    }
+
+
+def expand_visuals(compact: Dict[str, Any]) -> Dict[str, Any]:
+    """Verbose visual design dict (visual_elements, connection_styles, ...) from a compact answer."""
+    text_styles: List[Dict[str, Any]] = []
+    for style in compact.get('t', []):
+        expanded = _expand(style, TEXT_STYLE_KEYS, TEXT_STYLE_DEFAULTS)
+        expanded['weight'] = 'bold' if style.get('b') else 'normal'
+        text_styles.append(expanded)
+    return {
+        'visual_elements': [_expand(element, VISUAL_ELEMENT_KEYS, VISUAL_ELEMENT_DEFAULTS)
+                            for element in compact['e']],
+        'connection_styles': [_expand(style, CONNECTION_STYLE_KEYS, CONNECTION_STYLE_DEFAULTS)
+                              for style in compact.get('c', [])],
+        'text_styles': text_styles,
+        'overall_theme': compact.get('th', 'friendly'),
+    }
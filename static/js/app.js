@@ -102,7 +102,7 @@ class AITutorApp {
 
         this.socket.on('image_ready', (data) => {
             console.log('🖼️ Background image ready');
-            this.canvasEngine.setBackgroundImage(data.image_data);
+            this.canvasEngine.setBackgroundImage(data.image_url || data.image_data);
             this.updateStatus('Background image loaded. Creating diagram...');
         });
 
@@ -138,6 +138,13 @@ class AITutorApp {
             this.updateLoadingText(data.message);
         });
 
+        this.socket.on('queue_status', (data) => {
+            const wait = Math.max(0, Math.round(data.estimated_start_seconds));
+            const message = `You're #${data.position} in line - starting in about ${wait}s`;
+            this.updateStatus(message);
+            this.updateLoadingText(message);
+        });
+
         this.socket.on('generation_progress', (data) => {
             console.log('⏳ Progress:', data.message);
             this.updateLoadingText(data.message);
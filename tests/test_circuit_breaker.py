@@ -0,0 +1,183 @@
+import pytest
+
+from services import circuit_breaker
+from services.cancellation import Cancelled
+from services.circuit_breaker import CircuitBreaker, CircuitOpen, call_with_breaker, classify_error
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, 'time', fake.time)
+    # Cool-downs take their upper bound instead of a random jitter
+    monkeypatch.setattr(circuit_breaker.random, 'uniform', lambda low, high: high)
+    return fake
+
+
+class HttpError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type('Response', (), {'headers': {'retry-after': retry_after} if retry_after else {}})()
+
+
+def make_breaker(**kwargs):
+    kwargs.setdefault('failure_threshold', 2)
+    kwargs.setdefault('reset_seconds', 10.0)
+    return CircuitBreaker('gemini', **kwargs)
+
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = make_breaker()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.is_open()
+    with pytest.raises(CircuitOpen) as rejected:
+        breaker.before_call()
+    assert rejected.value.retry_after == pytest.approx(10.0)
+    assert breaker.stats()['short_circuited'] == 1
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 10
+    assert not breaker.is_open()
+    breaker.before_call()
+    assert breaker.state == 'half_open'
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()  # Only one probe at a time
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    breaker.before_call()
+
+
+def test_half_open_probe_failure_doubles_the_cooldown(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 10
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    clock.now += 10
+    assert breaker.is_open()
+    clock.now += 10
+    assert not breaker.is_open()
+
+
+def test_cooldown_is_capped(clock):
+    breaker = make_breaker(max_reset_seconds=15.0)
+    trip(breaker)
+    for _ in range(3):
+        clock.now += 15
+        breaker.before_call()
+        breaker.record_failure()
+    clock.now += 15
+    assert not breaker.is_open()
+
+
+def test_retry_after_opens_for_the_server_hint(clock):
+    breaker = make_breaker()
+    breaker.before_call()
+    breaker.record_failure(retry_after=42.0)
+    clock.now += 41
+    assert breaker.is_open()
+    clock.now += 1
+    assert not breaker.is_open()
+
+
+def test_release_returns_the_probe(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 10
+    breaker.before_call()
+    breaker.release()
+    breaker.before_call()
+    assert breaker.state == 'half_open'
+
+
+@pytest.mark.parametrize('error, expected', [
+    (HttpError(429, retry_after='7'), (True, 7.0)),
+    (HttpError(503), (True, None)),
+    (HttpError(400), (False, None)),
+    (TimeoutError('read timed out'), (True, None)),
+    (HttpError(429), (True, None)),
+    (ValueError('bad json'), (False, None)),
+])
+def test_classify_error(error, expected):
+    assert classify_error(error) == expected
+
+
+def test_retry_hint_is_read_from_the_error_text():
+    error = Exception('429 Quota exceeded, please retry in 3.5s')
+    error.code = 429
+    assert classify_error(error) == (True, 3.5)
+
+
+def test_call_with_breaker_retries_transient_errors(clock, monkeypatch):
+    monkeypatch.setattr(circuit_breaker, '_breakers', {'gemini': make_breaker(failure_threshold=5)})
+    monkeypatch.setattr(circuit_breaker, 'pause', lambda delay, cancel_token=None: None)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 2:
+            raise HttpError(503)
+        return 'ok'
+
+    assert call_with_breaker('gemini', flaky) == 'ok'
+    assert len(calls) == 2
+
+
+def test_call_with_breaker_does_not_count_bad_requests(clock, monkeypatch):
+    breaker = make_breaker(failure_threshold=1)
+    monkeypatch.setattr(circuit_breaker, '_breakers', {'gemini': breaker})
+
+    def bad_request():
+        raise HttpError(400)
+
+    with pytest.raises(HttpError):
+        call_with_breaker('gemini', bad_request)
+    assert breaker.state == 'closed'
+
+
+def test_cancelled_probe_is_released(clock, monkeypatch):
+    breaker = make_breaker()
+    monkeypatch.setattr(circuit_breaker, '_breakers', {'gemini': breaker})
+    trip(breaker)
+    clock.now += 10
+
+    def cancelled():
+        raise Cancelled('user left')
+
+    with pytest.raises(Cancelled):
+        call_with_breaker('gemini', cancelled)
+    assert call_with_breaker('gemini', lambda: 'ok') == 'ok'
+    assert breaker.state == 'closed'
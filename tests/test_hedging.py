@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+import pytest
+
+from services import hedging
+from services.hedging import Hedger
+from services.rate_limiter import MemoryBucketStore, RateLimiter
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = RateLimiter(MemoryBucketStore(), {'gemini': {'rpm': 60}, 'perplexity': {'rpm': 60}})
+    monkeypatch.setattr(hedging, 'get_rate_limiter', lambda: limiter)
+    return limiter
+
+
+def make_hedger():
+    return Hedger('test', 'gemini', 'perplexity', {'enabled': True, 'default_delay_seconds': 0.05,
+                                                   'headroom_calls': 0, 'max_ratio': 1.0})
+
+
+def test_async_loser_task_is_cancelled(limiter):
+    hedger = make_hedger()
+    primary_cancelled = asyncio.Event()
+
+    async def primary(token):
+        await limiter.acquire_async('gemini', cancel_token=token)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            primary_cancelled.set()
+            raise
+
+    async def backup(token):
+        await limiter.acquire_async('perplexity', cancel_token=token)
+        return {'ok': True}
+
+    async def race():
+        result = await hedger.run_async(primary, backup, lambda r: r.get('ok'))
+        await asyncio.wait_for(primary_cancelled.wait(), 1)
+        return result
+
+    assert asyncio.run(race()) == {'ok': True}
+    stats = hedger.stats()
+    assert stats['backup_wins'] == 1
+    assert stats['wasted_calls'] == {'gemini': 1, 'perplexity': 0}
+    # A request cut short is not a latency sample
+    assert 'gemini' not in stats['latency']
+
+
+def test_loser_waiting_for_quota_hands_its_reservation_back(limiter):
+    hedger = make_hedger()
+    backup_started = threading.Event()
+    release_primary = threading.Event()
+
+    def primary(token):
+        backup_started.wait(1)
+        release_primary.wait(0.2)
+        return {'ok': True}
+
+    def backup(token):
+        # Someone else empties the bucket, so this waits for quota until the primary wins
+        for _ in range(3):
+            limiter.reserve('perplexity')
+        backup_started.set()
+        limiter.acquire('perplexity', cancel_token=token)
+        return {'ok': False}
+
+    assert hedger.run(primary, backup, lambda r: r.get('ok')) == {'ok': True}
+    for _ in range(100):
+        if limiter.stats()['perplexity']['refunds']:
+            break
+        threading.Event().wait(0.05)
+    assert limiter.stats()['perplexity']['refunds'] == 1
+    assert hedger.stats()['wasted_calls']['perplexity'] == 0
@@ -0,0 +1,98 @@
+import pytest
+
+from services import rate_limiter
+from services.cancellation import CancellationToken, Cancelled
+from services.rate_limiter import MemoryBucketStore, RateLimiter, RedisBucketStore
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, 'time', fake.time)
+    return fake
+
+
+def most_in_any_minute(times):
+    times = sorted(times)
+    return max(sum(1 for t in times if start <= t < start + 60) for start in times)
+
+
+def test_first_minute_stays_within_rpm(clock):
+    limiter = RateLimiter(MemoryBucketStore(), {'gemini': {'rpm': 15, 'burst': 3}})
+    ready = [limiter.reserve('gemini').ready_at for _ in range(40)]
+
+    assert ready[:3] == [clock.now] * 3  # the burst goes out at once
+    assert sum(1 for t in ready if t < clock.now + 60) <= 15
+    assert most_in_any_minute(ready) <= 15
+
+
+def test_refill_after_idle_does_not_exceed_rpm(clock):
+    limiter = RateLimiter(MemoryBucketStore(), {'gemini': {'rpm': 15, 'burst': 3}})
+    ready = []
+    for _ in range(10):
+        ready.append(limiter.reserve('gemini').ready_at)
+    clock.now += 30
+    for _ in range(30):
+        ready.append(limiter.reserve('gemini').ready_at)
+    assert most_in_any_minute(ready) <= 15
+
+
+def test_burst_is_capped_at_half_the_limit(clock):
+    limiter = RateLimiter(MemoryBucketStore(), {'huggingface': {'rpm': 4, 'burst': 10}})
+    ready = [limiter.reserve('huggingface').ready_at for _ in range(12)]
+    assert ready[:2] == [clock.now] * 2
+    assert ready[2] > clock.now
+    assert most_in_any_minute(ready) <= 4
+
+
+def test_cancelled_reservation_is_refunded(clock):
+    limiter = RateLimiter(MemoryBucketStore(), {'gemini': {'rpm': 15, 'burst': 3}})
+    for _ in range(3):
+        limiter.reserve('gemini')
+    queued = limiter.reserve('gemini')
+    assert queued.delay() > 0
+    assert queued.cancel()
+    assert limiter.reserve('gemini').ready_at == queued.ready_at
+
+
+def test_available_counts_only_tokens_on_hand(clock):
+    limiter = RateLimiter(MemoryBucketStore(), {'gemini': {'rpm': 15, 'burst': 3}})
+    assert limiter.available('gemini') == pytest.approx(3)
+    assert limiter.capacity('gemini') == pytest.approx(3)
+    for _ in range(3):
+        limiter.reserve('gemini')
+    assert limiter.available('gemini') == pytest.approx(0)
+    clock.now += 5
+    assert limiter.available('gemini') == pytest.approx(1)
+
+
+def test_declined_background_call_reserves_nothing(clock):
+    limiter = RateLimiter(MemoryBucketStore(), {'gemini': {'rpm': 15, 'burst': 3}})
+    asked = []
+    token = CancellationToken(admit=lambda provider: asked.append(provider) or limiter.available(provider) >= 3)
+    limiter.acquire('gemini', cancel_token=CancellationToken(parent=token))
+    with pytest.raises(Cancelled):
+        limiter.acquire('gemini', cancel_token=token)
+    assert asked == ['gemini', 'gemini']
+    assert token.cancelled
+    assert limiter.available('gemini') == pytest.approx(2)
+
+
+def test_redis_store_leaves_time_to_the_server():
+    calls = []
+
+    class FakeRedis:
+        def register_script(self, script):
+            assert "redis.call('TIME')" in script
+            return lambda keys, args: calls.append(args) or '1'
+
+    RedisBucketStore(FakeRedis()).take('gemini:rpm', 3, 0.2, 1, now=12345.0)
+    assert calls == [[3, 0.2, 1]]
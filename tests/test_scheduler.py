@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from services import scheduler as scheduler_module
+from services.scheduler import FairScheduler, QueueFull, QuotaExceeded
+
+
+def spawn(target):
+    threading.Thread(target=target, daemon=True).start()
+
+
+def make_scheduler(**kwargs):
+    kwargs.setdefault('workers', 1)
+    return FairScheduler(spawn=spawn, estimate_job_seconds=lambda: 1.0, **kwargs)
+
+
+def run_all(scheduler, jobs):
+    """Submit (session, name) jobs before any worker starts, then return the order they ran in."""
+    ran = []
+    done = threading.Event()
+    for session_id, name in jobs:
+        def run(name=name):
+            ran.append(name)
+            if len(ran) == len(jobs):
+                done.set()
+        scheduler.submit(session_id, run)
+    scheduler.start()
+    assert done.wait(5)
+    return ran
+
+
+def test_sessions_are_interleaved(monkeypatch):
+    monkeypatch.setattr(scheduler_module.Config, 'SCHEDULER_MAX_PENDING_PER_SESSION', 5)
+    order = run_all(make_scheduler(), [('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1'), ('b', 'b2')])
+    assert order == ['a1', 'b1', 'a2', 'b2', 'a3']
+
+
+def test_per_session_state_is_released_when_jobs_finish():
+    scheduler = make_scheduler()
+    run_all(scheduler, [('a', 'a1'), ('b', 'b1')])
+    # The worker releases a job right after running it
+    for _ in range(100):
+        with scheduler._lock:
+            if not scheduler._session_pending and not scheduler._running:
+                break
+        threading.Event().wait(0.01)
+    assert scheduler._session_pending == {}
+    assert scheduler._last_finish == {}
+
+
+def test_forget_session_drops_quota_history():
+    scheduler = make_scheduler()
+    scheduler.submit('a', lambda: None)
+    scheduler.forget_session('a')
+    assert 'a' not in scheduler._session_submits
+    # Queued work is not touched
+    assert scheduler.stats()['queued'] == 1
+
+
+def test_old_submit_times_are_swept(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(scheduler_module.time, 'time', lambda: clock[0])
+    scheduler = make_scheduler()
+    job = scheduler.submit('a', lambda: None)
+    scheduler.cancel(job)
+    clock[0] += 120
+    scheduler.submit('b', lambda: None)
+    assert list(scheduler._session_submits) == ['b']
+
+
+def test_cancel_releases_the_session_share():
+    scheduler = make_scheduler()
+    first = scheduler.submit('a', lambda: None)
+    scheduler.submit('a', lambda: None)
+    with pytest.raises(QuotaExceeded):
+        scheduler.submit('a', lambda: None)
+    assert scheduler.cancel(first)
+    assert not scheduler.cancel(first)
+    scheduler.submit('a', lambda: None)
+
+
+def test_full_queue_rejects_with_retry_hint():
+    scheduler = make_scheduler(max_depth=2)
+    scheduler.submit('a', lambda: None)
+    scheduler.submit('b', lambda: None)
+    with pytest.raises(QueueFull) as rejected:
+        scheduler.submit('c', lambda: None)
+    assert rejected.value.retry_after > 0
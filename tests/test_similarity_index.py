@@ -0,0 +1,78 @@
+import pytest
+
+from services.cache_service import MemoryTier, TieredCache, normalize_question
+from services.similarity_index import MinHashLSHIndex, exact_tokens
+
+
+def build_index(*questions, **kwargs):
+    index = MinHashLSHIndex(threshold=0.6, **kwargs)
+    for question in questions:
+        index.add(normalize_question(question))
+    return index
+
+
+@pytest.mark.parametrize('cached, asked', [
+    ('causes of world war 1', 'causes of world war 2'),
+    ('what is a mammal', 'what is not a mammal'),
+    ('what is 3+2', 'what is 2 3'),
+    ('photosynthesis', 'photosynthesis without light'),
+])
+def test_numbers_and_negations_must_match(cached, asked):
+    assert build_index(cached).query(asked) == []
+
+
+@pytest.mark.parametrize('cached, asked', [
+    ('how does rain form', 'explain the rain cycle'),
+    ('how do clouds form?', 'How do clouds form'),
+    ('what causes world war 2', 'causes of world war 2'),
+])
+def test_rephrasings_match(cached, asked):
+    matches = build_index(cached).query(asked)
+    assert [key for key, _ in matches] == [normalize_question(cached)]
+    assert matches[0][1] >= 0.6
+
+
+def test_unrelated_topic_does_not_match():
+    assert build_index('how does rain form').query('what is rain') == []
+
+
+def test_exact_tokens_keep_order():
+    assert exact_tokens("Why isn't 2 bigger than 3?") == ('isn', 't', '2', '3')
+
+
+def test_query_ranks_candidates_and_limits():
+    index = build_index('how do clouds form', 'how does a cloud form in the sky', max_candidates=1)
+    assert [key for key, _ in index.query('how do clouds form')] == ['how do clouds form']
+    assert len(index.query('how do clouds form', limit=5)) == 2
+
+
+def test_remove_forgets_key():
+    index = build_index('how does rain form')
+    assert index.remove('how does rain form')
+    assert not index.remove('how does rain form')
+    assert index.query('explain the rain cycle') == []
+    assert index.stats()['indexed'] == 0
+
+
+def test_removals_survive_reload(tmp_path):
+    path = str(tmp_path / 'index.jsonl')
+    index = build_index('how does rain form', 'how do volcanoes erupt', persist_path=path)
+    index.remove('how does rain form')
+
+    reloaded = MinHashLSHIndex(threshold=0.6, persist_path=path)
+    assert reloaded.query('explain the rain cycle') == []
+    assert [key for key, _ in reloaded.query('how do volcanoes erupt')] == ['how do volcanoes erupt']
+    # The log is compacted to the live entries on load
+    with open(path, encoding='utf-8') as f:
+        assert len(f.readlines()) == 1
+
+
+def test_eviction_listener_reports_lru_and_expired_keys():
+    cache = TieredCache('plan', [MemoryTier(max_entries=1)])
+    evicted = []
+    cache.add_eviction_listener(evicted.append)
+    cache.set('first', {'a': 1})
+    cache.set('second', {'a': 2})
+    cache.set('stale', {'a': 3}, ttl=-1)
+    cache.get('stale')
+    assert evicted == ['first', 'second', 'stale']